@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+"""
+End-to-end benchmark of qp_create and qp_make on stub Hugin executables.
+
+Run from the repository root, for example:
+
+    PYTHONPATH=src python benchmarks/e2e.py -j 1 2 4 8 -o e2e.json
+
+A project directory with EXIF-tagged JPEGs is generated, the stubs from
+hugin_stub.py are put on $PATH, and both commands are run once for every
+number of jobs. Reported are the wall times, the throughput in image pairs
+per second, and the scaling efficiency relative to the first number of
+jobs. As the stubs take a fixed time, anything above that is orchestration
+overhead of QuickyPano itself. No Hugin installation is needed.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import os.path
+import platform
+import shlex
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import PIL.Image
+
+import quickypano.huginpto
+import quickypano.settings
+
+import hugin_stub
+
+log = logging.getLogger(__name__)
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+def exif_block(exposure_time: (int, int), fnumber: (int, int), iso: int) -> bytes:
+    """Returns an APP1 segment with a little-endian EXIF block."""
+
+    def entry(tag, ftype, count, value):
+        return struct.pack('<HHL', tag, ftype, count) + value
+
+    # TIFF header, IFD0 at offset 8 with one entry: the Exif IFD pointer.
+    exif_ifd_offset = 8 + 2 + 12 + 4
+    ifd0 = struct.pack('<H', 1) + entry(0x8769, 4, 1, struct.pack('<L', exif_ifd_offset))
+    ifd0 += struct.pack('<L', 0)
+
+    # Exif IFD with three entries, followed by the two rationals.
+    rationals_offset = exif_ifd_offset + 2 + 3 * 12 + 4
+    exif_ifd = struct.pack('<H', 3)
+    exif_ifd += entry(0x829a, 5, 1, struct.pack('<L', rationals_offset))
+    exif_ifd += entry(0x829d, 5, 1, struct.pack('<L', rationals_offset + 8))
+    exif_ifd += entry(0x8827, 3, 1, struct.pack('<HH', iso, 0))
+    exif_ifd += struct.pack('<L', 0)
+    rationals = struct.pack('<LLLL', *(exposure_time + fnumber))
+
+    tiff = b'II' + struct.pack('<HL', 42, 8) + ifd0 + exif_ifd + rationals
+    payload = b'Exif\0\0' + tiff
+    return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+
+def write_jpeg(filename: str, idx: int, size: (int, int)):
+    """Writes a JPEG with EXIF, bracketed in stacks of three exposures."""
+
+    img = PIL.Image.new('RGB', size, ((37 * idx) % 256, (91 * idx) % 256, (13 * idx) % 256))
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=75)
+    data = buffer.getvalue()
+
+    exposure_time = [(1, 250), (1, 60), (1, 15)][idx % 3]
+    with open(filename, 'wb') as outfile:
+        # Insert the APP1 segment right after the Start Of Image marker.
+        outfile.write(data[:2] + exif_block(exposure_time, (56, 10), 200) + data[2:])
+
+
+def make_project_dir(dirname: str, stack_size: int, size: (int, int)) -> int:
+    """Writes the JPEGs for a full panorama, returns the number of images."""
+
+    sett = quickypano.settings.DEFAULT_SETTINGS()
+    nr_of_images = sett.next_offset(sett.ORDER[-1]) * stack_size
+
+    jpeg_dir = os.path.join(dirname, 'jpeg')
+    os.makedirs(jpeg_dir)
+    for idx in range(nr_of_images):
+        write_jpeg(os.path.join(jpeg_dir, 'IMG_%04i.jpg' % idx), idx, size)
+    return nr_of_images
+
+
+def clean_project_dir(dirname: str):
+    """Removes everything but the JPEGs, so that every run starts from scratch."""
+
+    for fname in os.listdir(dirname):
+        if fname == 'jpeg':
+            continue
+        path = os.path.join(dirname, fname)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+
+
+def timed_run(cmd, cwd, env) -> float:
+    log.debug('Running %s', ' '.join(cmd))
+    start = time.perf_counter()
+    subprocess.check_call(cmd, cwd=cwd, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='Numbers of jobs to run with (default: %(default)s)')
+    parser.add_argument('-o', '--output', metavar='FILE', type=str, default=None,
+                        help='Write the results to this JSON file instead of stdout')
+    parser.add_argument('--stack-size', type=int, choices=[1, 3, 5, 7], default=3,
+                        help='Number of exposures per stack (default: %(default)s)')
+    parser.add_argument('--image-size', metavar='WxH', type=str, default='600x400',
+                        help='Pixel size of the generated JPEGs (default: %(default)s)')
+    parser.add_argument('--cpfind-latency', metavar='SECONDS', type=float, default=0.5,
+                        help='Time each cpfind run takes (default: %(default)s)')
+    parser.add_argument('--make-latency', metavar='SECONDS', type=float, default=0.2,
+                        help='Time of each remapping job of make (default: %(default)s)')
+    parser.add_argument('--latency', metavar='SECONDS', type=float, default=0.05,
+                        help='Time the other tools take (default: %(default)s)')
+    parser.add_argument('--busy', action='store_true', default=False,
+                        help='Let the stubs burn CPU instead of sleeping')
+    parser.add_argument('--control-points', metavar='N', type=int, default=10,
+                        help='Control points per image pair (default: %(default)s)')
+    parser.add_argument('--create-args', metavar='ARGS', type=str, default='',
+                        help='Extra arguments for qp_create, like "--async"')
+    args = parser.parse_args()
+
+    if sys.platform == 'win32':
+        raise SystemExit('The stub executables are shell scripts, and need a POSIX system.')
+
+    size = tuple(int(part) for part in args.image_size.lower().split('x'))
+
+    with tempfile.TemporaryDirectory(prefix='quickypano-e2e-') as tmpdir:
+        bindir = os.path.join(tmpdir, 'bin')
+        hugin_stub.make_bindir(bindir)
+
+        project_dir = os.path.join(tmpdir, 'project')
+        nr_of_images = make_project_dir(project_dir, args.stack_size, size)
+        log.info('Generated %i images in stacks of %i', nr_of_images, args.stack_size)
+
+        env = dict(os.environ)
+        env.update({
+            'PATH': bindir + os.pathsep + env.get('PATH', ''),
+            'PYTHONPATH': SRC_DIR + os.pathsep + env.get('PYTHONPATH', ''),
+            'XDG_CACHE_HOME': os.path.join(tmpdir, 'cache'),
+            'QP_STUB_LATENCY': str(args.latency),
+            'QP_STUB_CPFIND_LATENCY': str(args.cpfind_latency),
+            'QP_STUB_MAKE_LATENCY': str(args.make_latency),
+            'QP_STUB_BUSY': '1' if args.busy else '0',
+            'QP_STUB_CONTROL_POINTS': str(args.control_points),
+        })
+
+        runs = []
+        for jobs in args.jobs:
+            clean_project_dir(project_dir)
+
+            create_cmd = [sys.executable, '-m', 'quickypano_cli.create_project', 'out.pto',
+                          '-j', str(jobs), '--cores', str(jobs), '--no-cp-cache']
+            create_s = timed_run(create_cmd + shlex.split(args.create_args), project_dir, env)
+
+            make_cmd = [sys.executable, '-m', 'quickypano_cli.make', '-f', 'out.pto',
+                        '--jobs', str(jobs), '--cores', str(jobs), '--no-render-cache']
+            make_s = timed_run(make_cmd, project_dir, env)
+
+            with quickypano.huginpto.HuginPto(os.path.join(project_dir, 'out.pto'),
+                                              lazy=True) as pto:
+                nr_of_pairs = len(pto.control_points.pairs())
+                nr_of_cps = len(pto.control_points)
+
+            run = {
+                'jobs': jobs,
+                'qp_create_s': create_s,
+                'qp_make_s': make_s,
+                'pairs': nr_of_pairs,
+                'control_points': nr_of_cps,
+                'pairs_per_s': nr_of_pairs / create_s,
+            }
+            base = runs[0] if runs else run
+            for cmd in ('qp_create', 'qp_make'):
+                speedup = base['%s_s' % cmd] / run['%s_s' % cmd]
+                run['%s_speedup' % cmd] = speedup
+                run['%s_efficiency' % cmd] = speedup * base['jobs'] / jobs
+            runs.append(run)
+
+            log.info('%3i jobs: qp_create %7.2f s (%6.2f pairs/s, efficiency %3.0f%%), '
+                     'qp_make %6.2f s (efficiency %3.0f%%)',
+                     jobs, create_s, run['pairs_per_s'], 100 * run['qp_create_efficiency'],
+                     make_s, 100 * run['qp_make_efficiency'])
+
+    report = {
+        'python': sys.version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'images': nr_of_images,
+        'stack_size': args.stack_size,
+        'cpfind_latency_s': args.cpfind_latency,
+        'make_latency_s': args.make_latency,
+        'latency_s': args.latency,
+        'busy': args.busy,
+        'create_args': args.create_args,
+        'runs': runs,
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as outfile:
+            json.dump(report, outfile, indent=2)
+        log.info('Wrote %i runs to %s', len(runs), args.output)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
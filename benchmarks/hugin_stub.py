@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+
+"""
+Stand-ins for the Hugin executables, for benchmarking without Hugin.
+
+Usage: hugin_stub.py TOOL [ARGS...], or through the wrappers that
+make_bindir() writes. The stubs understand the arguments QuickyPano passes,
+write plausible output, and take a configurable amount of time:
+
+QP_STUB_LATENCY
+    Default number of seconds each tool takes, default 0.
+QP_STUB_<TOOL>_LATENCY
+    Latency of one tool, like QP_STUB_CPFIND_LATENCY. For make it is the
+    time of a single remapping job, see make().
+QP_STUB_BUSY
+    When set to 1, burn CPU instead of sleeping.
+QP_STUB_CONTROL_POINTS
+    Number of control points cpfind finds for each pair of images, default 10.
+
+Only POSIX systems are supported, as the wrappers are shell scripts.
+"""
+
+import math
+import os
+import os.path
+import random
+import re
+import shutil
+import stat
+import sys
+import time
+
+TOOLS = ('cpfind', 'pto_var', 'pto2mk', 'make', 'hugin_stitch_project',
+         'nona', 'enblend', 'enfuse')
+
+_image_re = re.compile(r'(?:^|\s)([whvy])(\S*)')
+_name_re = re.compile(r'n"([^"]*)"')
+
+
+def latency(tool: str) -> float:
+    value = os.environ.get('QP_STUB_%s_LATENCY' % tool.upper(),
+                           os.environ.get('QP_STUB_LATENCY', '0'))
+    return float(value)
+
+
+def spend(seconds: float):
+    """Sleeps or burns CPU for the given time."""
+
+    if seconds <= 0:
+        return
+    if os.environ.get('QP_STUB_BUSY') != '1':
+        time.sleep(seconds)
+        return
+
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def option(args, name, default=None):
+    """Returns the value following an option, like '-o' in ['-o', 'out.pto']."""
+
+    try:
+        return args[args.index(name) + 1]
+    except (ValueError, IndexError):
+        return default
+
+
+def read_images(pto_filename) -> [dict]:
+    """Returns the w, h, v, y and n of the 'i' lines, as strings."""
+
+    images = []
+    with open(pto_filename, 'r', encoding='utf-8') as infile:
+        for line in infile:
+            if not line.startswith('i '):
+                continue
+            params = dict(_image_re.findall(line[2:_name_re.search(line).start()]))
+            params['n'] = _name_re.search(line).group(1)
+            images.append(params)
+    return images
+
+
+def touch(filename):
+    with open(filename, 'ab'):
+        pass
+
+
+def cpfind(args):
+    if '--version' in args:
+        print('Hugin\'s cpfind stub')
+        return
+
+    spend(latency('cpfind'))
+    input_filename = args[0]
+    images = read_images(input_filename)
+
+    if '--kall' in args:
+        keypath = option(args, '--keypath', os.path.dirname(input_filename))
+        for image in images:
+            basename = os.path.splitext(os.path.basename(image['n']))[0]
+            touch(os.path.join(keypath, basename + '.key'))
+        return
+
+    nr_of_cps = int(os.environ.get('QP_STUB_CONTROL_POINTS', '10'))
+    rnd = random.Random(input_filename)
+    shutil.copyfile(input_filename, option(args, '-o'))
+    with open(option(args, '-o'), 'a', encoding='utf-8') as outfile:
+        for idx_0 in range(len(images)):
+            w0, h0 = float(images[idx_0]['w']), float(images[idx_0]['h'])
+            for idx_1 in range(idx_0 + 1, len(images)):
+                w1, h1 = float(images[idx_1]['w']), float(images[idx_1]['h'])
+                for _ in range(nr_of_cps):
+                    print('c n%i N%i x%.4f y%.4f X%.4f Y%.4f t0' % (
+                        idx_0, idx_1, rnd.uniform(0, w0), rnd.uniform(0, h0),
+                        rnd.uniform(0, w1), rnd.uniform(0, h1)), file=outfile)
+
+
+def pto_var(args):
+    spend(latency('pto_var'))
+    shutil.copyfile(args[0], option(args, '-o'))
+
+
+def stacks(images) -> [[int]]:
+    """Groups images into stacks, by their yaw being linked to the anchor."""
+
+    groups = {}
+    for idx, image in enumerate(images):
+        anchor = int(image['y'][1:]) if image['y'].startswith('=') else idx
+        groups.setdefault(anchor, []).append(idx)
+    return [groups[anchor] for anchor in sorted(groups)]
+
+
+def pto2mk(args):
+    """Writes a makefile with the structure of the ones pto2mk writes."""
+
+    spend(latency('pto2mk'))
+    pto_filename = args[-1]
+    prefix = option(args, '-p')
+    images = read_images(pto_filename)
+    with open(pto_filename, 'r', encoding='utf-8') as infile:
+        pto_text = infile.read()
+    fused = '#hugin_outputLDRExposureBlended true' in pto_text
+    compression = re.search(r'^#hugin_outputImageTypeCompression (\S+)', pto_text, re.M)
+    compression = compression.group(1) if compression else 'LZW'
+    nona_comp = '' if compression == 'NONE' else '-z ' + compression
+    enblend_comp = '' if compression == 'NONE' else '--compression=' + compression
+
+    # Like Hugin, blend onto the crop region, and only wrap around when
+    # rendering the full 360 degrees.
+    panorama = dict(_image_re.findall(re.search(r'^p (.*)$', pto_text, re.M).group(1)))
+    crop = re.search(r'(?:^p |\s)S(\d+),(\d+),(\d+),(\d+)', pto_text, re.M)
+    enblend_opts = ''
+    if crop:
+        left, right, top, bottom = (int(value) for value in crop.groups())
+        enblend_opts = ' -f%ix%i+%i+%i' % (right - left, bottom - top, left, top)
+    if panorama.get('v') == '360' and not (crop and (left, right) != (0, int(panorama['w']))):
+        enblend_opts = ' -w' + enblend_opts
+
+    def var(name, value):
+        return '%s=%s\n%s_SHELL=%s\n' % (name, value, name, value)
+
+    lines = ['# makefile for panorama stitching, created by the QuickyPano pto2mk stub\n',
+             '\n# Tool configuration\n',
+             'NONA=nona\nENBLEND=enblend\nENFUSE=enfuse\nRM=rm\n',
+             '\n# options for the programs\n',
+             'NONA_LDR_REMAPPED_COMP=%s\nNONA_OPTS=\n' % nona_comp,
+             'ENBLEND_OPTS=%s\nENBLEND_LDR_COMP=%s\n' % (enblend_opts, enblend_comp),
+             'ENFUSE_OPTS=\n',
+             '\n# the output panorama\n',
+             var('PROJECT_FILE', pto_filename),
+             var('LDR_REMAPPED_PREFIX', prefix),
+             var('LDR_BLENDED', prefix + '.tif'),
+             var('LDR_EXPOSURE_REMAPPED_PREFIX', prefix + '_exposure_layers_'),
+             var('LDR_STACKED_BLENDED', prefix + '_blended_fused.tif')]
+
+    remapped = ['%s%04i.tif' % (prefix, idx) for idx in range(len(images))]
+    exposure_layers = ['%s_exposure_layers_%04i.tif' % (prefix, idx)
+                       for idx in range(len(images))]
+    stack_outputs = ['%s_stack_ldr_%04i.tif' % (prefix, idx)
+                     for idx in range(len(stacks(images)))]
+
+    lines += ['\n# remapped images\n',
+              var('LDR_LAYERS', '\\\n'.join(remapped)),
+              '\n# remapped images for exposure fusion\n',
+              var('LDR_EXPOSURE_LAYERS', '\\\n'.join(exposure_layers)),
+              '\n# stacked images\n',
+              var('LDR_STACKS', '\\\n'.join(stack_outputs))]
+    for stack_idx, stack in enumerate(stacks(images)):
+        lines.append(var('LDR_STACK_%i' % stack_idx,
+                         ' '.join(exposure_layers[idx] for idx in stack)))
+
+    target = '$(LDR_STACKED_BLENDED)' if fused else '$(LDR_BLENDED)'
+    lines += ['\nTARGETS=%s\n' % target,
+              '\nifeq ($(words $(LDR_LAYERS)),0)\n',
+              'TARGETS=\n',
+              'endif\n',
+              '\n# Rules\n',
+              'all : startStitching $(TARGETS)\n\n',
+              'startStitching :\n',
+              "\t@echo 'Stitching panorama'\n\n",
+              'clean :\n',
+              '\t-$(RM) $(LDR_LAYERS_SHELL) $(LDR_EXPOSURE_LAYERS_SHELL) $(LDR_STACKS_SHELL)\n\n']
+
+    for idx, image in enumerate(images):
+        lines.append('%s : %s $(PROJECT_FILE)\n' % (remapped[idx], image['n']))
+        lines.append('\t$(NONA) $(NONA_OPTS) $(NONA_LDR_REMAPPED_COMP) -r ldr -m TIFF_m '
+                     '-o $(LDR_REMAPPED_PREFIX_SHELL) -i %i $(PROJECT_FILE_SHELL)\n\n' % idx)
+        lines.append('%s : %s $(PROJECT_FILE)\n' % (exposure_layers[idx], image['n']))
+        lines.append('\t$(NONA) $(NONA_OPTS) $(NONA_LDR_REMAPPED_COMP) -r ldr -e -m TIFF_m '
+                     '-o $(LDR_EXPOSURE_REMAPPED_PREFIX_SHELL) -i %i '
+                     '$(PROJECT_FILE_SHELL)\n\n' % idx)
+
+    for stack_idx in range(len(stack_outputs)):
+        lines.append('%s : $(LDR_STACK_%i)\n' % (stack_outputs[stack_idx], stack_idx))
+        lines.append('\t$(ENFUSE) $(ENFUSE_OPTS) -o %s -- $(LDR_STACK_%i_SHELL)\n\n' % (
+            stack_outputs[stack_idx], stack_idx))
+
+    lines += ['$(LDR_BLENDED) : $(LDR_LAYERS)\n',
+              '\t$(ENBLEND) $(ENBLEND_LDR_COMP) $(ENBLEND_OPTS) -o $(LDR_BLENDED_SHELL) '
+              '-- $(LDR_LAYERS_SHELL)\n\n',
+              '$(LDR_STACKED_BLENDED) : $(LDR_STACKS)\n',
+              '\t$(ENBLEND) $(ENBLEND_LDR_COMP) $(ENBLEND_OPTS) -o $(LDR_STACKED_BLENDED_SHELL) '
+              '-- $(LDR_STACKS_SHELL)\n\n']
+
+    with open(option(args, '-o'), 'w', encoding='utf-8') as outfile:
+        outfile.writelines(lines)
+
+
+def make(args):
+    """Simulates make running a stub makefile, without running any commands.
+
+    Takes ceil(images / jobs) times the make latency for remapping, plus the
+    same again for blending.
+    """
+
+    makefile = option(args, '-f')
+    jobs = 1
+    for arg in args:
+        if arg.startswith('-j') and arg[2:].isdigit():
+            jobs = int(arg[2:])
+
+    pto_filename = makefile[:-len('.mk')] if makefile.endswith('.mk') else makefile
+    nr_of_images = len(read_images(pto_filename)) if os.path.exists(pto_filename) else 1
+    spend(latency('make') * (math.ceil(nr_of_images / jobs) + 1))
+
+
+def hugin_stitch_project(args):
+    spend(latency('hugin_stitch_project'))
+    touch(option(args, '-o') + '.tif')
+
+
+def nona(args):
+    spend(latency('nona'))
+    touch('%s%04i.tif' % (option(args, '-o'), int(option(args, '-i', '0'))))
+
+
+def write_output(args):
+    """Writes a TIFF of the size given with -f, or an empty file without -f."""
+
+    size = [arg[2:] for arg in args if arg.startswith('-f')]
+    if not size:
+        touch(option(args, '-o'))
+        return
+
+    import PIL.Image
+
+    width, height, left, top = (int(value) for value in re.findall(r'\d+', size[0] + '+0+0')[:4])
+    img = PIL.Image.new('RGB', (width, height))
+    # A gradient over the whole canvas, so that misplaced tiles stand out.
+    img.putdata([((left + x) % 256, (top + y) % 256, 128)
+                 for y in range(height) for x in range(width)])
+    compression = [arg.split('=', 1)[1] for arg in args if arg.startswith('--compression=')]
+    img.save(option(args, '-o'), compression='tiff_lzw' if compression == ['LZW'] else None)
+
+
+def enblend(args):
+    spend(latency('enblend'))
+    write_output(args)
+
+
+def enfuse(args):
+    spend(latency('enfuse'))
+    touch(option(args, '-o'))
+
+
+def make_bindir(dirname: str):
+    """Writes executables for all stub tools into the directory.
+
+    Put the directory on $PATH, so that quickypano.hugin.find_hugin() finds
+    them, or pass it to quickypano.hugin.set_hugin_bindir().
+    """
+
+    os.makedirs(dirname, exist_ok=True)
+    script = os.path.abspath(__file__)
+    for tool in TOOLS:
+        fname = os.path.join(dirname, tool)
+        with open(fname, 'w', encoding='utf-8') as outfile:
+            outfile.write('#!/bin/sh\nexec "%s" "%s" %s "$@"\n' % (sys.executable, script, tool))
+        os.chmod(fname, os.stat(fname).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def main():
+    tool, args = sys.argv[1], sys.argv[2:]
+    if tool not in TOOLS:
+        raise SystemExit('Unknown tool %r, choose from %s' % (tool, ', '.join(TOOLS)))
+    globals()[tool](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+"""
+Micro-benchmarks of PTO parsing, writing and project math.
+
+Run from the repository root, for example:
+
+    PYTHONPATH=src python benchmarks/micro.py -o results.json
+
+Results are written as JSON, one record per benchmark and scale.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import os.path
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import quickypano.hugin
+import quickypano.huginpto
+import quickypano.project
+import quickypano_cli.switch_source
+
+import synthetic
+
+log = logging.getLogger(__name__)
+
+# (number of images, number of control points)
+SCALES = [
+    (30, 1000),
+    (30, 10000),
+    (300, 10000),
+    (300, 100000),
+    (3000, 100000),
+    (3000, 1000000),
+]
+
+# Number of pairs get_slice() is timed on, per repetition.
+SLICE_PAIRS = 100
+
+
+def timeit(func, repeat: int) -> [float]:
+    """Returns the wall time in seconds of each call."""
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def benchmarks(project, pto_filename):
+    """Yields (name, number of calls per run, function) tuples for one scale."""
+
+    with open(pto_filename, 'r', encoding='utf-8') as infile:
+        pto_text = infile.read()
+
+    yield 'HuginPto._parse', 1, lambda: quickypano.huginpto.HuginPto(pto_filename)
+
+    def lazy_index():
+        with quickypano.huginpto.HuginPto(pto_filename, lazy=True) as pto:
+            pto.count('c')
+
+    yield 'HuginPto._index', 1, lazy_index
+
+    pto = quickypano.huginpto.HuginPto(pto_filename)
+    pairs = pto.get_available_correspondence_pairs()
+
+    def all_correspondences(method):
+        def run():
+            for image1, image2 in pairs:
+                method(image1, image2)
+        return run
+
+    yield ('HuginPto.get_correspondences', len(pairs),
+           all_correspondences(pto.get_correspondences))
+    yield ('HuginPto.get_correspondences_ndarray', len(pairs),
+           all_correspondences(pto.get_correspondences_ndarray))
+
+    def available_pairs():
+        # Rebuild the pair index too.
+        pto.control_points._pair_index = None
+        pto.get_available_correspondence_pairs()
+
+    yield 'HuginPto.get_available_correspondence_pairs', 1, available_pairs
+
+    yield 'hugin.write', 1, lambda: quickypano.hugin.write(io.StringIO(), project)
+    yield 'Project.set_variables', 1, project.set_variables
+
+    anchors = range(0, len(project.photos), project.stack_size)
+    slice_pairs = [(anchors[i % len(anchors)], anchors[(i + 1) % len(anchors)])
+                   for i in range(SLICE_PAIRS)]
+
+    def get_slices():
+        for indices in slice_pairs:
+            project.get_slice(indices)
+
+    yield 'Project.get_slice', len(slice_pairs), get_slices
+
+    def switch_sources():
+        quickypano_cli.switch_source.switch_sources(io.StringIO(pto_text), io.StringIO(),
+                                                    'TIFF')
+
+    yield 'switch_source.switch_sources', 1, switch_sources
+
+    snapshot_filename = pto_filename + '.qps'
+    yield 'Project.save', 1, lambda: project.save(snapshot_filename)
+    yield 'Project.load', 1, lambda: quickypano.project.Project.load(snapshot_filename)
+
+    loaded = quickypano.project.Project.load(snapshot_filename)
+    yield 'Project.save (loaded)', 1, lambda: loaded.save(snapshot_filename)
+
+
+def run_scale(nr_of_images, nr_of_control_points, repeat, tmpdir):
+    log.info('Generating project with %i images and %i control points',
+             nr_of_images, nr_of_control_points)
+    project = synthetic.make_project(nr_of_images, nr_of_control_points)
+    pto_filename = os.path.join(tmpdir, 'synthetic-%i-%i.pto' % (nr_of_images,
+                                                                 nr_of_control_points))
+    synthetic.write_pto(project, pto_filename)
+
+    results = []
+    for name, calls, func in benchmarks(project, pto_filename):
+        timings = timeit(func, repeat)
+        result = {
+            'benchmark': name,
+            'images': nr_of_images,
+            'control_points': nr_of_control_points,
+            'pto_bytes': os.path.getsize(pto_filename),
+            'repeat': repeat,
+            'calls_per_run': calls,
+            'min_s': min(timings),
+            'median_s': statistics.median(timings),
+            'max_s': max(timings),
+        }
+        if calls:
+            result['per_call_s'] = result['min_s'] / calls
+        log.info('%-45s %5i images %8i cps: %9.4f s', name, nr_of_images,
+                 nr_of_control_points, result['min_s'])
+        results.append(result)
+
+    os.unlink(pto_filename)
+    os.unlink(pto_filename + '.qps')
+    return results
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-o', '--output', metavar='FILE', type=str, default=None,
+                        help='Write the results to this JSON file instead of stdout')
+    parser.add_argument('-r', '--repeat', metavar='N', type=int, default=3,
+                        help='Number of runs per benchmark; the minimum is reported')
+    parser.add_argument('--max-control-points', metavar='N', type=int, default=None,
+                        help='Skip scales with more control points than this')
+    parser.add_argument('--max-images', metavar='N', type=int, default=None,
+                        help='Skip scales with more images than this')
+    args = parser.parse_args()
+
+    scales = [(images, cps) for images, cps in SCALES
+              if (args.max_images is None or images <= args.max_images) and
+              (args.max_control_points is None or cps <= args.max_control_points)]
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='quickypano-bench-') as tmpdir:
+        for nr_of_images, nr_of_control_points in scales:
+            results += run_scale(nr_of_images, nr_of_control_points, args.repeat, tmpdir)
+
+    report = {
+        'python': sys.version,
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as outfile:
+            json.dump(report, outfile, indent=2)
+        log.info('Wrote %i results to %s', len(results), args.output)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
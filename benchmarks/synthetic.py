@@ -0,0 +1,77 @@
+"""
+Synthetic QuickyPano projects for benchmarking.
+
+Projects are built from ImageMetadata directly, so no image files are needed.
+"""
+
+import random
+
+import quickypano.exif
+import quickypano.hugin
+import quickypano.project
+import quickypano.settings
+
+STACK_SIZE = 3
+IMAGE_WIDTH = 3456
+IMAGE_HEIGHT = 5184
+
+
+def settings_for(nr_of_stacks: int) -> quickypano.settings.AbstractSettings:
+    """Returns settings with three rows, sized to hold this many stacks."""
+
+    class SyntheticSettings(quickypano.settings.AbstractSettings):
+        ROW_DOWN = nr_of_stacks // 3
+        ROW_UP = nr_of_stacks // 3
+        ROW_MIDDLE = nr_of_stacks - 2 * (nr_of_stacks // 3)
+
+        ORDER = ['MIDDLE', 'DOWN', 'UP']
+
+        VERTICAL_FOV = quickypano.settings.SybrenLX100.VERTICAL_FOV
+
+    return SyntheticSettings()
+
+
+def metadata(idx: int) -> quickypano.exif.ImageMetadata:
+    # Bracketed exposures of -2, 0 and +2 EV.
+    exposure_time = (1, 250) if idx % 3 == 0 else (1, 60) if idx % 3 == 1 else (1, 15)
+    return quickypano.exif.ImageMetadata(
+        width=IMAGE_WIDTH, height=IMAGE_HEIGHT, fnumber=(56, 10), exposure_time=exposure_time,
+        shutter_speed=None, aperture=None, iso=200, exposure_bias=(2 * (idx % 3) - 2, 1))
+
+
+def make_project(nr_of_images: int, nr_of_control_points: int=0,
+                 seed: int=0) -> quickypano.project.Project:
+    """Returns a project with HDR stacks of three images, with variables set.
+
+    Control points connect random pairs of stack anchors that are at most
+    four stacks apart, like neighbours in a row.
+    """
+
+    if nr_of_images % STACK_SIZE:
+        raise ValueError('Number of images should be a multiple of %i' % STACK_SIZE)
+
+    project = quickypano.project.Project()
+    project.stack_size = STACK_SIZE
+    project.settings = settings_for(nr_of_images // STACK_SIZE)
+    project.hugin_filename = 'synthetic.pto'
+    project.photos = [quickypano.project.Image('jpeg/IMG_%05i.jpg' % idx, metadata(idx))
+                      for idx in range(nr_of_images)]
+    project.set_variables()
+
+    rnd = random.Random(seed)
+    nr_of_stacks = nr_of_images // STACK_SIZE
+    for _ in range(nr_of_control_points):
+        stack_0 = rnd.randrange(nr_of_stacks)
+        stack_1 = (stack_0 + rnd.randint(1, 4)) % nr_of_stacks
+        idx_0, idx_1 = sorted((STACK_SIZE * stack_0, STACK_SIZE * stack_1))
+        project.control_points.append('c n%i N%i x%.4f y%.4f X%.4f Y%.4f t0' % (
+            idx_0, idx_1,
+            rnd.uniform(0, IMAGE_WIDTH), rnd.uniform(0, IMAGE_HEIGHT),
+            rnd.uniform(0, IMAGE_WIDTH), rnd.uniform(0, IMAGE_HEIGHT)))
+
+    return project
+
+
+def write_pto(project: quickypano.project.Project, filename: str):
+    with open(filename, 'w', encoding='utf-8') as outfile:
+        quickypano.hugin.write(outfile, project)
@@ -44,8 +44,10 @@ setup(
         "Operating System :: Microsoft :: Windows",
         "Programming Language :: Python",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.5",
-        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
+        "Programming Language :: Python :: 3.12",
         "Programming Language :: Python :: Implementation :: CPython",
         "Programming Language :: Python :: Implementation :: PyPy",
         "Topic :: Utilities",
@@ -53,6 +55,7 @@ setup(
     # keywords=[
     #     # eg: "keyword1", "keyword2", "keyword3",
     # ],
+    python_requires=">=3.9",
     install_requires=[
         read('requirements.txt').strip().split('\n')  # eg: "aspectlib==1.1.1", "six>=1.7",
     ],
@@ -66,6 +69,7 @@ setup(
             "qp_switch = quickypano_cli.switch_source:main",
             "qp_pto2mk = quickypano_cli.pto2mk:main",
             "qp_make = quickypano_cli.make:main",
+            "qp_batch = quickypano_cli.batch:main",
             "qp_exif = quickypano_cli.set_exif:main",
             "qp_panoexif = quickypano_cli.panoexif:main",
         ]
@@ -0,0 +1,208 @@
+"""
+Content-addressed on-disk caches with size-based LRU eviction.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import os.path
+import shutil
+import sys
+import threading
+
+log = logging.getLogger(__name__)
+
+
+def file_digest(filename: str) -> str:
+    """Returns the SHA-1 hex digest of the file's contents."""
+
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as infile:
+        for block in iter(lambda: infile.read(2 ** 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_key(*parts) -> str:
+    """Returns a cache key for JSON-serialisable parts."""
+
+    data = json.dumps(parts, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def default_cache_dir(name: str) -> str:
+    """Returns the per-user cache directory for QuickyPano's cache of this name."""
+
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~/AppData/Local')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'quickypano', name)
+
+
+class DirectoryCache:
+    """Stores cache entries as files in a directory.
+
+    Reading an entry updates its mtime, and when the total size exceeds the
+    limit the least recently used entries are removed.
+
+    The mtimes and sizes of the entries are read from disk once, and from then
+    on kept up to date in memory, so storing an entry doesn't walk the cache.
+    """
+
+    def __init__(self, root: str, max_size: int):
+        self.root = root
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._index = None  # {path: (mtime, size)}, see _load_index()
+        self._total = 0
+
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str) -> bytes:
+        """Returns the cached data, or None on a cache miss."""
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as infile:
+                data = infile.read()
+        except FileNotFoundError:
+            return None
+
+        # If evicted by another process while we were reading, we still have the data.
+        self._touch(path)
+        return data
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmpname = '%s-%i-%i.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmpname, 'wb') as outfile:
+            outfile.write(data)
+        os.replace(tmpname, path)
+
+        self._stored(path)
+        self.evict()
+
+    def remove(self, key: str):
+        path = self._path(key)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._forget(path)
+
+    def get_file(self, key: str, filename: str) -> bool:
+        """Copies the cached entry to the file, returns False on a cache miss.
+
+        Unlike get(), this doesn't hold the entire entry in memory.
+        """
+
+        path = self._path(key)
+        tmpname = '%s-%i-%i.tmp' % (filename, os.getpid(), threading.get_ident())
+        try:
+            shutil.copyfile(path, tmpname)
+        except FileNotFoundError:
+            return False
+        os.replace(tmpname, filename)
+
+        self._touch(path)
+        return True
+
+    def put_file(self, key: str, filename: str):
+        """Stores a copy of the file as the entry."""
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmpname = '%s-%i-%i.tmp' % (path, os.getpid(), threading.get_ident())
+        shutil.copyfile(filename, tmpname)
+        os.replace(tmpname, path)
+
+        self._stored(path)
+        self.evict()
+
+    def _entries(self) -> [(float, int, str)]:
+        """Returns (mtime, size, path) of all entries."""
+
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for fname in filenames:
+                if fname.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, fname)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _load_index(self):
+        """Reads the entries from disk, the first time the index is needed.
+
+        Must be called with the lock held.
+        """
+
+        if self._index is not None:
+            return
+        self._index = {path: (mtime, size) for mtime, size, path in self._entries()}
+        self._total = sum(size for _, size in self._index.values())
+
+    def _forget(self, path: str):
+        """Removes the entry from the index. Must be called with the lock held."""
+
+        if self._index is None or path not in self._index:
+            return
+        _, size = self._index.pop(path)
+        self._total -= size
+
+    def _update(self, path: str):
+        """Updates the entry in the index from disk. Must be called with the lock held."""
+
+        self._forget(path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        self._index[path] = (stat.st_mtime, stat.st_size)
+        self._total += stat.st_size
+
+    def _stored(self, path: str):
+        with self._lock:
+            self._load_index()
+            self._update(path)
+
+    def _touch(self, path: str):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            if self._index is not None:
+                self._update(path)
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits its size limit."""
+
+        with self._lock:
+            self._load_index()
+            if self._total <= self.max_size:
+                return
+
+            entries = sorted((mtime, size, path) for path, (mtime, size) in self._index.items())
+            for _, _, path in entries:
+                if self._total <= self.max_size:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                self._forget(path)
+                log.debug('Evicted %s from cache', path)
@@ -0,0 +1,360 @@
+"""
+Header-only EXIF reader for JPEG and TIFF files.
+
+Only the bytes up to the start of the image data are read, which is
+much cheaper than having PIL or exifread open the entire file.
+"""
+
+import collections
+import concurrent.futures
+import io
+import json
+import logging
+import math
+import os
+import os.path
+import struct
+import threading
+
+from . import cache
+
+log = logging.getLogger(__name__)
+
+CACHE_FILENAME = '.quickypano-metadata.json'
+
+# TIFF tags we're interested in.
+TAG_IMAGE_WIDTH = 0x0100
+TAG_IMAGE_LENGTH = 0x0101
+TAG_EXIF_IFD = 0x8769
+TAG_EXPOSURE_TIME = 0x829a
+TAG_FNUMBER = 0x829d
+TAG_ISO = 0x8827
+TAG_SHUTTER_SPEED = 0x9201
+TAG_APERTURE = 0x9202
+TAG_EXPOSURE_BIAS = 0x9204
+
+# TIFF field type -> (struct format character, size in bytes)
+_TIFF_TYPES = {
+    1: ('B', 1),  # BYTE
+    3: ('H', 2),  # SHORT
+    4: ('L', 4),  # LONG
+    5: ('LL', 8),  # RATIONAL
+    6: ('b', 1),  # SBYTE
+    8: ('h', 2),  # SSHORT
+    9: ('l', 4),  # SLONG
+    10: ('ll', 8),  # SRATIONAL
+}
+
+# Start Of Frame markers; 0xC4, 0xC8 and 0xCC are DHT, JPG and DAC.
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+_ImageMetadata = collections.namedtuple(
+    'ImageMetadata',
+    ('width', 'height', 'fnumber', 'exposure_time', 'shutter_speed', 'aperture',
+     'iso', 'exposure_bias'))
+
+
+class ImageMetadata(_ImageMetadata):
+    """Metadata of a source image.
+
+    Rational EXIF values are stored as (numerator, denominator) tuples,
+    and are None when the tag is missing from the file.
+    """
+
+    __slots__ = ()
+
+    @property
+    def exposure_value(self) -> float:
+        # Source: http://en.wikipedia.org/wiki/Exposure_value
+        f_nr = self.fnumber[0] / self.fnumber[1]
+        t = self.exposure_time[0] / self.exposure_time[1]
+        return math.log2(f_nr ** 2 / t)
+
+
+class _TiffReader:
+    """Reads IFD entries from a TIFF structure in a seekable file."""
+
+    def __init__(self, infile, base_offset=0):
+        self.infile = infile
+        self.base = base_offset
+
+        byte_order = self.read(0, 2)
+        if byte_order == b'II':
+            self.endian = '<'
+        elif byte_order == b'MM':
+            self.endian = '>'
+        else:
+            raise ValueError('Invalid TIFF byte order %r' % byte_order)
+
+        magic, self.first_ifd = self.unpack('HL', self.read(2, 6))
+        if magic != 42:
+            raise ValueError('Invalid TIFF magic number %i' % magic)
+
+    def read(self, offset, size) -> bytes:
+        self.infile.seek(self.base + offset)
+        data = self.infile.read(size)
+        if len(data) != size:
+            raise ValueError('Unexpected end of TIFF data')
+        return data
+
+    def unpack(self, fmt, data):
+        return struct.unpack(self.endian + fmt, data)
+
+    def read_ifd(self, offset, wanted) -> dict:
+        """Returns {tag: first value} for the wanted tags in the IFD.
+
+        Only the first value of a tag with several values is read and returned,
+        e.g. the first ISO of a camera that writes more than one; all the tags
+        QuickyPano reads are used as single values. A value is a number, or a
+        (numerator, denominator) tuple for rationals.
+        """
+
+        count, = self.unpack('H', self.read(offset, 2))
+        entries = self.read(offset + 2, 12 * count)
+
+        values = {}
+        for idx in range(count):
+            tag, ftype, nvalues, raw = self.unpack(
+                'HHL4s', entries[12 * idx:12 * idx + 12])
+            if tag not in wanted or ftype not in _TIFF_TYPES or not nvalues:
+                continue
+
+            fmt, size = _TIFF_TYPES[ftype]
+            if size * nvalues > 4:
+                # The values don't fit in the entry, which holds their offset instead.
+                # Of those, only the first is read.
+                value_offset, = self.unpack('L', raw)
+                raw = self.read(value_offset, size)
+            value = self.unpack(fmt, raw[:size])
+            values[tag] = value if len(value) > 1 else value[0]
+        return values
+
+    def read_tags(self) -> dict:
+        wanted = {TAG_IMAGE_WIDTH, TAG_IMAGE_LENGTH, TAG_EXIF_IFD}
+        tags = self.read_ifd(self.first_ifd, wanted)
+
+        if TAG_EXIF_IFD in tags:
+            wanted = {TAG_EXPOSURE_TIME, TAG_FNUMBER, TAG_ISO, TAG_SHUTTER_SPEED,
+                      TAG_APERTURE, TAG_EXPOSURE_BIAS}
+            tags.update(self.read_ifd(tags.pop(TAG_EXIF_IFD), wanted))
+        return tags
+
+
+def _read_jpeg(infile) -> (dict, (int, int)):
+    """Reads the EXIF tags and pixel size from the JPEG header.
+
+    Stops at the first Start Of Frame marker, so the entropy-coded image
+    data is never read.
+    """
+
+    tags = {}
+    while True:
+        if infile.read(1) != b'\xff':
+            raise ValueError('Invalid JPEG marker')
+        marker = infile.read(1)
+        while marker == b'\xff':  # fill bytes
+            marker = infile.read(1)
+        if not marker:
+            raise ValueError('Unexpected end of JPEG data')
+
+        marker = ord(marker)
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            # Standalone markers without a length.
+            continue
+        if marker in (0xD9, 0xDA):
+            raise ValueError('No Start Of Frame marker found')
+
+        length, = struct.unpack('>H', infile.read(2))
+        if marker == 0xE1 and not tags:
+            payload = infile.read(length - 2)
+            if payload.startswith(b'Exif\0\0'):
+                tags = _TiffReader(io.BytesIO(payload), 6).read_tags()
+        elif marker in _SOF_MARKERS:
+            height, width = struct.unpack('>xHH', infile.read(5))
+            return tags, (width, height)
+        else:
+            infile.seek(length - 2, io.SEEK_CUR)
+
+
+def read_metadata(filename: str) -> ImageMetadata:
+    """Reads the metadata of a JPEG or TIFF file, looking at its header only."""
+
+    with open(filename, 'rb') as infile:
+        magic = infile.read(2)
+        if magic == b'\xff\xd8':
+            tags, (width, height) = _read_jpeg(infile)
+        elif magic in (b'II', b'MM'):
+            tags = _TiffReader(infile).read_tags()
+            width = tags.get(TAG_IMAGE_WIDTH)
+            height = tags.get(TAG_IMAGE_LENGTH)
+        else:
+            raise ValueError('%s is not a JPEG or TIFF file' % filename)
+
+    return ImageMetadata(
+        width=width,
+        height=height,
+        fnumber=tags.get(TAG_FNUMBER),
+        exposure_time=tags.get(TAG_EXPOSURE_TIME),
+        shutter_speed=tags.get(TAG_SHUTTER_SPEED),
+        aperture=tags.get(TAG_APERTURE),
+        iso=tags.get(TAG_ISO),
+        exposure_bias=tags.get(TAG_EXPOSURE_BIAS),
+    )
+
+
+def read_all_metadata(filenames, max_workers: int=None) -> [ImageMetadata]:
+    """Reads the metadata of all files in parallel.
+
+    The results are returned in the same order as the filenames.
+    """
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        return list(executor.map(read_metadata, filenames))
+
+
+class MetadataCache:
+    """Sidecar file caching image metadata, keyed by path, size and mtime.
+
+    Cache hits only cost a stat() call; the image files themselves are not
+    opened at all. Entries whose size or mtime no longer match the file on
+    disk are considered stale and are replaced.
+    """
+
+    VERSION = 1
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.basedir = os.path.dirname(os.path.abspath(filename))
+        self.entries = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+
+        self._load()
+
+    @classmethod
+    def for_directory(cls, dirname: str) -> 'MetadataCache':
+        return cls(os.path.join(dirname, CACHE_FILENAME))
+
+    def _load(self):
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as infile:
+                data = json.load(infile)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            log.warning('Ignoring corrupt metadata cache %s', self.filename)
+            return
+
+        if data.get('VERSION') != self.VERSION:
+            log.info('Ignoring metadata cache %s of version %r', self.filename,
+                     data.get('VERSION'))
+            return
+        self.entries = data['entries']
+
+    def save(self):
+        """Writes the cache to disk, if it was changed."""
+
+        with self._lock:
+            if not self.dirty:
+                return
+            data = {'VERSION': self.VERSION, 'entries': self.entries}
+
+            tmpname = '%s-%i.tmp' % (self.filename, os.getpid())
+            with open(tmpname, 'w', encoding='utf-8') as outfile:
+                json.dump(data, outfile, sort_keys=True)
+            os.replace(tmpname, self.filename)
+            self.dirty = False
+
+    def _key(self, path: str) -> str:
+        path = os.path.abspath(path)
+        try:
+            # Relative paths keep the cache valid when the project directory is moved.
+            return os.path.relpath(path, self.basedir).replace('\\', '/')
+        except ValueError:
+            # Different drive on Windows.
+            return path.replace('\\', '/')
+
+    def _entry(self, path: str, stat: os.stat_result) -> dict:
+        """Returns the up-to-date cache entry for the path, or None."""
+
+        key = self._key(path)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+                return entry
+
+            # The file changed, so everything we know about it is stale.
+            del self.entries[key]
+            self.dirty = True
+        return None
+
+    def get(self, path: str, stat: os.stat_result=None) -> ImageMetadata:
+        """Returns the cached metadata, or None if not cached or stale."""
+
+        entry = self._entry(path, stat or os.stat(path))
+        if entry is None or 'metadata' not in entry:
+            return None
+
+        meta = {field: tuple(value) if isinstance(value, list) else value
+                for field, value in entry['metadata'].items()}
+        return ImageMetadata(**meta)
+
+    def _fresh_entry(self, path: str, stat: os.stat_result) -> dict:
+        """Returns the entry to update, replacing it when stale. Call with the lock held."""
+
+        key = self._key(path)
+        entry = self.entries.get(key)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+            entry = self.entries[key] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        self.dirty = True
+        return entry
+
+    def put(self, path: str, metadata: ImageMetadata, stat: os.stat_result=None):
+        stat = stat or os.stat(path)
+
+        with self._lock:
+            self._fresh_entry(path, stat)['metadata'] = metadata._asdict()
+
+    def digest(self, path: str) -> str:
+        """Returns the SHA-1 digest of the file's contents.
+
+        The file is only read when its digest isn't cached yet.
+        """
+
+        stat = os.stat(path)
+        entry = self._entry(path, stat)
+        if entry is not None and 'digest' in entry:
+            return entry['digest']
+
+        digest = cache.file_digest(path)
+        with self._lock:
+            self._fresh_entry(path, stat)['digest'] = digest
+        return digest
+
+    def read_metadata(self, path: str) -> ImageMetadata:
+        stat = os.stat(path)
+        metadata = self.get(path, stat)
+        if metadata is None:
+            metadata = read_metadata(path)
+            self.put(path, metadata, stat)
+        return metadata
+
+    def read_all(self, filenames, max_workers: int=None) -> [ImageMetadata]:
+        """Like read_all_metadata(), but only reads files that aren't cached."""
+
+        filenames = list(filenames)
+        stats = [os.stat(fname) for fname in filenames]
+        results = [self.get(fname, stat) for fname, stat in zip(filenames, stats)]
+
+        missing = [idx for idx, meta in enumerate(results) if meta is None]
+        log.debug('Metadata cache: %i hits, %i misses',
+                  len(results) - len(missing), len(missing))
+        if missing:
+            metadata = read_all_metadata([filenames[idx] for idx in missing], max_workers)
+            for idx, meta in zip(missing, metadata):
+                self.put(filenames[idx], meta, stats[idx])
+                results[idx] = meta
+
+        return results
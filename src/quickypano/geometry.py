@@ -0,0 +1,127 @@
+"""
+Predicts which images overlap, from their yaw, pitch, roll and field of view.
+"""
+
+import logging
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Hugin's image projections with equidistant (fisheye) mapping.
+FISHEYE_PROJECTIONS = {2, 3}
+
+# Default cap on the width of the equirectangular output canvas.
+MAX_CANVAS_WIDTH = 32768
+
+
+def vertical_fov(hfov, width, height):
+    """Returns the vertical field of view of a rectilinear image, in degrees."""
+
+    half = np.radians(np.asarray(hfov, dtype=float)) / 2
+    return np.degrees(2 * np.arctan(np.tan(half) * np.asarray(height) / np.asarray(width)))
+
+
+def optimal_canvas_size(width, hfov, projection=0, scale: float=1.0,
+                        max_width: int=MAX_CANVAS_WIDTH) -> (int, int):
+    """Returns the (width, height) of the 360x180 equirectangular canvas that
+    keeps the resolution at the centre of the source images.
+
+    This is what Hugin calls the optimal size: a rectilinear image has a
+    focal length of width / 2 / tan(hfov / 2) pixels, and the canvas gets
+    that many pixels per radian, so it is pi * width / tan(hfov / 2) wide.
+    The arguments can be arrays of all images, in which case the image with
+    the most pixels per degree decides.
+
+    :param projection: Hugin's image projection, the 'f' of the 'i' line.
+    :param scale: factor applied to the optimal size.
+    :param max_width: the width is capped at this; None = no cap.
+
+    >>> optimal_canvas_size(3456, 73.739795291688)
+    (14476, 7238)
+    >>> optimal_canvas_size(3456, 73.739795291688, scale=0.5)
+    (7238, 3619)
+    >>> optimal_canvas_size(3456, 73.739795291688, max_width=8192)
+    (8192, 4096)
+    """
+
+    width = np.asarray(width, dtype=float)
+    hfov = np.radians(np.asarray(hfov, dtype=float))
+    fisheye = np.isin(np.asarray(projection), list(FISHEYE_PROJECTIONS))
+    focal_pixels = np.where(fisheye, width / hfov, width / 2 / np.tan(hfov / 2))
+
+    canvas_width = 2 * np.pi * float(np.max(focal_pixels)) * scale
+    if max_width:
+        canvas_width = min(canvas_width, max_width)
+    # Even, so that the height is exactly half the width.
+    canvas_width = max(2, 2 * int(round(canvas_width / 2)))
+    return canvas_width, canvas_width // 2
+
+
+def camera_frames(yaw, pitch, roll):
+    """Returns the forward, right and up unit vectors of each camera, as (n, 3) arrays.
+
+    Angles are in degrees, using Hugin's conventions.
+    """
+
+    y, p, r = (np.radians(np.asarray(angle, dtype=float)) for angle in (yaw, pitch, roll))
+
+    forward = np.column_stack((np.cos(p) * np.cos(y), np.cos(p) * np.sin(y), np.sin(p)))
+    right = np.column_stack((-np.sin(y), np.cos(y), np.zeros_like(y)))
+    up = np.column_stack((-np.sin(p) * np.cos(y), -np.sin(p) * np.sin(y), np.cos(p)))
+
+    # Roll rotates right & up around the forward vector.
+    cos_r, sin_r = np.cos(r)[:, None], np.sin(r)[:, None]
+    right, up = cos_r * right + sin_r * up, cos_r * up - sin_r * right
+    return forward, right, up
+
+
+def overlap_matrix(yaw, pitch, roll, hfov, vfov):
+    """Returns an (n, n) matrix with the predicted overlap of each pair of images.
+
+    The overlap of image B in image A is estimated from the angular offset of
+    B's centre in A's frame, relative to A's field of view:
+    (1 - |offset x| / hfov) * (1 - |offset y| / vfov). This is 1 for
+    identical views and 0 when the centre of B is outside of A. The matrix
+    is symmetric, taking the smallest overlap of both directions.
+    """
+
+    forward, right, up = camera_frames(yaw, pitch, roll)
+
+    # Components of the centre of B (columns) in the frame of A (rows).
+    along = forward @ forward.T
+    across = right @ forward.T
+    vertical = up @ forward.T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset_x = np.degrees(np.arctan2(np.abs(across), along))
+        offset_y = np.degrees(np.arctan2(np.abs(vertical), along))
+
+    hfov = np.asarray(hfov, dtype=float)[:, None]
+    vfov = np.asarray(vfov, dtype=float)[:, None]
+    overlap = (np.clip(1 - offset_x / hfov, 0, 1) *
+               np.clip(1 - offset_y / vfov, 0, 1))
+    overlap[along <= 0] = 0
+
+    return np.minimum(overlap, overlap.T)
+
+
+def overlapping_pairs(project, min_overlap: float) -> [(int, int)]:
+    """Returns the (low, high) index pairs of stack anchors that overlap enough.
+
+    Uses the yaw, pitch, roll and field of view as set by Project.set_variables().
+    """
+
+    indices = list(range(0, len(project.photos), project.stack_size))
+    table = project.parameter_table.resolved(indices)
+
+    hfov = table.column('v')
+    vfov = vertical_fov(hfov, table.column('w'), table.column('h'))
+    overlap = overlap_matrix(table.column('y'), table.column('p'), table.column('r'), hfov, vfov)
+
+    rows, cols = np.nonzero(np.triu(overlap >= min_overlap, k=1))
+    pairs = [(indices[row], indices[col]) for row, col in zip(rows, cols)]
+
+    log.info('Found %i pairs of %i images with a predicted overlap of at least %.0f%%',
+             len(pairs), len(indices), 100 * min_overlap)
+    return pairs
@@ -2,12 +2,16 @@
 Hugin file support
 """
 
+import functools
 import os
 import os.path
 import subprocess
 import sys
 import distutils.spawn
 
+from . import trace
+
+_bindir = None
 _cpfind = None
 _pto_var = None
 _stitch = None
@@ -16,6 +20,12 @@ _make = None
 
 redirect_out = subprocess.DEVNULL
 
+# Variables to optimize, see pto_var --opt.
+OPTIMIZE_VARS = ('y', 'p', 'r', 'v', 'Eev')
+
+# When True, the optimizer variables are set by running pto_var instead of natively.
+use_pto_var = False
+
 
 def set_debugging(debugging: bool):
     global redirect_out
@@ -26,10 +36,17 @@ def set_debugging(debugging: bool):
         redirect_out = subprocess.DEVNULL
 
 
+def set_use_pto_var(use: bool):
+    global use_pto_var
+
+    use_pto_var = use
+
+
 def set_hugin_bindir(dirname: str):
-    global _cpfind, _pto_var, _stitch, _pto2mk, _make
+    global _bindir, _cpfind, _pto_var, _stitch, _pto2mk, _make
 
     print('Hugin found in %r' % dirname)
+    _bindir = dirname
 
     ext = '.exe' if sys.platform == 'win32' else ''
 
@@ -61,11 +78,12 @@ def find_hugin(dirname: str='c:/Program Files*/Hugin'):
 
 
 def write_header(outfile, project):
+    width, height = project.canvas_size
     print('''# hugin project file
 #hugin_ptoversion 2
-p f2 w8192 h4096 v360 k0 E%f R0 n"TIFF_m c:LZW r:CROP"
+p f2 w%i h%i v360 k0 E%f R0 n"TIFF_m c:LZW r:CROP"
 m g1 i0 f0 m2 p0.00784314
-''' % project.average_ev, file=outfile)
+''' % (width, height, project.average_ev), file=outfile)
 
 
 IMAGE_PARAM_ORDER = ('w h f v Ra Rb Rc Rd Re Eev Er Eb '
@@ -76,18 +94,60 @@ IMAGE_PARAM_ORDER = ('w h f v Ra Rb Rc Rd Re Eev Er Eb '
 def write_images(outfile, project):
     print('# image lines', file=outfile)
 
-    for idx, image in enumerate(project.photos):
+    rows = project.parameter_table.dicts()
+    for idx, (image, values) in enumerate(zip(project.photos, rows)):
         disabled = '' if idx % project.stack_size == 0 else ' disabled'
 
-        params = ['%s%s' % (key, image.parameters[key]) for key in IMAGE_PARAM_ORDER]
+        params = ['%s%s' % (key, values[key]) for key in IMAGE_PARAM_ORDER]
+        if image.digest:
+            print('#-quickypano digest=%s' % image.digest, file=outfile)
         print('#-hugin  cropFactor=1%s' % disabled, file=outfile)
         print('i %s n"%s"' % (' '.join(params), image.filename), file=outfile)
 
 
-def write_footer(outfile, project):
+def read_image_digests(pto_filename) -> [str]:
+    """Returns the content digest written for each image line, or None if there is none.
+
+    Hugin drops the digests when it saves the project itself.
+    """
+
+    digests = []
+    digest = None
+    with open(pto_filename, 'r', encoding='utf-8') as infile:
+        for line in infile:
+            if line.startswith('#-quickypano '):
+                for token in line.split()[1:]:
+                    if token.startswith('digest='):
+                        digest = token[len('digest='):]
+            elif line.startswith('i '):
+                digests.append(digest)
+                digest = None
+    return digests
+
+
+def optimizer_lines(project, variables=OPTIMIZE_VARS) -> [str]:
+    """Returns the 'v' lines that pto_var --opt would write.
+
+    Just like pto_var, linked variables (value '=N') are only optimized on
+    the image they are linked to, and the variables of each image are
+    written in sorted order.
+    """
+
+    lines = []
+    for idx, values in enumerate(project.parameter_table.dicts()):
+        for var in sorted(variables):
+            value = values[var]
+            if isinstance(value, str) and value.startswith('='):
+                continue
+            lines.append('v %s%i' % (var, idx))
+    return lines
+
+
+def write_footer(outfile, project, optimize_vars=OPTIMIZE_VARS):
     control_points = os.linesep.join(project.control_points)
 
     params = {
+        'optimize_vars': os.linesep.join(optimizer_lines(project, optimize_vars) + ['v']),
         'control_points': control_points,
         'hugin_outputLDRBlended': str(not project.is_hdr).lower(),
         'hugin_outputLDRExposureBlended': str(project.is_hdr).lower(),
@@ -97,7 +157,7 @@ def write_footer(outfile, project):
 
 
 # specify variables that should be optimized
-v
+%(optimize_vars)s
 
 
 # control points
@@ -133,43 +193,102 @@ v
 ''' % params, file=outfile)
 
 
-def write(outfile, project):
+def write(outfile, project, optimize_vars=OPTIMIZE_VARS):
     write_header(outfile, project)
     write_images(outfile, project)
-    write_footer(outfile, project)
+    write_footer(outfile, project, optimize_vars)
+
+
+def pto_var_command(input_filename, output_filename) -> [str]:
+    return [_pto_var,
+            input_filename,
+            '-o', output_filename,
+            '--opt', ','.join(OPTIMIZE_VARS)]
 
 
 def pto_var(input_filename, output_filename):
-    subprocess.check_call([_pto_var,
-                           input_filename,
-                           '-o', output_filename,
-                           '--opt', 'y,p,r,v,Eev'],
-                          stdout=redirect_out,
-                          stderr=redirect_out)
+    trace.check_call(pto_var_command(input_filename, output_filename),
+                     stdout=redirect_out,
+                     stderr=redirect_out)
 
 
-def cpfind(input_filename, output_filename):
-    subprocess.check_call([_cpfind,
-                           input_filename,
-                           '--cache',
-                           '-o', output_filename],
-                          stdout=redirect_out,
-                          stderr=redirect_out)
+def cpfind_command(input_filename, output_filename, extra_args=(), threads: int=None,
+                   keypath: str=None) -> [str]:
+    args = list(extra_args)
+    if threads:
+        args.append('--threads=%i' % threads)
+    if keypath:
+        args += ['--keypath', keypath]
 
+    return [_cpfind,
+            input_filename,
+            '--cache',
+            '-o', output_filename] + args
 
-def pto2mk(pto_filename) -> str:
-    mk_filename = pto_filename + '.mk'
+
+def cpfind(input_filename, output_filename, extra_args=(), threads: int=None,
+           keypath: str=None):
+    trace.check_call(cpfind_command(input_filename, output_filename, extra_args,
+                                    threads, keypath),
+                     stdout=redirect_out,
+                     stderr=redirect_out)
+
+
+def cpfind_keypoints_command(input_filename, keypath: str, threads: int=None) -> [str]:
+    args = ['--keypath', keypath]
+    if threads:
+        args.append('--threads=%i' % threads)
+
+    return [_cpfind,
+            input_filename,
+            '--kall'] + args
+
+
+def cpfind_keypoints(input_filename, keypath: str, threads: int=None):
+    """Only extracts the keypoints of all images, writing them to keyfiles in keypath."""
+
+    trace.check_call(cpfind_keypoints_command(input_filename, keypath, threads),
+                     stdout=redirect_out,
+                     stderr=redirect_out)
+
+
+def keyfile_name(keypath: str, image_filename: str) -> str:
+    """Returns the name of the keyfile cpfind uses for the image."""
+
+    basename = os.path.splitext(os.path.basename(image_filename))[0]
+    return os.path.join(keypath, basename + '.key')
+
+
+@functools.lru_cache()
+def cpfind_version() -> str:
+    """Returns the version string of cpfind, for use in cache keys."""
+
+    try:
+        output = subprocess.check_output([_cpfind, '--version'], stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return output.decode('utf-8', 'replace').strip()
+
+
+def makefile_name(pto_filename) -> str:
+    return pto_filename + '.mk'
+
+
+def pto2mk_command(pto_filename) -> [str]:
     prefix = pto_filename.replace('.pto', '')
 
-    subprocess.check_call([_pto2mk,
-                           '-p', prefix,
-                           '-o', mk_filename,
-                           pto_filename])
+    return [_pto2mk,
+            '-p', prefix,
+            '-o', makefile_name(pto_filename),
+            pto_filename]
+
 
-    return mk_filename
+def pto2mk(pto_filename) -> str:
+    trace.check_call(pto2mk_command(pto_filename))
+    return makefile_name(pto_filename)
 
 
-def stitch_project(pto_filename):
+def stitch_project_command(pto_filename) -> [str]:
     if not pto_filename.endswith('.pto'):
         raise ValueError('pto_filename should end in ".pto"')
 
@@ -178,21 +297,80 @@ def stitch_project(pto_filename):
     prefix = pto_filename.replace('.pto', '')
     # hugin_stitch_project.exe /w 1_terras.pto /o 1_terras_fused
 
-    subprocess.check_call([_stitch,
-                           '-w', pto_filename,
-                           '-o', prefix])
+    return [_stitch,
+            '-w', pto_filename,
+            '-o', prefix]
 
 
-def make(pto_filename, make_args=None, on_gpu=False):
-    makefile = pto2mk(pto_filename)
+def stitch_project(pto_filename):
+    trace.check_call(stitch_project_command(pto_filename))
+
+
+def make_command(makefile, make_args=None, on_gpu=False, jobs: int=None,
+                 nona_threads: int=None) -> [str]:
+    """Returns the make command line.
+
+    :param jobs: number of make jobs, None = 4 on the GPU and 8 otherwise.
+    :param nona_threads: number of threads of each nona process, None = 1.
+    """
 
     if make_args is None:
         make_args = []
+    if jobs is None:
+        jobs = 4 if on_gpu else 8
+
+    variables = ['%s=%s' % item for item in sorted(make_variables(on_gpu, nona_threads).items())]
+    args = [_make, '-f', makefile] + variables + ['-j%i' % jobs]
+    return args + make_args
 
-    args = [_make, 'ENBLEND=enblend --blend-colorspace=identity', '-f', makefile]
+
+def make_variables(on_gpu=False, nona_threads: int=None) -> dict:
+    """Returns the variables that override the makefile's tool configuration."""
+
+    nona = 'nona -t %i' % (nona_threads or 1)
     if on_gpu:
-        args += ['NONA=nona -t 1 -g', '-j4']
-    else:
-        args += ['NONA=nona -t 1', '-j8']
+        nona += ' -g'
 
-    subprocess.check_call(args + make_args)
+    return {'ENBLEND': 'enblend --blend-colorspace=identity',
+            'NONA': nona}
+
+
+def native_executor(makefile, on_gpu=False, jobs: int=None, nona_threads: int=None,
+                    retries: int=0, variables: dict=None, **kwargs):
+    """Returns a quickypano.makefile.MakeExecutor for a makefile written by pto2mk.
+
+    :param variables: extra variables, overriding the makefile's and ours.
+    :param kwargs: passed to the MakeExecutor.
+    """
+
+    from . import makefile as mkfile
+
+    all_variables = make_variables(on_gpu, nona_threads)
+    all_variables.update(variables or {})
+
+    # Just like make, find the tools next to pto2mk.
+    env = dict(os.environ)
+    if _bindir:
+        env['PATH'] = _bindir + os.pathsep + env.get('PATH', '')
+
+    return mkfile.MakeExecutor(mkfile.Makefile.parse(makefile, all_variables),
+                               jobs=jobs or os.cpu_count() or 1,
+                               state_filename=makefile + '.state',
+                               retries=retries, env=env, **kwargs)
+
+
+def make_native(pto_filename, goals=None, on_gpu=False, jobs: int=None,
+                nona_threads: int=None, retries: int=0, variables: dict=None):
+    """Runs pto2mk, then runs the makefile without make, see quickypano.makefile.
+
+    :param variables: extra variables, overriding the makefile's and ours.
+    """
+
+    makefile = pto2mk(pto_filename)
+    executor = native_executor(makefile, on_gpu, jobs, nona_threads, retries, variables)
+    return executor.run(goals)
+
+
+def make(pto_filename, make_args=None, on_gpu=False, jobs: int=None, nona_threads: int=None):
+    makefile = pto2mk(pto_filename)
+    trace.check_call(make_command(makefile, make_args, on_gpu, jobs, nona_threads))
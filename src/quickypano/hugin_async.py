@@ -0,0 +1,124 @@
+"""
+Asyncio counterparts of the Hugin wrappers in quickypano.hugin.
+
+Every child process runs in its own process group (a new session on POSIX),
+so that a timeout or cancellation kills the child together with anything it
+spawned, such as the nona and enblend processes started by make.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import sys
+
+from . import hugin, trace
+
+log = logging.getLogger(__name__)
+
+
+def _kill_process_group(proc: asyncio.subprocess.Process):
+    if proc.returncode is not None:
+        return
+
+    log.debug('Killing process group of PID %i', proc.pid)
+    try:
+        if sys.platform == 'win32':
+            # taskkill /T also kills the children; proc.kill() would only kill the process.
+            subprocess.call(['taskkill', '/F', '/T', '/PID', str(proc.pid)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, OSError):
+        # Already gone.
+        pass
+
+
+async def check_call(args, timeout: float=None, limit: asyncio.Semaphore=None,
+                     stdout=None, stderr=None) -> int:
+    """Runs a command, raising CalledProcessError when it fails.
+
+    :param timeout: maximum running time in seconds, None = unlimited. On
+        timeout the process group is killed and asyncio.TimeoutError is raised.
+    :param limit: semaphore bounding the number of concurrent processes.
+
+    When tracing, the child's wall time is recorded. Its CPU time and peak
+    RSS are not, as asyncio reaps the child itself.
+    """
+
+    if limit is not None:
+        async with limit:
+            return await check_call(args, timeout, None, stdout, stderr)
+
+    if sys.platform == 'win32':
+        kwargs = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        kwargs = {'start_new_session': True}
+
+    tracer = trace.tracer()
+    start_ts = None if tracer is None else tracer.timestamp()
+
+    proc = await asyncio.create_subprocess_exec(*args, stdout=stdout, stderr=stderr, **kwargs)
+    try:
+        returncode = await asyncio.wait_for(proc.wait(), timeout)
+    except BaseException:
+        # Timeout or cancellation; don't leave the process running.
+        _kill_process_group(proc)
+        try:
+            await asyncio.shield(proc.wait())
+        except asyncio.CancelledError:
+            pass
+        if tracer is not None:
+            tracer.process(args, proc.pid, start_ts, tracer.timestamp(), proc.returncode)
+        raise
+
+    if tracer is not None:
+        tracer.process(args, proc.pid, start_ts, tracer.timestamp(), returncode)
+
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, args)
+    return returncode
+
+
+async def pto_var(input_filename, output_filename, timeout: float=None,
+                  limit: asyncio.Semaphore=None):
+    await check_call(hugin.pto_var_command(input_filename, output_filename),
+                     timeout, limit, stdout=hugin.redirect_out, stderr=hugin.redirect_out)
+
+
+async def cpfind(input_filename, output_filename, extra_args=(), threads: int=None,
+                 keypath: str=None, timeout: float=None, limit: asyncio.Semaphore=None):
+    await check_call(hugin.cpfind_command(input_filename, output_filename, extra_args,
+                                          threads, keypath),
+                     timeout, limit, stdout=hugin.redirect_out, stderr=hugin.redirect_out)
+
+
+async def cpfind_keypoints(input_filename, keypath: str, threads: int=None,
+                           timeout: float=None, limit: asyncio.Semaphore=None):
+    await check_call(hugin.cpfind_keypoints_command(input_filename, keypath, threads),
+                     timeout, limit, stdout=hugin.redirect_out, stderr=hugin.redirect_out)
+
+
+async def pto2mk(pto_filename, timeout: float=None, limit: asyncio.Semaphore=None) -> str:
+    await check_call(hugin.pto2mk_command(pto_filename), timeout, limit)
+    return hugin.makefile_name(pto_filename)
+
+
+async def stitch_project(pto_filename, timeout: float=None, limit: asyncio.Semaphore=None):
+    await check_call(hugin.stitch_project_command(pto_filename), timeout, limit)
+
+
+async def make(pto_filename, make_args=None, on_gpu=False, jobs: int=None,
+               nona_threads: int=None, timeout: float=None, limit: asyncio.Semaphore=None):
+    """Runs pto2mk and make; the timeout applies to both together."""
+
+    async def run():
+        makefile = await pto2mk(pto_filename)
+        await check_call(hugin.make_command(makefile, make_args, on_gpu, jobs, nona_threads))
+
+    if limit is not None:
+        async with limit:
+            await asyncio.wait_for(run(), timeout)
+    else:
+        await asyncio.wait_for(run(), timeout)
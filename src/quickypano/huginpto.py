@@ -24,6 +24,114 @@
 # http://hugin.sourceforge.net/docs/nona/nona.txt
 # http://sourceforge.net/p/panotools/libpano13/ci/default/tree/doc/Optimize.txt
 
+import collections.abc
+import mmap
+import re
+
+import numpy as np
+
+# Matches the command character of every non-empty, non-comment line.
+_command_re = re.compile(rb'^[ \t]*([^\s#])', re.MULTILINE)
+
+
+class ControlPoints:
+    """
+    Columnar view of control points, one typed NumPy array per 'c' line field.
+
+    >>> cp = pto.control_points
+    >>> cp.n[:3], cp.x[:3]
+    (array([0, 0, 0], dtype=int32), array([1034., 1002.,  987.]))
+    """
+    COLUMNS = (('n', np.int32), ('N', np.int32),
+               ('x', np.float64), ('y', np.float64),
+               ('X', np.float64), ('Y', np.float64),
+               ('t', np.int32))
+
+    def __init__(self, **columns):
+        for name, dtype in self.COLUMNS:
+            setattr(self, name, np.asarray(columns.get(name, ()), dtype=dtype))
+
+        # Pair index, built on the first pair query:
+        # {(n, N): row indices}, in order of first appearance of the pair.
+        self._pair_index = None
+
+    @classmethod
+    def from_parsed(cls, parsed_c):
+        """
+        Build the columns from parsed 'c' lines.
+
+        :param parsed_c: list of dicts, see HuginPto.parsed['c']
+        """
+        columns = {}
+        for name, dtype in cls.COLUMNS:
+            default = '0' if name == 't' else 'nan'
+            columns[name] = np.array([c.get(name, default) for c in parsed_c], dtype=dtype)
+        return cls(**columns)
+
+    def __len__(self):
+        return len(self.n)
+
+    @staticmethod
+    def _index_rows(n, N, offset=0):
+        """
+        Group row indices by (n, N) pair.
+
+        :return: {(n, N): row indices}, ordered by first appearance of the pair
+        :rtype: dict
+        """
+        if not len(n):
+            return {}
+        keys = (n.astype(np.int64) << 32) | N.astype(np.int64)
+        order = np.argsort(keys, kind='stable')
+        _, starts = np.unique(keys[order], return_index=True)
+        groups = np.split(order + offset, starts[1:])
+
+        # Stable sort, so each group starts with the first appearance of its pair.
+        groups.sort(key=lambda rows: rows[0])
+        return {(int(n[rows[0] - offset]), int(N[rows[0] - offset])): rows
+                for rows in groups}
+
+    @property
+    def pair_index(self):
+        if self._pair_index is None:
+            self._pair_index = self._index_rows(self.n, self.N)
+        return self._pair_index
+
+    def pairs(self):
+        """
+        Pairs of image indices with control points, in order of first appearance.
+
+        :rtype: list of tuples
+        """
+        return list(self.pair_index)
+
+    def pair_rows(self, image1, image2):
+        """
+        Row indices of the control points between two images, in file order.
+        """
+        return self.pair_index.get((image1, image2), np.empty(0, dtype=np.intp))
+
+    def extend(self, **columns):
+        """
+        Append control points, keeping the pair index in sync.
+
+        :param columns: one array-like per column; missing columns default to 0
+        """
+        offset = len(self)
+        count = len(columns['n'])
+        new = {}
+        for name, dtype in self.COLUMNS:
+            new[name] = np.asarray(columns.get(name, np.zeros(count)), dtype=dtype)
+            setattr(self, name, np.concatenate((getattr(self, name), new[name])))
+
+        if self._pair_index is None:
+            return
+        for pair, rows in self._index_rows(new['n'], new['N'], offset).items():
+            existing = self._pair_index.get(pair)
+            if existing is not None:
+                rows = np.concatenate((existing, rows))
+            self._pair_index[pair] = rows
+
 
 class HuginPto:
     """
@@ -70,9 +178,17 @@ class HuginPto:
      'w': '1280',
      'y': '0'}
 
+    With lazy=True the file is memory-mapped, and only the byte offsets of
+    the lines are recorded. Lines are tokenised on first access, per command
+    or per image:
+
+    >>> with HuginPto('cam1 - cam8.pto', lazy=True) as pto:
+    ...     pto.count('i'), pto.get_image(7)['n']
+    (8, '"kamera8.png"')
+
     """
-    def __init__(self, filename):
-        self.commands = {'p': [],
+    def __init__(self, filename, lazy=False):
+        self.commands = {'p': ['f', 'w', 'h', 'v', 'k', 'b', 'E', 'R', 'T', 'S', 'n'],
                          'o': [],
                          'i': ['f', 'w', 'h', 'v', 'y', 'p', 'r', 'a', 'b', 'c', 'd', 'e', 'g', 't', 'S', 'C',
                                'o', 'X', 'Y', 'Z', 'n', 'TiX', 'TiY', 'TiZ', 'TiS', 'TrX', 'TrY', 'TrZ', 'Te0',
@@ -84,11 +200,42 @@ class HuginPto:
                          'c': ['n', 'N', 'x', 'y', 'X', 'Y', 't']}
         # TODO: add missing definitions
 
+        self._file = None
+        self._mmap = None
+        self._control_points = None
+
+        if lazy:
+            self._offsets = self._index(filename)
+            self.parsed = _LazySections(self)
+            return
+
         self.parsed = {}
         for c in self.commands:
             self.parsed[c] = []
 
         self._parse(filename)
+        self._control_points = ControlPoints.from_parsed(self.parsed['c'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Release the memory map of a lazily parsed file.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = self._file = None
+
+    @property
+    def control_points(self):
+        if self._control_points is None:
+            self._control_points = ControlPoints.from_parsed(self.parsed['c'])
+        return self._control_points
 
     @staticmethod
     def _add_item(d, key, item):
@@ -115,26 +262,94 @@ class HuginPto:
                     continue
                 c = line[0]
                 if c in self.commands:
-                    sub_command = {}
-                    for subc in line.split(' ')[1:]:
-                        # handles subcommands up to length of 3
-                        if subc == '':
-                            continue
-                        elif (len(subc) >= 1) and (subc[0] in self.commands[c]):
-                            self._add_item(sub_command, subc[0], subc[1:])
-                        elif (len(subc) >= 2) and (subc[0:2] in self.commands[c]):
-                            self._add_item(sub_command, subc[0:2], subc[2:])
-                        elif (len(subc) >= 3) and (subc[0:3] in self.commands[c]):
-                            self._add_item(sub_command, subc[0:3], subc[3:])
-                        else:
-                            self._add_item(sub_command, 'unknown', subc)
-                    self.parsed[c].append(sub_command)
+                    self.parsed[c].append(self._parse_line(c, line))
                 elif c == '#':
                     pass
                 else:
                     print('Unknown command on line ' + str(i) + ': ' + line)
                 i += 1
 
+    def _parse_line(self, c, line):
+        """
+        Tokenise a single line into a dictionary of subcommands.
+
+        :param c: command character, i.e. the first character of the line
+        :param line: stripped line
+        """
+        sub_command = {}
+        for subc in line.split(' ')[1:]:
+            # handles subcommands up to length of 3
+            if subc == '':
+                continue
+            elif (len(subc) >= 1) and (subc[0] in self.commands[c]):
+                self._add_item(sub_command, subc[0], subc[1:])
+            elif (len(subc) >= 2) and (subc[0:2] in self.commands[c]):
+                self._add_item(sub_command, subc[0:2], subc[2:])
+            elif (len(subc) >= 3) and (subc[0:3] in self.commands[c]):
+                self._add_item(sub_command, subc[0:3], subc[3:])
+            else:
+                self._add_item(sub_command, 'unknown', subc)
+        return sub_command
+
+    def _index(self, filename):
+        """
+        Memory-map the file and record the byte offset of each line, per command.
+
+        :return: {command: [offset, ...]}
+        :rtype: dict
+        """
+        self._file = open(filename, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped.
+            self._file.close()
+            self._file = None
+            return {c: [] for c in self.commands}
+
+        offsets = {c: [] for c in self.commands}
+        for match in _command_re.finditer(self._mmap):
+            c = match.group(1).decode('ascii', 'replace')
+            if c in offsets:
+                offsets[c].append(match.start(1))
+            else:
+                print('Unknown command at byte ' + str(match.start(1)) + ': ' +
+                      self._read_line(match.start(1)))
+        return offsets
+
+    def _read_line(self, offset):
+        end = self._mmap.find(b'\n', offset)
+        if end < 0:
+            end = len(self._mmap)
+        return self._mmap[offset:end].decode('utf-8').strip()
+
+    def _parse_section(self, c):
+        """
+        Parse all lines of one command, lazy mode only.
+        """
+        return [self._parse_line(c, self._read_line(offset)) for offset in self._offsets[c]]
+
+    def count(self, c):
+        """
+        Number of lines of the given command, e.g. count('i') for the number of images.
+        """
+        if isinstance(self.parsed, _LazySections) and not self.parsed.is_parsed(c):
+            return len(self._offsets[c])
+        return len(self.parsed[c])
+
+    def get_image(self, index):
+        """
+        Get the parsed 'i' line of a single image.
+
+        In lazy mode only that line is tokenised.
+
+        :param index: image index, see get_input_files()
+        :rtype: dict
+        """
+        if isinstance(self.parsed, _LazySections) and not self.parsed.is_parsed('i'):
+            return self._parse_line('i', self._read_line(self._offsets['i'][index]))
+        return self.parsed['i'][index]
+
     def get_input_files(self):
         """
         Get list of input files.
@@ -153,18 +368,27 @@ class HuginPto:
         :return: point coordinates for both images ([[x1, y1], [x2, y2], ...], [[X1, Y1], [X2, Y2], ...])
         :rtype: tuple of list of lists
         """
-        corr1 = []
-        corr2 = []
-        for c in self.parsed['c']:
-            if c['n'] == str(image1) and c['N'] == str(image2):
-                corr1.append([float(c['x']), float(c['y'])])
-                corr2.append([float(c['X']), float(c['Y'])])
+        cp = self.control_points
+        rows = cp.pair_rows(image1, image2)
+        corr1 = np.column_stack((cp.x[rows], cp.y[rows])).tolist()
+        corr2 = np.column_stack((cp.X[rows], cp.Y[rows])).tolist()
         return corr1, corr2
 
     def get_correspondences_ndarray(self, image1, image2):
-        import numpy as np
-        c1, c2 = self.get_correspondences(image1, image2)
-        return np.array(c1).T, np.array(c2).T
+        """
+        Get correspondences for pairs of images as arrays.
+
+        :param image1: image index, see get_input_files()
+        :param image2: image index
+        :return: point coordinates for both images, each of shape (2, n), or
+            of shape (0,) when the images have no correspondences
+        :rtype: tuple of numpy.ndarray
+        """
+        cp = self.control_points
+        rows = cp.pair_rows(image1, image2)
+        if not len(rows):
+            return np.array([]), np.array([])
+        return np.vstack((cp.x[rows], cp.y[rows])), np.vstack((cp.X[rows], cp.Y[rows]))
 
     def get_available_correspondence_pairs(self):
         """
@@ -175,9 +399,44 @@ class HuginPto:
         :return: list of indices pairs
         :rtype: list of lists
         """
-        pairs = []
-        for c in self.parsed['c']:
-            pair = [int(c['n']), int(c['N'])]
-            if pair not in pairs:
-                pairs.append(pair)
-        return pairs
+        return [list(pair) for pair in self.control_points.pairs()]
+
+    def add_control_point(self, image1, image2, x, y, X, Y, t=0):
+        """
+        Add a control point, keeping parsed['c'] and control_points in sync.
+
+        :param image1: image index, see get_input_files()
+        :param image2: image index
+        """
+        values = {'n': image1, 'N': image2, 'x': x, 'y': y, 'X': X, 'Y': Y, 't': t}
+        self.parsed['c'].append({key: str(value) for key, value in values.items()})
+        self.control_points.extend(**{key: [value] for key, value in values.items()})
+
+
+class _LazySections(collections.abc.Mapping):
+    """
+    HuginPto.parsed for lazy mode; each command is parsed on first access,
+    whether by indexing, get(), or iterating over values() or items().
+    """
+    def __init__(self, pto):
+        self._pto = pto
+        self._sections = {}
+
+    def __getitem__(self, c):
+        if c not in self._sections:
+            if c not in self._pto.commands:
+                raise KeyError(c)
+            self._sections[c] = self._pto._parse_section(c)
+        return self._sections[c]
+
+    def is_parsed(self, c):
+        return c in self._sections
+
+    def __contains__(self, c):
+        return c in self._pto.commands
+
+    def __iter__(self):
+        return iter(self._pto.commands)
+
+    def __len__(self):
+        return len(self._pto.commands)
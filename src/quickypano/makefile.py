@@ -0,0 +1,739 @@
+"""
+Runs the makefiles written by pto2mk without an external make.
+
+Only the subset of GNU make that pto2mk uses is supported: variable
+assignments, conditionals, explicit rules, .PHONY and a handful of
+functions. Tasks run with critical-path-first ordering, their progress is
+recorded in a state file so that an interrupted render can be resumed, and
+the duration of each task is logged and recorded.
+"""
+
+import collections
+import concurrent.futures
+import glob
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import os
+import os.path
+import re
+import subprocess
+import threading
+import time
+
+from . import scheduler, trace
+
+log = logging.getLogger(__name__)
+
+# Estimated duration of the programs in a recipe, relative to nona, for
+# tasks that have no recorded duration yet.
+DEFAULT_COSTS = {
+    'nona': 1.0,
+    'enfuse': 2.0,
+    'hugin_hdrmerge': 2.0,
+    'enblend': 10.0,
+}
+UNKNOWN_COST = 0.1
+
+STATE_VERSION = 1
+
+_assignment_re = re.compile(r'^(?:export\s+|override\s+)?([^\s:#=+?$]+)\s*(::=|:=|\+=|\?=|=)(.*)$')
+_conditional_re = re.compile(r'^(ifeq|ifneq|ifdef|ifndef)\s+(.*)$')
+# The colon of a rule, but not of a Windows drive letter like C:/
+_rule_colon_re = re.compile(r'::?(?![/\\])')
+_special_target_re = re.compile(r'^\.[A-Z_]+$')
+# A word in a list of targets or prerequisites; spaces are escaped as '\ '.
+_word_re = re.compile(r'(?:\\ |\S)+')
+
+
+class MakefileError(Exception):
+    pass
+
+
+class Rule:
+    def __init__(self, target: str, prerequisites: [str], recipe: [str]):
+        self.target = target
+        self.prerequisites = prerequisites
+        self.recipe = recipe  # unexpanded recipe lines
+
+
+class Makefile:
+    """Parsed makefile.
+
+    :param variables: variables set on the command line, like
+        {'NONA': 'nona -t 4'}, which override the makefile's.
+    """
+
+    def __init__(self, variables: dict=None):
+        self.overrides = dict(variables or {})
+        self.variables = {}  # name -> (recursive?, value)
+        self.rules = collections.OrderedDict()  # target -> Rule
+        self.phony = set()
+        self.default_goal = None
+
+    @classmethod
+    def parse(cls, filename: str, variables: dict=None) -> 'Makefile':
+        makefile = cls(variables)
+        with open(filename, 'r', encoding='utf-8') as infile:
+            makefile.parse_lines(infile.read().splitlines())
+        return makefile
+
+    def parse_lines(self, lines: [str]):
+        # Stack of (this branch is active, a branch was taken) per conditional.
+        conditions = []
+        rule_targets = None  # targets of the rule being parsed, if any
+
+        def active():
+            return all(taken for taken, _ in conditions)
+
+        for line in _logical_lines(lines):
+            if line.startswith('\t') and rule_targets is not None:
+                if active():
+                    for target in rule_targets:
+                        self.rules[target].recipe.append(line[1:])
+                continue
+
+            stripped = _strip_comment(line).strip()
+            if not stripped:
+                continue
+
+            # Conditionals are tracked even in inactive branches, for nesting.
+            match = _conditional_re.match(stripped)
+            if match:
+                taken = active() and self._condition(*match.groups())
+                conditions.append((taken, taken))
+                continue
+            if stripped == 'else' or stripped.startswith('else '):
+                if not conditions:
+                    raise MakefileError('else without if')
+                _, was_taken = conditions.pop()
+                outer_active = active()
+                condition = stripped[5:].strip()
+                if was_taken or not outer_active:
+                    conditions.append((False, was_taken))
+                elif condition:
+                    taken = self._condition(*_conditional_re.match(condition).groups())
+                    conditions.append((taken, taken))
+                else:
+                    conditions.append((True, True))
+                continue
+            if stripped == 'endif':
+                if not conditions:
+                    raise MakefileError('endif without if')
+                conditions.pop()
+                continue
+
+            if not active():
+                continue
+
+            rule_targets = None
+            match = _assignment_re.match(stripped)
+            if match:
+                self._assign(*match.groups())
+                continue
+            if stripped.split()[0] in ('export', 'unexport'):
+                continue
+            if stripped.split()[0] in ('include', '-include', 'sinclude', 'define'):
+                raise MakefileError('Unsupported directive %r' % stripped)
+
+            rule_targets = self._add_rule(line)
+
+        if conditions:
+            raise MakefileError('Missing endif')
+
+    def _assign(self, name, operator, value):
+        value = value.strip()
+        if name in self.overrides:
+            return
+        if operator == '=':
+            self.variables[name] = (True, value)
+        elif operator in (':=', '::='):
+            self.variables[name] = (False, self.expand(value))
+        elif operator == '?=':
+            if name not in self.variables and name not in os.environ:
+                self.variables[name] = (True, value)
+        elif operator == '+=':
+            recursive, old = self.variables.get(name, (True, ''))
+            if not recursive:
+                value = self.expand(value)
+            self.variables[name] = (recursive, (old + ' ' + value).strip())
+
+    def _add_rule(self, line) -> [str]:
+        line, _, inline_recipe = _strip_comment(line).partition(';')
+        line = self.expand(line)
+        match = _rule_colon_re.search(line)
+        if not match:
+            raise MakefileError('Unable to parse line %r' % line)
+
+        targets = _split_words(line[:match.start()])
+        prerequisites = _split_words(line[match.end():])
+        recipe = [inline_recipe.strip()] if inline_recipe.strip() else []
+
+        if targets == ['.PHONY']:
+            self.phony.update(prerequisites)
+            return []
+        if targets and _special_target_re.match(targets[0]):
+            # Special targets like .SUFFIXES; not supported, but harmless.
+            return []
+
+        # Pattern rules are not used by pto2mk, and are ignored.
+        targets = [target for target in targets if '%' not in target]
+        for target in targets:
+            rule = self.rules.get(target)
+            if rule is None:
+                self.rules[target] = Rule(target, list(prerequisites), list(recipe))
+            else:
+                rule.prerequisites += prerequisites
+                rule.recipe += recipe
+            if self.default_goal is None:
+                self.default_goal = target
+        return targets
+
+    def _condition(self, directive, args) -> bool:
+        if directive in ('ifdef', 'ifndef'):
+            defined = bool(self.lookup(self.expand(args).strip()))
+            return defined == (directive == 'ifdef')
+
+        args = args.strip()
+        if args.startswith('('):
+            left, right = _split_args(args[1:_matching_paren(args, 0)], 2)
+        else:
+            left, right = re.findall(r'"([^"]*)"|\'([^\']*)\'', args)
+            left, right = left[0] or left[1], right[0] or right[1]
+
+        equal = self.expand(left).strip() == self.expand(right).strip()
+        return equal == (directive == 'ifeq')
+
+    def lookup(self, name: str, automatic: dict=None, _depth=0) -> str:
+        """Returns the expanded value of the variable."""
+
+        if name in self.overrides:
+            return self.overrides[name]
+        if automatic and name in automatic:
+            return automatic[name]
+        if name in self.variables:
+            recursive, value = self.variables[name]
+            return self.expand(value, automatic, _depth + 1) if recursive else value
+        return os.environ.get(name, '')
+
+    def expand(self, text: str, automatic: dict=None, _depth=0) -> str:
+        """Expands variable references and function calls in the text."""
+
+        if _depth > 100:
+            raise MakefileError('Recursive variable reference in %r' % text)
+        if '$' not in text:
+            return text
+
+        result = []
+        idx = 0
+        while idx < len(text):
+            dollar = text.find('$', idx)
+            if dollar < 0 or dollar == len(text) - 1:
+                result.append(text[idx:])
+                break
+            result.append(text[idx:dollar])
+
+            char = text[dollar + 1]
+            if char == '$':
+                result.append('$')
+                idx = dollar + 2
+            elif char in '({':
+                end = _matching_paren(text, dollar + 1)
+                result.append(self._expand_reference(text[dollar + 2:end], automatic, _depth))
+                idx = end + 1
+            else:
+                result.append(self.lookup(char, automatic, _depth))
+                idx = dollar + 2
+        return ''.join(result)
+
+    def _expand_reference(self, inner, automatic, depth) -> str:
+        name, _, args = inner.partition(' ')
+        if args and name in _FUNCTIONS:
+            return _FUNCTIONS[name](self, args, automatic, depth + 1)
+
+        return self.lookup(self.expand(inner, automatic, depth + 1), automatic, depth)
+
+
+def _logical_lines(lines):
+    """Joins lines ending in a backslash with the next line."""
+
+    buffer = []
+    for line in lines:
+        if line.endswith('\\'):
+            buffer.append(line[:-1])
+            continue
+        buffer.append(line)
+        yield ' '.join(part.strip() if idx else part.rstrip()
+                       for idx, part in enumerate(buffer))
+        buffer = []
+    if buffer:
+        yield ' '.join(buffer)
+
+
+def _split_words(text: str) -> [str]:
+    """Splits filenames on whitespace, like make does for targets and prerequisites.
+
+    pto2mk escapes spaces in filenames as 'foo\\ bar.tif'; like in make,
+    the backslash is removed from the name.
+    """
+
+    return [word.replace('\\ ', ' ') for word in _word_re.findall(text)]
+
+
+def _strip_comment(line: str) -> str:
+    idx = line.find('#')
+    while idx > 0 and line[idx - 1] == '\\':
+        idx = line.find('#', idx + 1)
+    return line if idx < 0 else line[:idx]
+
+
+def _matching_paren(text: str, start: int) -> int:
+    """Returns the index of the parenthesis or brace closing the one at start."""
+
+    opening = text[start]
+    closing = ')' if opening == '(' else '}'
+    depth = 0
+    for idx in range(start, len(text)):
+        if text[idx] == opening:
+            depth += 1
+        elif text[idx] == closing:
+            depth -= 1
+            if depth == 0:
+                return idx
+    raise MakefileError('Unterminated reference in %r' % text)
+
+
+def _split_args(text: str, maxsplit: int) -> [str]:
+    """Splits function arguments on commas that are not inside references."""
+
+    args = []
+    depth = 0
+    start = 0
+    for idx, char in enumerate(text):
+        if char in '({':
+            depth += 1
+        elif char in ')}':
+            depth -= 1
+        elif char == ',' and depth == 0 and len(args) < maxsplit - 1:
+            args.append(text[start:idx])
+            start = idx + 1
+    args.append(text[start:])
+    return args
+
+
+def _function(nargs):
+    def decorator(func):
+        def wrapper(makefile, args, automatic, depth):
+            args = [makefile.expand(arg, automatic, depth) for arg in _split_args(args, nargs)]
+            return func(*args)
+        return wrapper
+    return decorator
+
+
+def _shell(makefile, args, automatic, depth):
+    command = makefile.expand(args, automatic, depth)
+    output = subprocess.run(command, shell=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    return ' '.join(output.split('\n')).strip()
+
+
+_FUNCTIONS = {
+    'words': _function(1)(lambda text: str(len(text.split()))),
+    'strip': _function(1)(lambda text: ' '.join(text.split())),
+    'subst': _function(3)(lambda old, new, text: text.replace(old, new)),
+    'findstring': _function(2)(lambda find, text: find if find in text else ''),
+    'wildcard': _function(1)(lambda pattern: ' '.join(
+        sorted(fname for part in pattern.split() for fname in glob.glob(part)))),
+    'notdir': _function(1)(lambda text: ' '.join(os.path.basename(part)
+                                                 for part in text.split())),
+    'dir': _function(1)(lambda text: ' '.join(os.path.dirname(part) + '/'
+                                              for part in text.split())),
+    'shell': _shell,
+}
+
+TaskResult = collections.namedtuple('TaskResult', 'target status duration attempts finished')
+
+
+class MakeExecutor:
+    """Runs the recipes of a makefile on a pool of worker threads.
+
+    Each recipe line runs in its own shell, as with make. Of the tasks that
+    are ready to run, the one with the longest chain of work depending on it
+    is started first. Durations come from the state file of previous runs,
+    or else from DEFAULT_COSTS.
+
+    :param state_filename: JSON file recording the finished tasks. A target
+        is only considered up to date when it is recorded there with the
+        same commands, so that outputs of interrupted tasks are rebuilt.
+    :param retries: number of times a failed task is retried.
+    :param keep_going: continue with independent tasks after a failure.
+    :param name: name to prefix log messages with, useful when running
+        several makefiles at once with run_plans().
+    :param task_cores: cores claimed by each task from the budget of
+        run_plans().
+    :param task_memory: memory in bytes claimed by each task from that budget.
+    """
+
+    def __init__(self, makefile: Makefile, jobs: int=1, state_filename: str=None,
+                 retries: int=0, keep_going: bool=False, env: dict=None, name: str=None,
+                 task_cores: int=1, task_memory: int=0):
+        self.makefile = makefile
+        self.jobs = max(1, jobs)
+        self.state_filename = state_filename
+        self.retries = retries
+        self.keep_going = keep_going
+        self.env = env
+        self.name = name
+        self.task_cores = task_cores
+        self.task_memory = task_memory
+
+        self._state_lock = threading.Lock()
+        self.state = self._load_state()
+
+    def _load_state(self) -> dict:
+        if not self.state_filename:
+            return {}
+        try:
+            with open(self.state_filename, 'r', encoding='utf-8') as infile:
+                data = json.load(infile)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            log.warning('Ignoring corrupt state file %s', self.state_filename)
+            return {}
+        if data.get('version') != STATE_VERSION:
+            return {}
+        return data.get('tasks', {})
+
+    def _save_state(self):
+        if not self.state_filename:
+            return
+        tmpname = '%s-%i.tmp' % (self.state_filename, os.getpid())
+        with open(tmpname, 'w', encoding='utf-8') as outfile:
+            json.dump({'version': STATE_VERSION, 'tasks': self.state}, outfile, indent=1)
+        os.replace(tmpname, self.state_filename)
+
+    def _update_state(self, target, entry):
+        with self._state_lock:
+            if entry is None:
+                self.state.pop(target, None)
+            else:
+                self.state[target] = entry
+            self._save_state()
+
+    def _automatic(self, rule: Rule) -> dict:
+        return {'@': rule.target,
+                '<': rule.prerequisites[0] if rule.prerequisites else '',
+                '^': ' '.join(collections.OrderedDict.fromkeys(rule.prerequisites)),
+                '+': ' '.join(rule.prerequisites)}
+
+    def commands(self, rule: Rule) -> [str]:
+        automatic = self._automatic(rule)
+        return [self.makefile.expand(line, automatic) for line in rule.recipe]
+
+    @staticmethod
+    def _command_hash(commands) -> str:
+        return hashlib.sha1('\n'.join(commands).encode('utf-8')).hexdigest()
+
+    def _cost(self, target: str, commands: [str]) -> float:
+        recorded = self.state.get(target, {}).get('duration')
+        if recorded is not None:
+            return recorded
+
+        cost = 0.0
+        for command in commands:
+            words = command.lstrip('@-+ \t').split()
+            if not words:
+                continue
+            program = os.path.splitext(os.path.basename(words[0].strip('"\'')))[0]
+            cost += DEFAULT_COSTS.get(program, UNKNOWN_COST)
+        return cost
+
+    def _collect(self, goals) -> [str]:
+        """Returns all targets needed for the goals, in topological order."""
+
+        order = []
+        visiting = set()
+        done = set()
+
+        def visit(target, parent):
+            if target in done:
+                return
+            if target in visiting:
+                raise MakefileError('Circular dependency on %s' % target)
+            rule = self.makefile.rules.get(target)
+            if rule is None:
+                if os.path.exists(target):
+                    done.add(target)
+                    return
+                raise MakefileError('No rule to make target %r, needed by %r' % (target, parent))
+
+            visiting.add(target)
+            for prerequisite in rule.prerequisites:
+                visit(prerequisite, target)
+            visiting.discard(target)
+            done.add(target)
+            order.append(target)
+
+        for goal in goals:
+            visit(goal, None)
+        return order
+
+    def _mtime(self, filename):
+        try:
+            return os.path.getmtime(filename)
+        except OSError:
+            return None
+
+    def _needs_run(self, rule: Rule, commands, rebuilt: set) -> bool:
+        if any(prerequisite in rebuilt for prerequisite in rule.prerequisites):
+            return True
+        if rule.target in self.makefile.phony:
+            return bool(commands)
+        if not commands:
+            return False
+
+        target_mtime = self._mtime(rule.target)
+        if target_mtime is None:
+            return True
+        for prerequisite in rule.prerequisites:
+            mtime = self._mtime(prerequisite)
+            if mtime is not None and mtime > target_mtime:
+                return True
+
+        entry = self.state.get(rule.target)
+        return entry is None or entry.get('command') != self._command_hash(commands)
+
+    def prepare(self, goals: [str]=None) -> 'Plan':
+        """Determines which tasks to run for the goals, and their priorities.
+
+        :raises MakefileError: when a goal can't be made.
+        """
+
+        goals = goals or [self.makefile.default_goal]
+        order = self._collect(goals)
+
+        commands = {target: self.commands(self.makefile.rules[target]) for target in order}
+        todo = []
+        rebuilt = set()
+        for target in order:
+            if self._needs_run(self.makefile.rules[target], commands[target], rebuilt):
+                todo.append(target)
+                rebuilt.add(target)
+        log.info('%s%i of %i tasks to run, %i up to date', self._prefix(), len(todo),
+                 len(order), len(order) - len(todo))
+
+        # Critical path: the task's own cost plus the longest chain depending on it.
+        todo_set = set(todo)
+        dependents = collections.defaultdict(list)
+        waiting_for = {}
+        for target in todo:
+            prerequisites = {p for p in self.makefile.rules[target].prerequisites
+                             if p in todo_set}
+            waiting_for[target] = len(prerequisites)
+            for prerequisite in prerequisites:
+                dependents[prerequisite].append(target)
+
+        priority = {}
+        for target in reversed(todo):
+            priority[target] = (self._cost(target, commands[target]) +
+                                max((priority[d] for d in dependents[target]), default=0.0))
+
+        return Plan(self, todo, commands, dependents, waiting_for, priority)
+
+    def _prefix(self) -> str:
+        return '%s: ' % self.name if self.name else ''
+
+    def run(self, goals: [str]=None) -> [TaskResult]:
+        """Builds the goals, by default the first target of the makefile.
+
+        :raises MakefileError: when a task failed, after the running tasks finished.
+        """
+
+        results, = run_plans([self.prepare(goals)], self.jobs)
+        failed = [result.target for result in results if result.status == 'failed']
+        if failed:
+            raise MakefileError('%i tasks failed: %s' % (len(failed), ', '.join(failed)))
+        return results
+
+    def _run_task(self, target: str, commands: [str]) -> float:
+        """Runs the commands of a task, returns its duration in seconds."""
+
+        # Forget the target while it's being built, so an interrupted build is redone.
+        self._update_state(target, None)
+
+        start = time.perf_counter()
+        with trace.span(target, 'make'):
+            for command in commands:
+                silent = ignore_errors = False
+                while command[:1] in ('@', '-', '+'):
+                    silent |= command[0] == '@'
+                    ignore_errors |= command[0] == '-'
+                    command = command[1:]
+                command = command.strip()
+                if not command:
+                    continue
+
+                if not silent:
+                    log.debug('%s', command)
+                try:
+                    trace.check_call(command, shell=True, env=self.env)
+                except subprocess.CalledProcessError:
+                    if not ignore_errors:
+                        raise
+        duration = time.perf_counter() - start
+
+        if target not in self.makefile.phony:
+            self._update_state(target, {'command': self._command_hash(commands),
+                                        'duration': duration,
+                                        'finished': time.time()})
+        return duration
+
+
+class Plan:
+    """Tasks of one executor that are still to run, with their dependencies."""
+
+    def __init__(self, executor: MakeExecutor, todo: [str], commands: dict,
+                 dependents: dict, waiting_for: dict, priority: dict):
+        self.executor = executor
+        self.todo = todo
+        self.commands = commands
+        self.dependents = dependents
+        self.waiting_for = waiting_for
+        self.priority = priority
+        self.nr_of_commands = sum(1 for target in todo if commands[target])
+        self.results = []
+        self.failed = False
+        self.done = 0
+        self.running = 0
+
+
+def run_plans(plans: [Plan], jobs: int,
+              budget: scheduler.ResourceBudget=None) -> [[TaskResult]]:
+    """Runs the tasks of several makefiles interleaved, on one pool of workers.
+
+    Of all the tasks that are ready, the one with the longest critical path
+    is started first, regardless of its makefile. No more than the jobs of
+    its executor run at the same time for each makefile. A failed task only
+    stops the makefile it belongs to, unless that executor has keep_going set.
+
+    :param plans: as returned by MakeExecutor.prepare().
+    :param jobs: maximum number of tasks running at the same time, in total.
+    :param budget: when given, a task only starts when the budget has room
+        for the task_cores and task_memory of its executor.
+    :returns: the task results, in order of completion, for each plan.
+        Tasks that never ran because of a failure are included last, with
+        status 'skipped'.
+    """
+
+    ready = []
+    sequence = itertools.count()
+
+    def push(plan_idx, target):
+        plan = plans[plan_idx]
+        heapq.heappush(ready, (-plan.priority[target], next(sequence), plan_idx, target))
+
+    for plan_idx, plan in enumerate(plans):
+        for target in plan.todo:
+            if not plan.waiting_for[target]:
+                push(plan_idx, target)
+
+    running = {}
+    attempts = collections.Counter()
+
+    def finish(plan_idx, target, status, duration):
+        plan = plans[plan_idx]
+        plan.results.append(TaskResult(target, status, duration, attempts[plan_idx, target],
+                                       time.time()))
+        if status != 'ok':
+            plan.failed = True
+            return
+        for dependent in plan.dependents[target]:
+            plan.waiting_for[dependent] -= 1
+            if not plan.waiting_for[dependent]:
+                push(plan_idx, dependent)
+
+    with concurrent.futures.ThreadPoolExecutor(max(1, jobs)) as pool:
+        while ready or running:
+            # Tasks of makefiles that run all their jobs already, put back afterwards.
+            deferred = []
+            while ready and len(running) < jobs:
+                _, _, plan_idx, target = ready[0]
+                plan = plans[plan_idx]
+                executor = plan.executor
+                if plan.failed and not executor.keep_going:
+                    heapq.heappop(ready)
+                    continue
+                if not plan.commands[target]:
+                    # Nothing to run, like the 'all' target.
+                    heapq.heappop(ready)
+                    finish(plan_idx, target, 'ok', 0.0)
+                    continue
+                if plan.running >= executor.jobs:
+                    deferred.append(heapq.heappop(ready))
+                    continue
+                if budget is not None and not budget.try_acquire(executor.task_cores,
+                                                                 executor.task_memory):
+                    break
+
+                heapq.heappop(ready)
+                attempts[plan_idx, target] += 1
+                plan.running += 1
+                future = pool.submit(executor._run_task, target, plan.commands[target])
+                running[future] = plan_idx, target
+            for item in deferred:
+                heapq.heappush(ready, item)
+
+            if not running:
+                break
+
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                plan_idx, target = running.pop(future)
+                plan = plans[plan_idx]
+                plan.running -= 1
+                executor = plan.executor
+                if budget is not None:
+                    budget.release(executor.task_cores, executor.task_memory)
+
+                try:
+                    duration = future.result()
+                except subprocess.CalledProcessError as ex:
+                    if attempts[plan_idx, target] <= executor.retries:
+                        log.warning('%s%s failed with exit status %i, retrying',
+                                    executor._prefix(), target, ex.returncode)
+                        push(plan_idx, target)
+                        continue
+                    log.error('%s%s failed with exit status %i',
+                              executor._prefix(), target, ex.returncode)
+                    finish(plan_idx, target, 'failed', None)
+                    continue
+
+                plan.done += 1
+                finish(plan_idx, target, 'ok', duration)
+                log.info('%s[%i/%i] %s done in %.1f seconds', executor._prefix(),
+                         plan.done, plan.nr_of_commands, target, duration)
+
+    for plan in plans:
+        finished = {result.target for result in plan.results}
+        plan.results += [TaskResult(target, 'skipped', None, 0, None)
+                         for target in plan.todo if target not in finished]
+    return [plan.results for plan in plans]
+
+
+def run(makefile_name: str, goals: [str]=None, variables: dict=None, jobs: int=1,
+        resume: bool=True, retries: int=0, keep_going: bool=False,
+        env: dict=None) -> [TaskResult]:
+    """Parses and runs a makefile.
+
+    :param resume: keep the state in makefile_name + '.state', so that a
+        next run continues where an interrupted one stopped.
+    """
+
+    makefile = Makefile.parse(makefile_name, variables)
+    state_filename = makefile_name + '.state' if resume else None
+    executor = MakeExecutor(makefile, jobs, state_filename, retries, keep_going, env)
+    return executor.run(goals)
@@ -2,17 +2,16 @@
 Data model for projects.
 """
 
-import copy
-import json
+import collections.abc
+import numbers
 import os.path
 import logging
 import os
 import threading
-import math
-import PIL.Image
-import PIL.ExifTags
 
-from . import settings, hugin
+import numpy as np
+
+from . import settings, hugin, exif, geometry, trace
 
 log = logging.getLogger(__name__)
 
@@ -58,31 +57,236 @@ CLONE_FROM_FIRST = 'v Ra Rb Rc Rd Re a b c d e g t Va Vb Vc Vd Vx Vy'.split()
 # Params that are always cloned from the anchor image in the stack
 CLONE_FROM_STACK = 'y p r TrX TrY TrZ j'.split()
 
+PARAM_KEYS = tuple(DEFAULT_PARAMS)
+PARAM_INDEX = {key: col for col, key in enumerate(PARAM_KEYS)}
+
+
+class ParameterTable:
+    """The parameters of a list of images, one row per image.
+
+    Every row has, for each key in PARAM_KEYS:
+
+    - value: the value as float, and is_int to tell whether it was an int;
+    - link: index of the image the parameter is linked to, or -1 when the
+      image has its own value. This is '=N' in the Hugin project.
+    """
+
+    DTYPE = np.dtype([
+        ('value', np.float64, (len(PARAM_KEYS),)),
+        ('link', np.int32, (len(PARAM_KEYS),)),
+        ('is_int', np.bool_, (len(PARAM_KEYS),)),
+    ])
+
+    def __init__(self, array: np.ndarray):
+        self.array = array
+        self.superseded = False  # True once rows were gathered into another table
+
+    @classmethod
+    def defaults(cls, nr_of_rows: int) -> 'ParameterTable':
+        """Returns a table with DEFAULT_PARAMS in every row."""
+
+        return cls(np.repeat(_default_row, nr_of_rows))
+
+    @classmethod
+    def from_columns(cls, keys, value, link, is_int) -> 'ParameterTable':
+        """Creates the table from (rows, keys) arrays, for example from a snapshot.
+
+        The values are copied, so the arrays may be read-only memory maps.
+        """
+
+        cols = [list(keys).index(key) for key in PARAM_KEYS]
+        table = cls(np.empty(len(value), dtype=cls.DTYPE))
+        table.array['value'] = np.asarray(value)[:, cols]
+        table.array['link'] = np.asarray(link)[:, cols]
+        table.array['is_int'] = np.asarray(is_int)[:, cols]
+        return table
+
+    @classmethod
+    def gather(cls, views) -> 'ParameterTable':
+        """Returns a table with the rows of the views, and moves the views onto it."""
+
+        if not views:
+            return cls(np.empty(0, dtype=cls.DTYPE))
+
+        if all(view.table is views[0].table for view in views):
+            array = views[0].table.array[[view.row for view in views]]
+        else:
+            array = np.empty(len(views), dtype=cls.DTYPE)
+            for row, view in enumerate(views):
+                array[row] = view.table.array[view.row]
+
+        table = cls(array)
+        for row, view in enumerate(views):
+            view.table.superseded = True
+            view.table = table
+            view.row = row
+        return table
+
+    def __len__(self):
+        return len(self.array)
+
+    def get(self, row: int, key: str):
+        """Returns the parameter as int, float or '=N' link."""
+
+        col = PARAM_INDEX[key]
+        record = self.array[row]
+        link = record['link'][col]
+        if link >= 0:
+            return '=%i' % link
+        if record['is_int'][col]:
+            return int(record['value'][col])
+        return float(record['value'][col])
+
+    def set(self, row: int, key: str, value):
+        """Sets the parameter to an int, float or '=N' link."""
+
+        col = PARAM_INDEX[key]
+        record = self.array[row]
+        if isinstance(value, str):
+            if not value.startswith('='):
+                raise ValueError('Parameter %s should be a number or =N link, not %r'
+                                 % (key, value))
+            record['link'][col] = int(value[1:])
+            record['value'][col] = 0
+            record['is_int'][col] = True
+            return
+
+        record['link'][col] = -1
+        record['value'][col] = value
+        record['is_int'][col] = isinstance(value, numbers.Integral)
+
+    def dicts(self, start: int=0, stop: int=None) -> [dict]:
+        """Returns the parameters of the rows as {key: value} dicts."""
+
+        array = self.array[start:stop]
+        values = array['value'].astype(object)
+        is_int = array['is_int']
+        values[is_int] = array['value'][is_int].astype(np.int64).astype(object)
+
+        linked = array['link'] >= 0
+        if linked.any():
+            links = array['link'][linked]
+            names = np.array(['=%i' % link for link in range(links.max() + 1)], dtype=object)
+            values[linked] = names[links]
+        return [dict(zip(PARAM_KEYS, row)) for row in values.tolist()]
+
+    def resolved(self, rows=None) -> 'ParameterTable':
+        """Returns the rows with links replaced by the value they refer to.
+
+        Links are followed for all rows and parameters at once, one step
+        per iteration, so chains of links like '=3' to '=0' are resolved too.
+
+        :param rows: indices of the rows to return, by default all of them.
+        """
+
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.intp)
+        links = self.array['link']
+        cols = np.arange(len(PARAM_KEYS))
+
+        target = np.repeat(rows[:, None], len(cols), axis=1)
+        for _ in range(len(self) + 1):
+            link = links[target, cols]
+            linked = link >= 0
+            if not linked.any():
+                break
+            target[linked] = link[linked]
+        else:
+            raise ValueError('Circular links between image parameters')
+
+        array = np.empty(len(rows), dtype=self.DTYPE)
+        array['value'] = self.array['value'][target, cols]
+        array['is_int'] = self.array['is_int'][target, cols]
+        array['link'] = -1
+        return ParameterTable(array)
+
+    def column(self, key: str) -> np.ndarray:
+        """Returns the values of the parameter as float array, ignoring links."""
+
+        return self.array['value'][:, PARAM_INDEX[key]]
+
+
+def _default_row() -> np.ndarray:
+    table = ParameterTable(np.empty(1, dtype=ParameterTable.DTYPE))
+    for key, value in DEFAULT_PARAMS.items():
+        table.set(0, key, value)
+    return table.array
+
+
+_default_row = _default_row()
+
+
+class ImageParameters(collections.abc.MutableMapping):
+    """The parameters of one image, as dict-like view on a row of a ParameterTable.
+
+    Linked parameters have the value '=N', where N is the index of the
+    image they are linked to.
+    """
+
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table: ParameterTable, row: int):
+        self.table = table
+        self.row = row
+
+    def __getitem__(self, key):
+        return self.table.get(self.row, key)
+
+    def __setitem__(self, key, value):
+        self.table.set(self.row, key, value)
+
+    def __delitem__(self, key):
+        raise TypeError('Image parameters cannot be removed')
+
+    def __iter__(self):
+        return iter(PARAM_KEYS)
+
+    def __len__(self):
+        return len(PARAM_KEYS)
+
+    def copy(self) -> dict:
+        return self.table.dicts(self.row, self.row + 1)[0]
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.copy())
+
 
 class Image:
-    def __init__(self, filename):
-        self.parameters = DEFAULT_PARAMS.copy()
+    def __init__(self, filename, metadata: exif.ImageMetadata=None):
+        self._parameters = ImageParameters(ParameterTable.defaults(1), 0)
         self.filename = filename
+        self.digest = None  # SHA-1 of the file contents, if known
+
+        self.calculate_ev(metadata)
 
-        self.calculate_ev()
+    @classmethod
+    def from_table(cls, filename, table: ParameterTable, row: int,
+                   digest: str=None) -> 'Image':
+        """Creates the image on a row of a parameter table, without reading the file."""
+
+        image = cls.__new__(cls)
+        image._parameters = ImageParameters(table, row)
+        image.filename = filename
+        image.digest = digest
+        return image
+
+    @property
+    def parameters(self) -> ImageParameters:
+        return self._parameters
 
-    def calculate_ev(self):
-        img = PIL.Image.open(self.filename)
-        exif = {PIL.ExifTags.TAGS[k]: v
-                for k, v in img._getexif().items()
-                if k in PIL.ExifTags.TAGS}
+    @parameters.setter
+    def parameters(self, parameters: dict):
+        self._parameters.update(DEFAULT_PARAMS)
+        self._parameters.update(parameters)
 
-        # Determine width/height in pixels too, now that we have the file open anyway.
-        width, height = img.size
-        self.parameters['w'] = width
-        self.parameters['h'] = height
+    def calculate_ev(self, metadata: exif.ImageMetadata=None):
+        if metadata is None:
+            metadata = exif.read_metadata(self.filename)
 
-        # Source: http://en.wikipedia.org/wiki/Exposure_value
-        f_nr = exif['FNumber'][0] / exif['FNumber'][1]
-        t = exif['ExposureTime'][0] / exif['ExposureTime'][1]
-        ev = math.log2(f_nr ** 2 / t)
+        # Determine width/height in pixels too, now that we have the metadata anyway.
+        self.parameters['w'] = metadata.width
+        self.parameters['h'] = metadata.height
+        self.parameters['Eev'] = metadata.exposure_value
 
-        self.parameters['Eev'] = ev
 
 class Project:
     def __init__(self):
@@ -93,13 +297,57 @@ class Project:
         self.settings = settings.DEFAULT_SETTINGS()
         self.control_points = []  # list of control point line strings
         self.average_ev = 0.0  # average exposure value
+        self.canvas_scale = 1.0  # factor applied to the optimal canvas size
+        self.max_canvas_width = geometry.MAX_CANVAS_WIDTH  # None = no cap
+
+        # Parameter table of the photos, and the photos it was gathered for.
+        self._table = None
+        self._table_photos = []
 
     @property
     def is_hdr(self) -> bool:
         return self.stack_size > 1
 
-    def load_photos(self, filenames):
-        self.photos = [Image(filename) for filename in sorted(filenames)]
+    @property
+    def canvas_size(self) -> (int, int):
+        """Width and height of the output canvas, from the resolution of the photos."""
+
+        table = self.parameter_table.resolved()
+        return geometry.optimal_canvas_size(
+            table.column('w'), table.column('v'), table.column('f'),
+            scale=self.canvas_scale, max_width=self.max_canvas_width)
+
+    @property
+    def parameter_table(self) -> ParameterTable:
+        """The parameters of all photos, one row per photo in the order of self.photos.
+
+        The table is gathered again from the photos when they were replaced,
+        added or moved around, or moved to the table of another project.
+        """
+
+        photos = self.photos
+        table = self._table
+        if table is None or table.superseded or photos != self._table_photos:
+            table = self._table = ParameterTable.gather([photo.parameters for photo in photos])
+            self._table_photos = list(photos)
+        return table
+
+    def load_photos(self, filenames, max_workers: int=None,
+                    cache: exif.MetadataCache=None):
+        """Loads the photos, reading their metadata in parallel.
+
+        :param max_workers: number of threads reading metadata, None = let
+            concurrent.futures decide.
+        :param cache: when given, only photos not in the cache are read.
+        """
+
+        filenames = sorted(filenames)
+        with trace.span('EXIF ingest', photos=len(filenames)):
+            if cache is None:
+                metadata = exif.read_all_metadata(filenames, max_workers)
+            else:
+                metadata = cache.read_all(filenames, max_workers)
+        self.photos = [Image(filename, meta) for filename, meta in zip(filenames, metadata)]
 
     def move_anchor(self, anchor_idx):
         """Moves the N'th image to the front of each stack."""
@@ -180,35 +428,34 @@ class Project:
 
 
     @classmethod
-    def load(cls, filename: str):
-        with open(filename, 'r', encoding='utf-8') as infile:
-            data = json.load(infile)
+    def load(cls, filename: str) -> 'Project':
+        """Loads a snapshot written by save(), see quickypano.snapshot."""
 
-        if data['VERSION'] > 1:
-            raise ValueError('Unsupported value %i' % data['VERSION'])
+        from . import snapshot
 
-        project = Project()
-        for key, value in data['project'].items():
-            setattr(project, key, value)
-
-        project.settings = settings.AbstractSettings()
-        project.settings.from_json(data['project']['settings'])
+        return snapshot.load(filename, cls)
 
     def save(self, filename: str):
-        data = {
-            'VERSION': 1,
-            'project': self.__dict__,
-        }
-        data['project']['settings'] = data['project']['settings'].to_json()
+        """Writes the project as snapshot, see quickypano.snapshot."""
+
+        from . import snapshot
 
-        with open(filename, 'w', encoding='utf-8') as outfile:
-            json.dump(data, outfile, indent=4, sort_keys=True)
+        snapshot.save(self, filename)
 
     def create_hugin_project(self):
+        with trace.span('write PTO', filename=os.path.basename(self.hugin_filename)):
+            self._write_hugin_project()
+
+    def _write_hugin_project(self):
         # Create the PTO
+        if not hugin.use_pto_var:
+            with open(self.hugin_filename, 'w', encoding='utf-8') as outfile:
+                hugin.write(outfile, self)
+            log.debug('Saved project as %s', self.hugin_filename)
+            return
 
         with open(self.hugin_filename, 'w', encoding='utf-8') as outfile:
-            hugin.write(outfile, self)
+            hugin.write(outfile, self, optimize_vars=())
 
         # Modify it using pto_var
         basedir = os.path.dirname(self.hugin_filename)
@@ -221,25 +468,33 @@ class Project:
 
         log.debug('Saved project as %s', self.hugin_filename)
 
+    def resolved_parameter(self, idx, key):
+        """Returns the photo's parameter value, following '=N' references to other photos."""
+
+        return self.parameter_table.resolved([idx]).get(0, key)
+
     def get_slice(self, indices):
-        # Clone the project
+        """Returns a project with only the given photos.
+
+        References to other photos are replaced by the referred value. The
+        photos of the slice share nothing with ours but the filenames, so
+        they can be changed freely.
+        """
+
+        indices = list(indices)
+        table = self.parameter_table.resolved(indices)
+
         clone = Project()
         clone.filename = self.filename
         clone.hugin_filename = self.hugin_filename
-        clone.photos = [copy.deepcopy(self.photos[i]) for i in indices]
+        clone.photos = [Image.from_table(self.photos[idx].filename, table, row,
+                                         self.photos[idx].digest)
+                        for row, idx in enumerate(indices)]
         clone.stack_size = self.stack_size
         clone.settings = self.settings
-
-        # Fix up references to other photos by copying the referred value.
-        for photo in clone.photos:
-            new_params = {}
-            for key, value in photo.parameters.items():
-                # Keep following references until we've found an actual value.
-                while isinstance(value, str) and value.startswith('='):
-                    refidx = int(value[1:])
-                    value = self.photos[refidx].parameters[key]
-                new_params[key] = value
-
-            photo.parameters.update(new_params)
+        clone.canvas_scale = self.canvas_scale
+        clone.max_canvas_width = self.max_canvas_width
+        clone._table = table
+        clone._table_photos = list(clone.photos)
 
         return clone
@@ -0,0 +1,77 @@
+"""
+Reduced-size proxy images for control point detection.
+"""
+
+import concurrent.futures
+import hashlib
+import logging
+import os
+import os.path
+
+import PIL.Image
+
+log = logging.getLogger(__name__)
+
+
+def proxy_filename(proxy_dir: str, filename: str, scale: int) -> str:
+    """Returns the proxy filename, unique for the path of the image."""
+
+    basename = os.path.splitext(os.path.basename(filename))[0]
+    path_hash = hashlib.sha1(os.path.normcase(os.path.abspath(filename)).encode('utf-8'))
+    return os.path.join(proxy_dir, '%s-%s-1_%i.jpg' % (basename, path_hash.hexdigest()[:8], scale))
+
+
+def proxy_size(width: int, height: int, scale: int) -> (int, int):
+    return max(1, width // scale), max(1, height // scale)
+
+
+def make_proxy(filename: str, proxy_fname: str, scale: int) -> (int, int):
+    """Writes a proxy image downscaled by the given factor, returns its size.
+
+    JPEG files are decoded in draft mode, so that the DCT scaling of the
+    decoder does most of the work and the full-size image is never decoded.
+    """
+
+    img = PIL.Image.open(filename)
+    size = proxy_size(img.width, img.height, scale)
+    img.draft('RGB', size)
+    if img.size != size:
+        img = img.resize(size, PIL.Image.BILINEAR)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    tmpname = '%s-%i.tmp.jpg' % (proxy_fname, os.getpid())
+    img.save(tmpname, quality=95)
+    os.replace(tmpname, proxy_fname)
+    return img.size
+
+
+def make_proxies(filenames, proxy_dir: str, scale: int, max_workers: int=None) -> [str]:
+    """Creates proxies for the files in parallel processes, returns the proxy filenames.
+
+    Existing proxies that are newer than their source file are reused.
+    """
+
+    os.makedirs(proxy_dir, exist_ok=True)
+    filenames = list(filenames)
+    proxy_fnames = [proxy_filename(proxy_dir, fname, scale) for fname in filenames]
+
+    todo = []
+    for fname, proxy_fname in zip(filenames, proxy_fnames):
+        try:
+            if os.path.getmtime(proxy_fname) >= os.path.getmtime(fname):
+                continue
+        except FileNotFoundError:
+            pass
+        todo.append((fname, proxy_fname))
+
+    log.info('Creating %i of %i proxy images at 1/%i size',
+             len(todo), len(filenames), scale)
+    if todo:
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            futures = [executor.submit(make_proxy, fname, proxy_fname, scale)
+                       for fname, proxy_fname in todo]
+            for future in futures:
+                future.result()
+
+    return proxy_fnames
@@ -0,0 +1,642 @@
+"""
+Rendering of Hugin projects with make.
+"""
+
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+import os.path
+import re
+import time
+
+import numpy as np
+
+from . import cache, exif, hugin, huginpto, makefile, scheduler, tiff, trace
+
+log = logging.getLogger(__name__)
+
+# Rough estimates of the peak memory use of a single make job, i.e. a nona
+# remapping one image or an enfuse fusing one stack. Each job holds the
+# source image, plus its layer of the output canvas.
+MAKE_BASE_MEMORY = 200 * 2 ** 20
+MAKE_BYTES_PER_SOURCE_PIXEL = 16
+MAKE_BYTES_PER_LAYER_PIXEL = 24
+
+# Layers overlap, so each covers more than its share of the canvas.
+LAYER_OVERLAP = 2
+
+# Running more nona processes on the GPU at once doesn't make it any faster.
+GPU_MAX_JOBS = 4
+
+# Tiled rendering: default tile size, and the margin around each tile that
+# is rendered and blended too, but cut off again when assembling. The margin
+# gives enblend room to place its seams the same way in neighbouring tiles.
+TILE_SIZE = 4096
+TILE_MARGIN = 128
+
+# Tiles are rendered as uncompressed TIFF, so that they can be assembled
+# strip by strip at their full bit depth, see quickypano.tiff.
+TILE_OUTPUT_OPTIONS = collections.OrderedDict([
+    ('#hugin_outputImageType', 'tif'),
+    ('#hugin_outputImageTypeCompression', 'NONE'),
+    ('#hugin_outputImageTypeHDR', 'tif'),
+    ('#hugin_outputImageTypeHDRCompression', 'NONE'),
+])
+
+# Number of output rows assembled at a time.
+ASSEMBLE_ROWS = 64
+
+_crop_re = re.compile(r'(?<=\s)S\d+,\d+,\d+,\d+(?=\s)')
+
+Tile = collections.namedtuple('Tile', 'row column crop inner')
+
+IMAGE_EXTENSIONS = ('.tif', '.tiff', '.jpg', '.jpeg', '.png', '.exr', '.hdr')
+
+# Bump when the render cache key changes meaning.
+RENDER_CACHE_VERSION = 2
+
+# Renderer of qp_stitch, for render_key(); see make_renderer() for qp_make.
+STITCH_RENDERER = {'renderer': 'hugin_stitch_project'}
+
+# Final outputs of a project, as (option, suffix, HDR); see Hugin's pto2mk.
+PROJECT_OUTPUTS = (
+    ('#hugin_outputLDRBlended', '', False),
+    ('#hugin_outputLDRExposureLayersFused', '_fused', False),
+    ('#hugin_outputLDRExposureBlended', '_blended_fused', False),
+    ('#hugin_outputHDRBlended', '_hdr', True),
+)
+
+# PTO lines that change the rendered image. Of the '#hugin_' options only
+# the ones about output and blending matter; other comments don't.
+RENDER_COMMANDS = ('p', 'i', 'k', 'm')
+RENDER_OPTION_PREFIXES = ('#hugin_output', '#hugin_blender', '#hugin_enblend', '#hugin_enfuse',
+                          '#hugin_hdrmerge', '#hugin_verdandi', '#hugin_ROI')
+
+_token_re = re.compile(r'([A-Za-z]+)("[^"]*"|\S*)')
+
+MakePlan = collections.namedtuple('MakePlan', 'jobs nona_threads job_memory reasons')
+
+
+def plan_make(pto_filename: str, cores: int=None, memory: int=None, on_gpu: bool=False,
+              jobs: int=None, nona_threads: int=None) -> MakePlan:
+    """Chooses the number of make jobs and nona threads for rendering the project.
+
+    The job count is limited by the number of cores, by the estimated
+    memory use of each job in the given memory budget, and by the number of
+    images. Cores not used by jobs are given to nona as threads.
+
+    :param cores: number of cores, None = os.cpu_count()
+    :param memory: memory budget in bytes, None = the memory available now
+    :param jobs: number of jobs, None = choose automatically
+    :param nona_threads: number of nona threads, None = choose automatically
+    :returns: the plan, including the estimated memory per job in bytes and
+        the reasoning as list of strings
+    """
+
+    cores = cores or os.cpu_count() or 1
+    if memory is None:
+        memory = scheduler.available_memory()
+    reasons = []
+
+    with huginpto.HuginPto(pto_filename, lazy=True) as pto:
+        panorama = pto.parsed['p'][0] if pto.count('p') else {}
+        images = pto.parsed['i']
+
+    canvas_w, canvas_h = int(panorama.get('w', 0)), int(panorama.get('h', 0))
+    if panorama.get('S'):
+        # Only the crop region is rendered.
+        left, right, top, bottom = (int(value) for value in panorama['S'].split(','))
+        canvas_w, canvas_h = right - left, bottom - top
+    source_pixels = max((int(image.get('w', 0)) * int(image.get('h', 0)) for image in images),
+                        default=0)
+    layers = sum(1 for image in images if not image.get('y', '').startswith('=')) or 1
+    layer_pixels = min(canvas_w * canvas_h, LAYER_OVERLAP * canvas_w * canvas_h // layers)
+    job_memory = (MAKE_BASE_MEMORY + MAKE_BYTES_PER_SOURCE_PIXEL * source_pixels +
+                  MAKE_BYTES_PER_LAYER_PIXEL * layer_pixels)
+    reasons.append('%ix%i canvas, %i images of up to %.1f MPixel in %i layers: '
+                   'estimated %i MiB per job' % (canvas_w, canvas_h, len(images),
+                                                 source_pixels / 1e6, layers,
+                                                 job_memory // 2 ** 20))
+
+    if jobs:
+        reasons.append('using %i jobs as requested' % jobs)
+    else:
+        jobs = cores
+        reasons.append('%i cores allow %i jobs' % (cores, jobs))
+
+        if memory is None:
+            reasons.append('available memory is unknown, not limiting jobs by memory')
+        else:
+            memory_jobs = max(1, memory // job_memory)
+            reasons.append('%i MiB of memory allows %i jobs' % (memory // 2 ** 20, memory_jobs))
+            jobs = min(jobs, memory_jobs)
+
+        if len(images) and len(images) < jobs:
+            jobs = len(images)
+            reasons.append('limited to %i jobs, one per image' % jobs)
+        if on_gpu and jobs > GPU_MAX_JOBS:
+            jobs = GPU_MAX_JOBS
+            reasons.append('limited to %i jobs on the GPU' % jobs)
+
+    if nona_threads:
+        reasons.append('using %i nona threads as requested' % nona_threads)
+    else:
+        nona_threads = max(1, cores // jobs)
+        reasons.append('%i cores over %i jobs gives %i nona threads per job' % (
+            cores, jobs, nona_threads))
+
+    return MakePlan(jobs, nona_threads, job_memory, reasons)
+
+
+def render_batch(pto_filenames: [str], budget: scheduler.ResourceBudget, on_gpu: bool=False,
+                 nona_threads: int=None, retries: int=0, keep_going: bool=False) -> [dict]:
+    """Renders many projects at once, sharing one budget of cores and memory.
+
+    The makefiles are created by pto2mk in parallel, after which the tasks
+    of all projects are interleaved by quickypano.makefile.run_plans(),
+    so that the cores stay busy while a project waits for its final blend.
+    Every task claims nona_threads cores, 1 by default, and the estimated
+    memory per job of its project. Each project runs at most the number of
+    jobs that plan_make() chose for it within the budget.
+
+    A project that fails doesn't stop the others.
+
+    :returns: a summary for each project, in the order of pto_filenames.
+    """
+
+    start_time = time.time()
+    summaries = collections.OrderedDict(
+        (pto, {'project': pto, 'status': 'ok'}) for pto in pto_filenames)
+
+    makefiles = {}
+    with scheduler.BudgetExecutor(budget.cores, budget) as executor:
+        futures = {executor.submit(hugin.pto2mk, pto): pto for pto in pto_filenames}
+        for future in concurrent.futures.as_completed(futures):
+            pto = futures[future]
+            try:
+                makefiles[pto] = future.result()
+            except Exception as ex:
+                log.error('%s: pto2mk failed: %s', pto, ex)
+                summaries[pto].update(status='pto2mk failed', error=str(ex))
+    log.info('Created %i makefiles in %.1f seconds', len(makefiles), time.time() - start_time)
+
+    plans = []
+    for pto in pto_filenames:
+        if pto not in makefiles:
+            continue
+        mkfile = makefiles[pto]
+        make_plan = plan_make(pto, cores=budget.cores, memory=budget.memory, on_gpu=on_gpu,
+                              nona_threads=nona_threads or 1)
+        try:
+            executor = hugin.native_executor(mkfile, on_gpu, make_plan.jobs,
+                                             make_plan.nona_threads, retries,
+                                             keep_going=keep_going, name=pto,
+                                             task_cores=make_plan.nona_threads,
+                                             task_memory=make_plan.job_memory)
+            plans.append((pto, executor.prepare()))
+        except makefile.MakefileError as ex:
+            log.error('%s: %s', pto, ex)
+            summaries[pto].update(status='makefile error', error=str(ex))
+            continue
+        summaries[pto].update(makefile=mkfile, jobs=make_plan.jobs,
+                              nona_threads=make_plan.nona_threads,
+                              job_memory_mib=make_plan.job_memory // 2 ** 20)
+
+    jobs = min(budget.cores, GPU_MAX_JOBS) if on_gpu else budget.cores
+    all_results = makefile.run_plans([plan for _, plan in plans], jobs, budget)
+
+    for (pto, _), results in zip(plans, all_results):
+        statuses = collections.Counter(result.status for result in results)
+        durations = [result.duration for result in results if result.duration]
+        finished = [result.finished for result in results if result.finished]
+        summaries[pto].update(
+            status='failed' if statuses['failed'] else 'ok',
+            tasks_run=len(durations),
+            tasks_failed=statuses['failed'],
+            tasks_skipped=statuses['skipped'],
+            task_seconds=sum(durations),
+            finished_after_seconds=max(finished) - start_time if finished else 0.0,
+            failed_targets=[result.target for result in results if result.status == 'failed'],
+        )
+
+    return list(summaries.values())
+
+
+def panorama_region(pto_filename: str) -> (int, int, int, int):
+    """Returns the (left, right, top, bottom) of the output, which is the crop
+    region of the 'p' line, or the entire canvas if there is none."""
+
+    with huginpto.HuginPto(pto_filename, lazy=True) as pto:
+        panorama = pto.parsed['p'][0]
+    if panorama.get('S'):
+        return tuple(int(value) for value in panorama['S'].split(','))
+    return 0, int(panorama['w']), 0, int(panorama['h'])
+
+
+def plan_tiles(region: (int, int, int, int), tile_size: int=TILE_SIZE,
+               margin: int=TILE_MARGIN) -> [Tile]:
+    """Splits the region into tiles of at most tile_size pixels square.
+
+    The inner region of each tile is the part it contributes to the final
+    image; the crop region is that plus the margin, clipped to the region.
+
+    >>> [tile.crop for tile in plan_tiles((0, 8192, 0, 4096), 4096, 100)]
+    [(0, 4196, 0, 4096), (3996, 8192, 0, 4096)]
+    """
+
+    left, right, top, bottom = region
+    tiles = []
+    for row, tile_top in enumerate(range(top, bottom, tile_size)):
+        tile_bottom = min(bottom, tile_top + tile_size)
+        for column, tile_left in enumerate(range(left, right, tile_size)):
+            tile_right = min(right, tile_left + tile_size)
+            crop = (max(left, tile_left - margin), min(right, tile_right + margin),
+                    max(top, tile_top - margin), min(bottom, tile_bottom + margin))
+            tiles.append(Tile(row, column, crop, (tile_left, tile_right, tile_top, tile_bottom)))
+    return tiles
+
+
+def tile_filename(pto_filename: str, tile: Tile) -> str:
+    return '%s_tile_%02i_%02i.pto' % (pto_filename[:-len('.pto')], tile.row, tile.column)
+
+
+def write_tile_pto(pto_filename: str, tile: Tile) -> str:
+    """Writes a copy of the project that only renders the crop region of the tile,
+    as uncompressed TIFF.
+
+    :returns: the filename of the tile project, next to the project itself so
+        that relative image paths still work.
+    """
+
+    left, right, top, bottom = tile.crop
+    crop = 'S%i,%i,%i,%i' % (left, right, top, bottom)
+
+    outname = tile_filename(pto_filename, tile)
+    with open(pto_filename, 'r', encoding='utf-8') as infile, \
+            open(outname, 'w', encoding='utf-8') as outfile:
+        for line in infile:
+            if line.startswith('p '):
+                line, count = _crop_re.subn(crop, line)
+                if not count:
+                    line = 'p %s %s' % (crop, line[2:])
+            elif line.split(' ', 1)[0].strip() in TILE_OUTPUT_OPTIONS:
+                continue
+            outfile.write(line)
+        for option, value in TILE_OUTPUT_OPTIONS.items():
+            print(option, value, file=outfile)
+    return outname
+
+
+def remove_tile_files(tile_pto: str):
+    """Removes the tile project, its makefile and state, and everything it rendered."""
+
+    mkfile_name = hugin.makefile_name(tile_pto)
+    prefix = tile_pto[:-len('.pto')]
+    filenames = [tile_pto, mkfile_name, mkfile_name + '.state']
+    if os.path.exists(mkfile_name):
+        mkfile = makefile.Makefile.parse(mkfile_name)
+        # Only what the tile rendered, never a source image.
+        filenames += [target for target in mkfile.rules
+                      if target not in mkfile.phony and target.startswith(prefix)]
+
+    for filename in filenames:
+        try:
+            os.unlink(filename)
+        except FileNotFoundError:
+            pass
+
+
+def project_outputs(pto_filename: str) -> [str]:
+    """Returns the final images the project rendered, from its output options.
+
+    Like render_outputs(), but without a makefile. Layers and stacks are
+    not included.
+    """
+
+    options = {}
+    with open(pto_filename, 'r', encoding='utf-8') as infile:
+        for line in infile:
+            if line.startswith('#hugin_output'):
+                name, _, value = line.strip().partition(' ')
+                options[name] = value.strip()
+
+    prefix = pto_filename[:-len('.pto')]
+    outputs = []
+    for option, suffix, is_hdr in PROJECT_OUTPUTS:
+        if options.get(option) != 'true':
+            continue
+        if is_hdr:
+            extension = options.get('#hugin_outputImageTypeHDR', 'exr')
+        else:
+            extension = options.get('#hugin_outputImageType', 'tif')
+        output = '%s%s.%s' % (prefix, suffix, extension)
+        if os.path.exists(output):
+            outputs.append(output)
+    return outputs
+
+
+def render_outputs(makefile_name: str) -> [str]:
+    """Returns the images the default goal of the makefile rendered."""
+
+    mkfile = makefile.Makefile.parse(makefile_name)
+    goal = mkfile.rules[mkfile.default_goal]
+    return [target for target in goal.prerequisites
+            if os.path.splitext(target)[1].lower() in IMAGE_EXTENSIONS and
+            os.path.exists(target)]
+
+
+def tile_output(makefile_name: str) -> str:
+    """Returns the final image the makefile of a tile renders."""
+
+    for target in render_outputs(makefile_name):
+        if os.path.splitext(target)[1].lower() in ('.tif', '.tiff'):
+            return target
+    raise makefile.MakefileError('%s did not render a TIFF file' % makefile_name)
+
+
+def _tile_offset(tile: Tile, reader: tiff.TiffReader,
+                 region: (int, int, int, int)) -> (int, int):
+    """Returns the canvas position of the tile image, which either covers its
+    crop region, or the entire region."""
+
+    left, right, top, bottom = region
+    crop_left, crop_right, crop_top, crop_bottom = tile.crop
+    size = (reader.width, reader.height)
+    if size == (crop_right - crop_left, crop_bottom - crop_top):
+        return crop_left, crop_top
+    if size == (right - left, bottom - top):
+        return left, top
+    raise tiff.TiffError('%s has unexpected size %ix%i' % ((reader.filename,) + size))
+
+
+def assemble_tiles(tiles: [(Tile, str)], region: (int, int, int, int), output: str):
+    """Copies the inner region of each tile image into the output image.
+
+    The output is written ASSEMBLE_ROWS rows at a time, so memory use does not
+    depend on the size of the panorama. The tiles must be uncompressed TIFF
+    files of the same sample type; the output is an uncompressed TIFF with
+    that same bit depth and sample format.
+
+    :raises quickypano.tiff.TiffError: when the tiles can't be assembled.
+    """
+
+    left, right, top, bottom = region
+    readers = []
+    try:
+        for tile, filename in tiles:
+            readers.append((tile, tiff.TiffReader(filename)))
+
+        first = readers[0][1]
+        for _, reader in readers:
+            if (reader.dtype.newbyteorder('<'), reader.samples) != \
+                    (first.dtype.newbyteorder('<'), first.samples):
+                raise tiff.TiffError('%s has %i samples of %s, but %s has %i samples of %s'
+                                     % (reader.filename, reader.samples, reader.dtype,
+                                        first.filename, first.samples, first.dtype))
+
+        log.info('Writing %ix%i panorama of %i %s samples per pixel to %s',
+                 right - left, bottom - top, first.samples, first.dtype.name, output)
+        with tiff.TiffWriter(output, right - left, bottom - top, first.dtype, first.samples,
+                             first.photometric, first.extra_samples) as writer:
+            for band_top in range(top, bottom, ASSEMBLE_ROWS):
+                band_bottom = min(bottom, band_top + ASSEMBLE_ROWS)
+                band = np.zeros((band_bottom - band_top, right - left, first.samples),
+                                dtype=writer.dtype)
+                for tile, reader in readers:
+                    inner_left, inner_right, inner_top, inner_bottom = tile.inner
+                    rows_top = max(band_top, inner_top)
+                    rows_bottom = min(band_bottom, inner_bottom)
+                    if rows_top >= rows_bottom:
+                        continue
+                    offset_x, offset_y = _tile_offset(tile, reader, region)
+                    band[rows_top - band_top:rows_bottom - band_top,
+                         inner_left - left:inner_right - left] = reader.read_rows(
+                        rows_top - offset_y, rows_bottom - offset_y,
+                        inner_left - offset_x, inner_right - offset_x)
+                writer.write_rows(band)
+    finally:
+        for _, reader in readers:
+            reader.close()
+
+
+def render_tiled(pto_filename: str, budget: scheduler.ResourceBudget, output: str=None,
+                 tile_size: int=TILE_SIZE, margin: int=TILE_MARGIN, on_gpu: bool=False,
+                 nona_threads: int=None, retries: int=0) -> [dict]:
+    """Renders the panorama in tiles, which are rendered and blended in parallel.
+
+    Every tile is a copy of the project with a crop region, rendered with
+    render_batch(), so that the memory of each job is bound by the tile size
+    rather than the panorama size. The tiles are rendered as uncompressed
+    TIFF and streamed into the output image by assemble_tiles(), so the
+    output is an uncompressed TIFF, also for projects that render EXR or
+    JPEG. After a successful assembly the files of the tiles are removed.
+
+    :param output: the output filename, defaults to the name the makefile of
+        the project would use, with a .tif extension.
+    :returns: the output filename.
+    :raises RuntimeError: when a tile failed to render, or the output is not TIFF.
+    :raises quickypano.tiff.TiffError: when the tiles can't be assembled.
+    """
+
+    if output and os.path.splitext(output)[1].lower() not in ('.tif', '.tiff'):
+        raise RuntimeError('Tiled rendering writes TIFF, not %s' % output)
+
+    region = panorama_region(pto_filename)
+    tiles = plan_tiles(region, tile_size, margin)
+    log.info('Rendering %ix%i pixels in %i tiles of up to %i pixels square',
+             region[1] - region[0], region[3] - region[2], len(tiles), tile_size)
+
+    tile_ptos = [write_tile_pto(pto_filename, tile) for tile in tiles]
+    summaries = render_batch(tile_ptos, budget, on_gpu=on_gpu, nona_threads=nona_threads,
+                             retries=retries)
+    failed = [summary['project'] for summary in summaries if summary['status'] != 'ok']
+    if failed:
+        raise RuntimeError('%i tiles failed to render: %s' % (len(failed), ', '.join(failed)))
+
+    tile_images = [(tile, tile_output(hugin.makefile_name(tile_pto)))
+                   for tile, tile_pto in zip(tiles, tile_ptos)]
+    if not output:
+        # Same suffix as the tiles, like '_blended_fused.tif'.
+        tile_image = tile_images[0][1]
+        suffix = tile_image[len(tile_ptos[0][:-len('.pto')]):]
+        output = pto_filename[:-len('.pto')] + suffix
+
+    with trace.span('assemble tiles', tiles=len(tiles)):
+        assemble_tiles(tile_images, region, output)
+
+    for tile_pto in tile_ptos:
+        remove_tile_files(tile_pto)
+    return output
+
+
+def _canonical_line(line: str) -> str:
+    """Returns the line with its parameters sorted and numbers normalised."""
+
+    command, _, rest = line.partition(' ')
+    params = []
+    for name, value in _token_re.findall(rest):
+        try:
+            value = repr(float(value))
+        except ValueError:
+            pass
+        params.append(name + value)
+    return ' '.join([command] + sorted(params))
+
+
+def make_renderer(on_gpu: bool=False, tile_size: int=None, margin: int=TILE_MARGIN) -> dict:
+    """Describes rendering with the makefile of pto2mk, as qp_make does, for render_key().
+
+    The number of jobs and threads don't change the output, so they are not
+    included. Tiled renders have their seams elsewhere, and are uncompressed.
+    """
+
+    renderer = {'renderer': 'make', 'enblend': hugin.make_variables(on_gpu)['ENBLEND'],
+                'gpu': on_gpu}
+    if tile_size:
+        renderer.update(tile_size=tile_size, tile_margin=margin)
+    return renderer
+
+
+def render_key(pto_filename: str, renderer: dict, digests: exif.MetadataCache=None) -> str:
+    """Returns a key of everything that determines the rendered panorama.
+
+    That is the geometry and photometry of the images, the 'p', 'k' and 'm'
+    lines, the output and blending options, the contents of the source
+    images, and what rendered it. Control points, optimiser variables and
+    other comments don't matter, and neither do the formatting of numbers or
+    the order of the parameters on a line.
+
+    :param renderer: describes the tool and its options that render the
+        project, like STITCH_RENDERER or make_renderer().
+    :param digests: cache of the source images' digests; by default the
+        metadata cache in the directory of the project is used.
+    """
+
+    basedir = os.path.dirname(os.path.abspath(pto_filename))
+    if digests is None:
+        digests = exif.MetadataCache.for_directory(basedir)
+
+    lines = []
+    disabled = False
+    with open(pto_filename, 'r', encoding='utf-8') as infile:
+        for line in infile:
+            line = line.strip()
+            if line.startswith('#-hugin '):
+                disabled = 'disabled' in line.split()
+            elif line.startswith(RENDER_OPTION_PREFIXES):
+                lines.append(' '.join(line.split()))
+            elif line[:1] in RENDER_COMMANDS and line[1:2] == ' ':
+                if line.startswith('i '):
+                    name = re.search(r'\sn"([^"]*)"', line).group(1)
+                    line = line.replace(' n"%s"' % name, '')
+                    digest = digests.digest(os.path.join(basedir, name))
+                    line += ' #%s%s' % (digest, ' disabled' if disabled else '')
+                    disabled = False
+                lines.append(_canonical_line(line))
+
+    digests.save()
+    return cache.make_key(RENDER_CACHE_VERSION, renderer, lines)
+
+
+class RenderCache:
+    """Cache of rendered panoramas, keyed by render_key().
+
+    The output files are stored relative to the prefix of the project, so
+    that a hit restores them under the name of the project that asked.
+    """
+
+    def __init__(self, root: str, max_size: int):
+        self.cache = cache.DirectoryCache(root, max_size)
+
+    @staticmethod
+    def _prefix(pto_filename: str) -> str:
+        return pto_filename[:-len('.pto')]
+
+    def restore(self, pto_filename: str, key: str) -> [str]:
+        """Copies the cached outputs next to the project, returns None on a miss."""
+
+        manifest = self.cache.get(key)
+        if manifest is None:
+            return None
+
+        suffixes = json.loads(manifest.decode('utf-8'))
+        if not suffixes:
+            # Stored before empty renders were refused; render anew.
+            self.cache.remove(key)
+            return None
+
+        prefix = self._prefix(pto_filename)
+        outputs = []
+        for suffix in suffixes:
+            output = prefix + suffix
+            if not self.cache.get_file(cache.make_key(key, suffix), output):
+                # An output was evicted; drop the manifest so the entry is stored anew.
+                log.info('Render cache entry for %s was partly evicted', pto_filename)
+                self.cache.remove(key)
+                return None
+            outputs.append(output)
+        return outputs
+
+    def store(self, pto_filename: str, key: str, outputs: [str]):
+        missing = [output for output in outputs if not os.path.exists(output)]
+        if missing:
+            log.warning('Not caching the render of %s: %s was not written',
+                        pto_filename, ', '.join(missing))
+            return
+
+        prefix = self._prefix(pto_filename)
+        named = []
+        for output in outputs:
+            if output.startswith(prefix):
+                named.append(output)
+            else:
+                log.warning('Not caching %s, as it is not named after %s', output, pto_filename)
+        if not named:
+            # An empty manifest would turn every later render into a hit without outputs.
+            log.warning('Not caching the render of %s: it has no outputs', pto_filename)
+            return
+
+        size = sum(os.path.getsize(output) for output in named)
+        if size > self.cache.max_size:
+            log.info('Not caching the render of %s: %i MiB of output does not fit in the '
+                     '%i MiB cache', pto_filename, size // 2 ** 20, self.cache.max_size // 2 ** 20)
+            return
+
+        suffixes = []
+        for output in named:
+            suffix = output[len(prefix):]
+            self.cache.put_file(cache.make_key(key, suffix), output)
+            suffixes.append(suffix)
+        # The manifest goes last, so that a hit finds all outputs.
+        self.cache.put(key, json.dumps(suffixes).encode('utf-8'))
+
+
+def cached_render(pto_filename: str, render_cache: RenderCache, render,
+                  renderer: dict) -> [str]:
+    """Returns the cached outputs of the project, or renders and caches them.
+
+    :param render_cache: the cache, or None to always render.
+    :param render: callable that renders the project and returns the
+        output filenames.
+    :param renderer: describes what render() does, see render_key().
+    """
+
+    if render_cache is None:
+        return render()
+
+    with trace.span('render cache lookup'):
+        try:
+            key = render_key(pto_filename, renderer)
+        except OSError as ex:
+            log.warning('Not using the render cache: %s', ex)
+            return render()
+        outputs = render_cache.restore(pto_filename, key)
+    if outputs is not None:
+        log.info('Using cached render of %s: %s', pto_filename, ', '.join(outputs))
+        return outputs
+
+    outputs = render()
+    render_cache.store(pto_filename, key, outputs)
+    return outputs
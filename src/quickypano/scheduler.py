@@ -0,0 +1,218 @@
+"""
+Scheduling of subprocess-heavy tasks within a CPU and memory budget.
+"""
+
+import asyncio
+import concurrent.futures
+import contextlib
+import logging
+import os
+import re
+import sys
+import threading
+
+log = logging.getLogger(__name__)
+
+_size_re = re.compile(r'^\s*(?P<number>[0-9.]+)\s*(?P<unit>[kmgt]?)i?b?\s*$', re.IGNORECASE)
+_size_units = {'': 1, 'k': 2 ** 10, 'm': 2 ** 20, 'g': 2 ** 30, 't': 2 ** 40}
+
+
+def parse_size(text: str) -> int:
+    """Parses a size like '16G' or '512 MiB' into a number of bytes.
+
+    >>> parse_size('16G')
+    17179869184
+    >>> parse_size('1.5 MiB')
+    1572864
+    >>> parse_size('1000')
+    1000
+    """
+
+    m = _size_re.match(text)
+    if not m:
+        raise ValueError('Invalid size %r' % text)
+    return int(float(m.group('number')) * _size_units[m.group('unit').lower()])
+
+
+def available_memory() -> int:
+    """Returns the memory available for new processes in bytes, or None if unknown.
+
+    On Linux this is MemAvailable from /proc/meminfo, on Windows the available
+    physical memory. Elsewhere the total physical memory is returned, as that
+    is all that can be found without extra dependencies.
+    """
+
+    if sys.platform == 'win32':
+        import ctypes
+
+        class MemoryStatusEx(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong),
+                        ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong),
+                        ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong),
+                        ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong),
+                        ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MemoryStatusEx()
+        status.dwLength = ctypes.sizeof(status)
+        if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return None
+        return status.ullAvailPhys
+
+    try:
+        with open('/proc/meminfo', 'r') as infile:
+            for line in infile:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class ResourceBudget:
+    """Keeps track of the cores and memory claimed by running tasks.
+
+    A task that needs more than the entire budget is still admitted, but
+    only when nothing else is running.
+    """
+
+    def __init__(self, cores: int=None, memory: int=None):
+        """
+        :param cores: total number of cores, None = os.cpu_count()
+        :param memory: total memory in bytes, None = unlimited
+        """
+
+        self.cores = cores or os.cpu_count() or 1
+        self.memory = memory
+        self.cores_used = 0
+        self.memory_used = 0
+        self._cond = threading.Condition()
+
+    def _fits(self, cores: int, memory: int) -> bool:
+        if not self.cores_used and not self.memory_used:
+            return True
+        if self.cores_used + cores > self.cores:
+            return False
+        return self.memory is None or self.memory_used + memory <= self.memory
+
+    def acquire(self, cores: int=1, memory: int=0):
+        """Blocks until the resources are available, then claims them."""
+
+        with self._cond:
+            self._cond.wait_for(lambda: self._fits(cores, memory))
+            self.cores_used += cores
+            self.memory_used += memory
+
+    def try_acquire(self, cores: int=1, memory: int=0) -> bool:
+        """Claims the resources if they are available now, without blocking."""
+
+        with self._cond:
+            if not self._fits(cores, memory):
+                return False
+            self.cores_used += cores
+            self.memory_used += memory
+            return True
+
+    def release(self, cores: int=1, memory: int=0):
+        with self._cond:
+            self.cores_used -= cores
+            self.memory_used -= memory
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def reserve(self, cores: int=1, memory: int=0):
+        self.acquire(cores, memory)
+        try:
+            yield
+        finally:
+            self.release(cores, memory)
+
+
+class BudgetExecutor:
+    """Thread pool that only starts a task when the budget has room for it.
+
+    Tasks are started in order of submission; a task waiting for resources
+    holds back the tasks submitted after it.
+    """
+
+    def __init__(self, jobs: int, budget: ResourceBudget):
+        self.budget = budget
+        self._executor = concurrent.futures.ThreadPoolExecutor(jobs)
+        self._admission = threading.Lock()
+
+    def _run(self, cores, memory, callable, args):
+        # Serialise admission, so that big tasks don't starve.
+        with self._admission:
+            self.budget.acquire(cores, memory)
+        try:
+            return callable(*args)
+        finally:
+            self.budget.release(cores, memory)
+
+    def submit(self, callable, *args, cores: int=1, memory: int=0) -> concurrent.futures.Future:
+        return self._executor.submit(self._run, cores, memory, callable, args)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._executor.shutdown(wait=True)
+        return False
+
+
+class AsyncResourceBudget(ResourceBudget):
+    """ResourceBudget for coroutines running in a single event loop.
+
+    Use acquire_async() and release_async(), or ``async with budget.reserve_async()``.
+    """
+
+    def __init__(self, cores: int=None, memory: int=None):
+        super().__init__(cores, memory)
+        self._async_cond = None
+
+    def _condition(self) -> asyncio.Condition:
+        # Created on first use, so that it belongs to the running event loop.
+        if self._async_cond is None:
+            self._async_cond = asyncio.Condition()
+        return self._async_cond
+
+    async def acquire_async(self, cores: int=1, memory: int=0):
+        """Waits until the resources are available, then claims them."""
+
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: self._fits(cores, memory))
+            self.cores_used += cores
+            self.memory_used += memory
+
+    async def release_async(self, cores: int=1, memory: int=0):
+        cond = self._condition()
+        async with cond:
+            self.cores_used -= cores
+            self.memory_used -= memory
+            cond.notify_all()
+
+    def reserve_async(self, cores: int=1, memory: int=0):
+        return _AsyncReservation(self, cores, memory)
+
+
+class _AsyncReservation:
+    def __init__(self, budget: AsyncResourceBudget, cores: int, memory: int):
+        self.budget = budget
+        self.cores = cores
+        self.memory = memory
+
+    async def __aenter__(self):
+        await self.budget.acquire_async(self.cores, self.memory)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.budget.release_async(self.cores, self.memory)
+        return False
@@ -0,0 +1,232 @@
+"""
+Compact binary snapshots of projects, for checkpointing between stages.
+
+A snapshot starts with a magic number and a JSON header, followed by
+NumPy arrays that are each aligned to ALIGNMENT bytes:
+
+- the photo parameters, the fields of quickypano.project.ParameterTable,
+  with one column per parameter;
+- the control points, one column per field of the 'c' lines, see
+  quickypano.huginpto.ControlPoints.
+
+Loading memory-maps the file, so the control point columns are not parsed
+or copied, and their lines are only formatted when they are used. The photo
+parameters, one small row per photo, are copied into a writable
+ParameterTable in the column order of this version's PARAM_KEYS.
+"""
+
+import collections.abc
+import json
+import mmap
+import os
+import re
+import struct
+
+import numpy as np
+
+from . import huginpto, settings
+
+MAGIC = b'QPSNAP\r\n'
+VERSION = 2
+ALIGNMENT = 64
+
+CP_COLUMNS = huginpto.ControlPoints.COLUMNS
+
+_header_len = struct.Struct('<Q')
+_cp_line_re = re.compile(r'^c n(\S+) N(\S+) x(\S+) y(\S+) X(\S+) Y(\S+) t(\S+)[ \t]*$', re.M)
+
+
+class ControlPointLines(collections.abc.MutableSequence):
+    """The 'c' lines of a project, formatted on access from control point columns.
+
+    The columns are usually memory-mapped from a snapshot. The first change
+    turns them into a plain list of lines.
+    """
+
+    def __init__(self, columns: dict):
+        self.columns = columns
+        self._lines = None
+
+    @property
+    def materialised(self) -> bool:
+        return self._lines is not None
+
+    def _format(self, start: int, stop: int) -> [str]:
+        values = [self.columns[name][start:stop].tolist() for name, _ in CP_COLUMNS]
+        return ['c n%i N%i x%r y%r X%r Y%r t%i' % row for row in zip(*values)]
+
+    def _list(self) -> list:
+        if self._lines is None:
+            self._lines = self._format(0, len(self))
+        return self._lines
+
+    def __len__(self):
+        if self._lines is not None:
+            return len(self._lines)
+        return len(self.columns['n'])
+
+    def __getitem__(self, idx):
+        if self._lines is not None:
+            return self._lines[idx]
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            return self._format(start, stop)[::step]
+
+        length = len(self)
+        if idx < 0:
+            idx += length
+        if not 0 <= idx < length:
+            raise IndexError('control point index out of range')
+        return self._format(idx, idx + 1)[0]
+
+    def __iter__(self):
+        if self._lines is not None:
+            return iter(self._lines)
+        return iter(self._format(0, len(self)))
+
+    def __setitem__(self, idx, value):
+        self._list()[idx] = value
+
+    def __delitem__(self, idx):
+        del self._list()[idx]
+
+    def insert(self, idx, value):
+        self._list().insert(idx, value)
+
+    def extend(self, values):
+        self._list().extend(values)
+
+    def clear(self):
+        self._lines = []
+
+
+def control_point_columns(lines) -> dict:
+    """Returns the columns of the 'c' lines, as {name: array}."""
+
+    if isinstance(lines, ControlPointLines) and not lines.materialised:
+        return lines.columns
+
+    lines = list(lines)
+    rows = _cp_line_re.findall('\n'.join(lines))
+    if len(rows) != len(lines):
+        # Not all in the order cpfind writes them; tokenise line by line.
+        rows = []
+        for line in lines:
+            fields = {token[0]: token[1:] for token in line.split()[1:]}
+            rows.append([fields.get(name, '0' if name == 't' else 'nan')
+                         for name, _ in CP_COLUMNS])
+
+    table = np.array(rows, dtype=np.float64).reshape(-1, len(CP_COLUMNS))
+    return {name: table[:, col].astype(dtype) for col, (name, dtype) in enumerate(CP_COLUMNS)}
+
+
+def _settings_header(sett: settings.AbstractSettings) -> dict:
+    values = {name: getattr(sett, name) for name in dir(sett) if name.isupper()}
+    return {'class': type(sett).__name__, 'values': values}
+
+
+def _load_settings(header: dict) -> settings.AbstractSettings:
+    cls = getattr(settings, header['class'], None)
+    if not (isinstance(cls, type) and issubclass(cls, settings.AbstractSettings)):
+        cls = settings.AbstractSettings
+    sett = cls()
+    sett.from_json(header['values'])
+    return sett
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def save(project, filename: str):
+    """Writes the project as snapshot. The project itself is not changed."""
+
+    from . import project as project_module
+
+    table = project.parameter_table
+    arrays = {'param/' + field: table.array[field] for field in table.DTYPE.names}
+    for name, column in control_point_columns(project.control_points).items():
+        arrays['cp/' + name] = column
+
+    scalars = {key: value for key, value in vars(project).items()
+               if value is None or isinstance(value, (bool, int, float, str))}
+    header = {
+        'version': VERSION,
+        'project': scalars,
+        'settings': _settings_header(project.settings),
+        'photos': {
+            'filenames': [photo.filename for photo in project.photos],
+            'digests': [photo.digest for photo in project.photos],
+            'parameters': list(project_module.PARAM_KEYS),
+        },
+        'arrays': {},
+    }
+
+    # Offsets are relative to the start of the data, which follows the header.
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape),
+                                  'offset': offset}
+        offset = _align(offset + array.nbytes)
+    data = json.dumps(header, sort_keys=True).encode('utf-8')
+    data_start = _align(len(MAGIC) + _header_len.size + len(data))
+
+    tmpname = '%s-%i.tmp' % (filename, os.getpid())
+    with open(tmpname, 'wb') as outfile:
+        outfile.write(MAGIC)
+        outfile.write(_header_len.pack(len(data)))
+        outfile.write(data)
+        for name, array in arrays.items():
+            padding = data_start + header['arrays'][name]['offset'] - outfile.tell()
+            outfile.write(b'\0' * padding)
+            outfile.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmpname, filename)
+
+
+def load(filename: str, project_class=None):
+    """Loads a snapshot written by save(), returns the project.
+
+    :param project_class: class of the returned project, by default
+        quickypano.project.Project.
+    """
+
+    from . import project as project_module
+
+    project_class = project_class or project_module.Project
+
+    with open(filename, 'rb') as infile:
+        if infile.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a QuickyPano snapshot' % filename)
+        header_len, = _header_len.unpack(infile.read(_header_len.size))
+        header = json.loads(infile.read(header_len).decode('utf-8'))
+        if header['version'] != VERSION:
+            raise ValueError('Unsupported snapshot version %i' % header['version'])
+        mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    data_start = _align(len(MAGIC) + _header_len.size + header_len)
+    arrays = {}
+    for name, meta in header['arrays'].items():
+        count = int(np.prod(meta['shape']))
+        if not count:
+            # Empty arrays at the end may lie beyond the end of the file.
+            arrays[name] = np.empty(meta['shape'], dtype=meta['dtype'])
+            continue
+        arrays[name] = np.frombuffer(mapped, dtype=meta['dtype'], count=count,
+                                     offset=data_start + meta['offset']).reshape(meta['shape'])
+
+    project = project_class()
+    for key, value in header['project'].items():
+        setattr(project, key, value)
+    project.settings = _load_settings(header['settings'])
+
+    photos = header['photos']
+    table = project_module.ParameterTable.from_columns(
+        photos['parameters'], arrays['param/value'], arrays['param/link'],
+        arrays['param/is_int'])
+    project.photos = [
+        project_module.Image.from_table(filename, table, row, digest)
+        for row, (filename, digest) in enumerate(zip(photos['filenames'], photos['digests']))]
+
+    project.control_points = ControlPointLines(
+        {name: arrays['cp/' + name] for name, _ in CP_COLUMNS})
+    return project
@@ -0,0 +1,289 @@
+"""
+Uncompressed TIFF files, read and written in strips of rows.
+
+Used to assemble tiled renders into one image, without having the entire
+image in memory and while keeping the bit depth and sample format of the
+tiles, like 16-bit integer or 32-bit float HDR. Only the layout Hugin's
+tools write without compression is supported: one image of interleaved
+samples, stored in strips. Anything else raises TiffError.
+
+Files larger than classic TIFF allows are written as BigTIFF.
+"""
+
+import struct
+
+import numpy as np
+
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+PHOTOMETRIC = 262
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIG = 284
+TILE_WIDTH = 322
+EXTRA_SAMPLES = 338
+SAMPLE_FORMAT = 339
+
+COMPRESSION_NONE = 1
+PLANAR_CONTIG = 1
+
+# TIFF field type -> struct format
+_TYPES = {1: 'B', 3: 'H', 4: 'L', 16: 'Q'}
+SHORT, LONG, LONG8 = 3, 4, 16
+
+# TIFF sample format -> NumPy kind
+_SAMPLE_KINDS = {1: 'u', 2: 'i', 3: 'f'}
+_SAMPLE_FORMATS = {kind: fmt for fmt, kind in _SAMPLE_KINDS.items()}
+
+# Rows per strip of written files.
+WRITE_ROWS_PER_STRIP = 16
+
+# Keep classic TIFF files well below their 4 GiB limit, the IFD comes last.
+_CLASSIC_MAX_SIZE = 2 ** 32 - 2 ** 20
+
+
+class TiffError(ValueError):
+    pass
+
+
+class TiffReader:
+    """Reads rows of pixels from an uncompressed TIFF file.
+
+    Use as context manager, or call close().
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.infile = open(filename, 'rb')
+        try:
+            self._read_header()
+        except Exception:
+            self.infile.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.infile.close()
+
+    def _unpack(self, fmt, data):
+        return struct.unpack(self.endian + fmt, data)
+
+    def _read_header(self):
+        header = self.infile.read(16)
+        self.endian = {b'II': '<', b'MM': '>'}.get(header[:2])
+        if self.endian is None:
+            raise TiffError('%s is not a TIFF file' % self.filename)
+
+        magic, = self._unpack('H', header[2:4])
+        if magic == 42:
+            self.big = False
+            ifd_offset, = self._unpack('L', header[4:8])
+        elif magic == 43:
+            self.big = True
+            ifd_offset, = self._unpack('Q', header[8:16])
+        else:
+            raise TiffError('%s is not a TIFF file' % self.filename)
+
+        tags = self._read_ifd(ifd_offset)
+
+        def tag(code, default=None):
+            if code in tags:
+                return tags[code]
+            if default is None:
+                raise TiffError('%s has no TIFF tag %i' % (self.filename, code))
+            return default
+
+        compression, = tag(COMPRESSION, (COMPRESSION_NONE,))
+        if compression != COMPRESSION_NONE:
+            raise TiffError('%s is compressed (TIFF compression %i); only uncompressed '
+                            'files are supported' % (self.filename, compression))
+        if TILE_WIDTH in tags:
+            raise TiffError('%s is a tiled TIFF; only strips are supported' % self.filename)
+
+        self.width, = tag(IMAGE_WIDTH)
+        self.height, = tag(IMAGE_LENGTH)
+        self.samples, = tag(SAMPLES_PER_PIXEL, (1,))
+        planar, = tag(PLANAR_CONFIG, (PLANAR_CONTIG,))
+        if planar != PLANAR_CONTIG and self.samples > 1:
+            raise TiffError('%s has separate sample planes; only interleaved samples '
+                            'are supported' % self.filename)
+
+        bits = set(tag(BITS_PER_SAMPLE, (1,)))
+        formats = set(tag(SAMPLE_FORMAT, (1,)))
+        if len(bits) != 1 or len(formats) != 1:
+            raise TiffError('%s has samples of different types' % self.filename)
+        bits, sample_format = bits.pop(), formats.pop()
+        if bits not in (8, 16, 32, 64) or sample_format not in _SAMPLE_KINDS:
+            raise TiffError('%s has unsupported %i-bit samples of format %i'
+                            % (self.filename, bits, sample_format))
+        self.dtype = np.dtype('%s%s%i' % (self.endian, _SAMPLE_KINDS[sample_format], bits // 8))
+
+        self.photometric, = tag(PHOTOMETRIC)
+        self.extra_samples = tags.get(EXTRA_SAMPLES, ())
+        self.rows_per_strip = min(tag(ROWS_PER_STRIP, (self.height,))[0], self.height)
+        self.strip_offsets = tag(STRIP_OFFSETS)
+        self.row_bytes = self.width * self.samples * self.dtype.itemsize
+
+    def _read_ifd(self, offset) -> dict:
+        """Returns {tag: tuple of values} of the first image."""
+
+        count_fmt, entry_size, value_size = ('Q', 20, 8) if self.big else ('H', 12, 4)
+        self.infile.seek(offset)
+        count, = self._unpack(count_fmt, self.infile.read(struct.calcsize(count_fmt)))
+        entries = self.infile.read(entry_size * count)
+
+        tags = {}
+        for idx in range(count):
+            entry = entries[entry_size * idx:entry_size * (idx + 1)]
+            code, ftype = self._unpack('HH', entry[:4])
+            if ftype not in _TYPES:
+                continue
+            nvalues, = self._unpack('Q' if self.big else 'L', entry[4:entry_size - value_size])
+            fmt = '%i%s' % (nvalues, _TYPES[ftype])
+            size = struct.calcsize(self.endian + fmt)
+            raw = entry[entry_size - value_size:]
+            if size > value_size:
+                value_offset, = self._unpack('Q' if self.big else 'L', raw)
+                self.infile.seek(value_offset)
+                raw = self.infile.read(size)
+            tags[code] = self._unpack(fmt, raw[:size])
+        return tags
+
+    def read_rows(self, top: int, bottom: int, left: int, right: int) -> np.ndarray:
+        """Returns the pixels in the rectangle as (rows, columns, samples) array."""
+
+        if not (0 <= top <= bottom <= self.height and 0 <= left <= right <= self.width):
+            raise TiffError('Rows %i-%i, columns %i-%i are outside the %ix%i image %s'
+                            % (top, bottom, left, right, self.width, self.height,
+                               self.filename))
+
+        pixel_bytes = self.samples * self.dtype.itemsize
+        nbytes = (right - left) * pixel_bytes
+        rows = np.empty((bottom - top, right - left, self.samples), dtype=self.dtype)
+        for row in range(top, bottom):
+            strip, row_in_strip = divmod(row, self.rows_per_strip)
+            self.infile.seek(self.strip_offsets[strip] + row_in_strip * self.row_bytes +
+                             left * pixel_bytes)
+            data = self.infile.read(nbytes)
+            if len(data) != nbytes:
+                raise TiffError('Unexpected end of file in %s' % self.filename)
+            rows[row - top] = np.frombuffer(data, dtype=self.dtype).reshape(-1, self.samples)
+        return rows
+
+
+class TiffWriter:
+    """Writes an uncompressed TIFF file, from the top rows to the bottom ones.
+
+    Use as context manager; the image is only complete when all rows are
+    written and the writer is closed.
+    """
+
+    def __init__(self, filename: str, width: int, height: int, dtype, samples: int,
+                 photometric: int, extra_samples=()):
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.samples = samples
+        self.photometric = photometric
+        self.extra_samples = tuple(extra_samples)
+        self.rows_written = 0
+
+        self.row_bytes = width * samples * self.dtype.itemsize
+        self.big = 16 + height * self.row_bytes > _CLASSIC_MAX_SIZE
+        self.data_start = 16 if self.big else 8
+
+        self.outfile = open(filename, 'wb')
+        self.outfile.write(b'\0' * self.data_start)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.outfile.close()
+
+    def write_rows(self, rows: np.ndarray):
+        """Appends (rows, width, samples) pixels to the image."""
+
+        if rows.shape[1:] != (self.width, self.samples):
+            raise TiffError('Expected rows of %i pixels of %i samples, not %r'
+                            % (self.width, self.samples, rows.shape))
+        if self.rows_written + len(rows) > self.height:
+            raise TiffError('Too many rows for %s' % self.filename)
+        self.outfile.write(np.ascontiguousarray(rows, dtype=self.dtype).tobytes())
+        self.rows_written += len(rows)
+
+    def close(self):
+        """Writes the IFD, and closes the file."""
+
+        try:
+            if self.rows_written != self.height:
+                raise TiffError('Only %i of %i rows written to %s'
+                                % (self.rows_written, self.height, self.filename))
+            self._write_ifd()
+        finally:
+            self.outfile.close()
+
+    def _write_ifd(self):
+        strip_bytes = WRITE_ROWS_PER_STRIP * self.row_bytes
+        nr_of_strips = -(-self.height // WRITE_ROWS_PER_STRIP)
+        offsets = [self.data_start + strip * strip_bytes for strip in range(nr_of_strips)]
+        counts = [min(strip_bytes, self.height * self.row_bytes - offset + self.data_start)
+                  for offset in offsets]
+
+        entries = [
+            (IMAGE_WIDTH, LONG, [self.width]),
+            (IMAGE_LENGTH, LONG, [self.height]),
+            (BITS_PER_SAMPLE, SHORT, [8 * self.dtype.itemsize] * self.samples),
+            (COMPRESSION, SHORT, [COMPRESSION_NONE]),
+            (PHOTOMETRIC, SHORT, [self.photometric]),
+            (STRIP_OFFSETS, LONG8 if self.big else LONG, offsets),
+            (SAMPLES_PER_PIXEL, SHORT, [self.samples]),
+            (ROWS_PER_STRIP, LONG, [WRITE_ROWS_PER_STRIP]),
+            (STRIP_BYTE_COUNTS, LONG, counts),
+            (PLANAR_CONFIG, SHORT, [PLANAR_CONTIG]),
+            (SAMPLE_FORMAT, SHORT, [_SAMPLE_FORMATS[self.dtype.kind]] * self.samples),
+        ]
+        if self.extra_samples:
+            entries.append((EXTRA_SAMPLES, SHORT, list(self.extra_samples)))
+        entries.sort()
+
+        count_fmt, entry_fmt, value_size = ('<Q', '<HHQ', 8) if self.big else ('<H', '<HHL', 4)
+        ifd_offset = self.outfile.tell()
+        ifd_offset += ifd_offset % 2  # IFDs start on a word boundary
+        entry_size = struct.calcsize(entry_fmt) + value_size
+        ifd_size = struct.calcsize(count_fmt) + len(entries) * entry_size + value_size
+
+        ifd = struct.pack(count_fmt, len(entries))
+        extra = b''
+        for code, ftype, values in entries:
+            data = struct.pack('<%i%s' % (len(values), _TYPES[ftype]), *values)
+            if len(data) <= value_size:
+                value = data.ljust(value_size, b'\0')
+            else:
+                offset = ifd_offset + ifd_size + len(extra)
+                value = struct.pack('<Q' if self.big else '<L', offset)
+                extra += data + b'\0' * (len(data) % 2)
+            ifd += struct.pack(entry_fmt, code, ftype, len(values)) + value
+        ifd += b'\0' * value_size  # no next IFD
+
+        self.outfile.seek(ifd_offset)
+        self.outfile.write(ifd + extra)
+
+        self.outfile.seek(0)
+        if self.big:
+            self.outfile.write(b'II' + struct.pack('<HHHQ', 43, 8, 0, ifd_offset))
+        else:
+            self.outfile.write(b'II' + struct.pack('<HL', 42, ifd_offset))
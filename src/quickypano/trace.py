@@ -0,0 +1,213 @@
+"""
+Timeline of the pipeline stages and Hugin subprocesses, in Chrome's trace-event format.
+
+The resulting JSON file can be loaded in chrome://tracing or https://ui.perfetto.dev/.
+Tracing is disabled until start() is called; until then span() and
+check_call() cost next to nothing.
+"""
+
+import contextlib
+import contextvars
+import itertools
+import json
+import logging
+import os
+import os.path
+import subprocess
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+_tracer = None
+
+# Track of the innermost span() with an explicit tid, for the events nested in it.
+_track = contextvars.ContextVar('quickypano_trace_track', default=None)
+
+
+class Tracer:
+    """Collects trace events in memory."""
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._named_tids = set()
+        self._track_ids = itertools.count(1)
+        self.pid = os.getpid()
+
+        self._metadata('process_name', self.pid, {'name': 'quickypano'})
+
+    def _metadata(self, name, pid, args, tid=0):
+        with self._lock:
+            self.events.append({'ph': 'M', 'name': name, 'pid': pid, 'tid': tid, 'args': args})
+
+    def timestamp(self) -> float:
+        """Returns the current time in microseconds since the start of the trace."""
+        return (time.perf_counter() - self._start) * 1e6
+
+    def current_tid(self) -> int:
+        """Returns the trace thread ID of the calling thread, naming it on first use.
+
+        Inside a span() with an explicit tid, that tid is returned instead.
+        """
+
+        tid = _track.get()
+        if tid is not None:
+            return tid
+
+        tid = threading.get_ident()
+        if tid not in self._named_tids:
+            self._named_tids.add(tid)
+            self._metadata('thread_name', self.pid, {'name': threading.current_thread().name},
+                           tid=tid)
+        return tid
+
+    def new_track(self, name: str) -> int:
+        """Returns a new thread ID for events that overlap with others in the same thread.
+
+        Used for coroutines, which all run in the thread of the event loop.
+        """
+
+        tid = -next(self._track_ids)
+        self._metadata('thread_name', self.pid, {'name': name}, tid=tid)
+        return tid
+
+    def complete(self, name: str, cat: str, start: float, end: float, args: dict=None,
+                 pid: int=None, tid: int=None):
+        """Records a complete ('X') event; start and end are from timestamp()."""
+
+        event = {
+            'ph': 'X',
+            'name': name,
+            'cat': cat,
+            'ts': start,
+            'dur': end - start,
+            'pid': self.pid if pid is None else pid,
+            'tid': self.current_tid() if tid is None else tid,
+        }
+        if args:
+            event['args'] = args
+
+        with self._lock:
+            self.events.append(event)
+
+    def process(self, args, pid: int, start: float, end: float, returncode: int,
+                rusage=None):
+        """Records a child process as an event nested in the current span.
+
+        :param rusage: resource usage as returned by os.wait4(), if available.
+        """
+
+        if isinstance(args, str):
+            # Shell command line.
+            cmdline = args
+            args = args.split()
+        else:
+            cmdline = subprocess.list2cmdline([str(arg) for arg in args])
+
+        name = os.path.splitext(os.path.basename(args[0].strip('"\'')))[0]
+        event_args = {'cmdline': cmdline, 'returncode': returncode}
+        if rusage is not None:
+            event_args['user_cpu_s'] = rusage.ru_utime
+            event_args['system_cpu_s'] = rusage.ru_stime
+            event_args['cpu_utilisation'] = ((rusage.ru_utime + rusage.ru_stime) /
+                                             max((end - start) / 1e6, 1e-6))
+            # macOS reports bytes, Linux kilobytes.
+            kilobytes = rusage.ru_maxrss / 1024 if sys.platform == 'darwin' else rusage.ru_maxrss
+            event_args['max_rss_mb'] = kilobytes / 1024
+
+        event_args['pid'] = pid
+        self.complete(name, 'subprocess', start, end, event_args)
+
+    def save(self, filename: str):
+        with self._lock:
+            data = {'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}
+
+        with open(filename, 'w', encoding='utf-8') as outfile:
+            json.dump(data, outfile)
+        log.info('Wrote %i trace events to %s', len(data['traceEvents']), filename)
+
+
+def start():
+    """Enables tracing."""
+
+    global _tracer
+    _tracer = Tracer()
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def tracer() -> Tracer:
+    """Returns the active tracer, or None when tracing is disabled."""
+    return _tracer
+
+
+def save(filename: str):
+    """Writes the trace to a JSON file, if tracing is enabled."""
+
+    if _tracer is not None:
+        _tracer.save(filename)
+
+
+@contextlib.contextmanager
+def span(name: str, cat: str='stage', tid: int=None, **args):
+    """Records the wall time of the with-block as a trace event.
+
+    :param tid: track to record the span and the events nested in it on, see
+        new_track(). None = the track of the current thread or span.
+    """
+
+    if _tracer is None:
+        yield
+        return
+
+    token = None if tid is None else _track.set(tid)
+    start_ts = _tracer.timestamp()
+    try:
+        yield
+    finally:
+        _tracer.complete(name, cat, start_ts, _tracer.timestamp(), args)
+        if token is not None:
+            _track.reset(token)
+
+
+def new_track(name: str) -> int:
+    """Returns a track for overlapping spans, or None when tracing is disabled."""
+
+    if _tracer is None:
+        return None
+    return _tracer.new_track(name)
+
+
+def check_call(args, **kwargs):
+    """subprocess.check_call() that records the child in the trace.
+
+    Where os.wait4() is available, the child's CPU time and peak RSS are
+    recorded too. These include the descendants the child waited for, so
+    for make they cover the nona and enblend processes it ran.
+    """
+
+    if _tracer is None:
+        return subprocess.check_call(args, **kwargs)
+
+    start_ts = _tracer.timestamp()
+    rusage = None
+    with subprocess.Popen(args, **kwargs) as proc:
+        if hasattr(os, 'wait4'):
+            try:
+                _, status, rusage = os.wait4(proc.pid, 0)
+            except BaseException:
+                proc.kill()
+                raise
+            proc.returncode = os.waitstatus_to_exitcode(status)
+        else:
+            proc.wait()
+
+    _tracer.process(args, proc.pid, start_ts, _tracer.timestamp(), proc.returncode, rusage)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, args)
+    return 0
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+import argparse
+import glob
+import json
+import logging
+import os.path
+import time
+
+import quickypano.hugin
+import quickypano.render
+import quickypano.scheduler
+import quickypano.trace
+
+
+def main():
+    """Renders many PTO files at once."""
+
+    start_time = time.time()
+
+    logging.basicConfig(level=logging.INFO)
+    log = logging.getLogger('quickypano')
+    log.setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description='Renders many panoramas at once, sharing the cores and memory.')
+    parser.add_argument('--hugin', metavar='HUGIN_DIR', type=str, help="Hugin's directory",
+                        default=r'c:\Program Files*\Hugin')
+    parser.add_argument('--gpu', help="Run Nona on the GPU",
+                        default=False, action='store_true')
+    parser.add_argument('--cores', metavar='N', type=int, default=None,
+                        help='Number of cores to use; defaults to all cores')
+    parser.add_argument('--max-mem', metavar='SIZE', type=quickypano.scheduler.parse_size,
+                        default=None,
+                        help='Memory budget, like "16G"; defaults to the available memory')
+    parser.add_argument('--nona-threads', metavar='N', type=int, default=None,
+                        help='Number of threads per nona process (default: 1)')
+    parser.add_argument('--retries', metavar='N', type=int, default=0,
+                        help='Number of times a failed task is retried')
+    parser.add_argument('-k', '--keep-going', action='store_true', default=False,
+                        help='Continue with the rest of a project after one of its tasks failed')
+    parser.add_argument('--summary', metavar='FILE', type=str, default='qp_batch.json',
+                        help='Write the per-project summary to this JSON file '
+                             '(default: %(default)s)')
+    parser.add_argument('--trace', metavar='FILE', type=str, default=None,
+                        help='Write a timeline of the Hugin processes to FILE, '
+                             'in Chrome trace-event format')
+    parser.add_argument('filenames', metavar='PTO', type=str, nargs='*',
+                        help='The PTO files; defaults to all PTO files in the current directory')
+    args = parser.parse_args()
+    if args.trace:
+        quickypano.trace.start()
+
+    quickypano.hugin.find_hugin(args.hugin)
+
+    ptos = args.filenames or sorted(glob.glob('*.pto'))
+    if not ptos:
+        raise SystemExit('No PTO files found.')
+    for pto in ptos:
+        if not os.path.exists(pto):
+            raise SystemExit('File %s does not exist.' % pto)
+
+    memory = args.max_mem
+    if memory is None:
+        memory = quickypano.scheduler.available_memory()
+    budget = quickypano.scheduler.ResourceBudget(cores=args.cores, memory=memory)
+    log.info('Rendering %i projects on %i cores', len(ptos), budget.cores)
+
+    quickypano.lowpriority()
+    with quickypano.trace.span('batch', projects=len(ptos)):
+        summaries = quickypano.render.render_batch(ptos, budget, on_gpu=args.gpu,
+                                                   nona_threads=args.nona_threads,
+                                                   retries=args.retries,
+                                                   keep_going=args.keep_going)
+
+    with open(args.summary, 'w', encoding='utf-8') as outfile:
+        json.dump(summaries, outfile, indent=2)
+
+    end_time = time.time()
+
+    print(50 * '-')
+    for summary in summaries:
+        print('%-30s %-15s %4i tasks, %4i failed, %8.1f task seconds, done after %s' % (
+            summary['project'], summary['status'], summary.get('tasks_run', 0),
+            summary.get('tasks_failed', 0), summary.get('task_seconds', 0.0),
+            time.strftime('%H:%M:%S', time.gmtime(summary.get('finished_after_seconds', 0)))))
+    print(50 * '-')
+    duration = end_time - start_time
+    str_duration = time.strftime('%H:%M:%S', time.gmtime(duration))
+    print('Done! Duration: %s, summary written to %s' % (str_duration, args.summary))
+
+    if args.trace:
+        quickypano.trace.save(args.trace)
+
+    if any(summary['status'] != 'ok' for summary in summaries):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ Simple Hugin project generator.
 
 import glob
 import argparse
+import asyncio
 import os
 import os.path
 import random
@@ -13,30 +14,46 @@ import time
 import threading
 import concurrent.futures
 import logging
+import shutil
 import sys
 import math
 
 import quickypano
+import quickypano.cache
+import quickypano.exif
+import quickypano.geometry
 import quickypano.project
 import quickypano.hugin
+import quickypano.hugin_async
+import quickypano.huginpto
+import quickypano.proxies
+import quickypano.scheduler
+import quickypano.trace
+
+# Rough estimate of cpfind's peak memory use, per input pixel plus a fixed overhead.
+CPFIND_BYTES_PER_PIXEL = 24
+CPFIND_BASE_MEMORY = 100 * 2 ** 20
 
 
 class DummyExecutor:
+    """Runs tasks immediately in the submitting thread."""
+
     def __init__(self, nr_of_threads=None):
-        self.queue = []
+        pass
 
-    def submit(self, callable, *args):
-        self.queue.append((callable, args))
+    def submit(self, callable, *args, **resources):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(callable(*args))
+        except Exception as ex:
+            future.set_exception(ex)
+        return future
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type:
-            return False
-
-        for callable, args in self.queue:
-            callable(*args)
+        return False
 
 
 def main():
@@ -57,11 +74,71 @@ def main():
                         help='Run single-threaded for easier debuggin')
     parser.add_argument('--no-cp', action='store_true', default=False,
                         help="Don't find control points")
+    parser.add_argument('--min-overlap', metavar='FRACTION', type=float, default=0.25,
+                        help='Only find control points between images whose predicted '
+                             'overlap is at least this fraction (default: %(default)s)')
+    parser.add_argument('--cp-strategy', choices=['pairs', 'single', 'compare'],
+                        default='pairs',
+                        help='Run cpfind once per image pair, or once for all pairs. '
+                             '"compare" runs both, reports their timing, and keeps '
+                             'the per-pair result.')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=None,
+                        help='Maximum number of concurrent cpfind processes; defaults to '
+                             'the number of cores divided by --threads-per-job')
+    parser.add_argument('--threads-per-job', metavar='N', type=int, default=1,
+                        help='Number of threads for each cpfind process')
+    parser.add_argument('--cores', metavar='N', type=int, default=None,
+                        help='Number of cores cpfind processes may use together; '
+                             'defaults to all cores')
+    parser.add_argument('--max-mem', metavar='SIZE', type=quickypano.scheduler.parse_size,
+                        default=None,
+                        help='Memory budget for concurrent cpfind processes, like "16G"')
+    parser.add_argument('--async', dest='use_async', action='store_true', default=False,
+                        help='Run the per-pair cpfind processes from an asyncio event loop '
+                             'instead of a thread pool')
+    parser.add_argument('--cp-timeout', metavar='SECONDS', type=float, default=None,
+                        help='Kill a per-pair cpfind process after this many seconds; '
+                             'only used with --async')
+    parser.add_argument('--cp-cache', metavar='DIR', type=str,
+                        default=quickypano.cache.default_cache_dir('cpfind'),
+                        help='Directory for caching cpfind results (default: %(default)s)')
+    parser.add_argument('--cp-cache-size', metavar='SIZE', type=quickypano.scheduler.parse_size,
+                        default='256M',
+                        help='Maximum size of the cpfind result cache (default: %(default)s)')
+    parser.add_argument('--no-cp-cache', action='store_true', default=False,
+                        help="Don't use the cpfind result cache")
+    parser.add_argument('--incremental', action='store_true', default=False,
+                        help='Reuse control points from the existing output file for '
+                             'images that did not change')
+    parser.add_argument('--no-keypoints', action='store_true', default=False,
+                        help="Don't extract keypoints once per image before matching pairs")
+    parser.add_argument('--proxy-scale', type=int, choices=[1, 2, 4, 8], default=1,
+                        help='Find control points on proxy images downscaled by this factor')
+    parser.add_argument('--canvas-scale', metavar='FACTOR', type=float, default=1.0,
+                        help='Scale of the output canvas relative to the optimal size, '
+                             'computed from the resolution of the photos (default: %(default)s)')
+    parser.add_argument('--max-canvas-width', metavar='PIXELS', type=int,
+                        default=quickypano.geometry.MAX_CANVAS_WIDTH,
+                        help='Maximum width of the output canvas; 0 for no maximum '
+                             '(default: %(default)s)')
+    parser.add_argument('--pto-var', action='store_true', default=False,
+                        help='Set the optimizer variables with pto_var instead of natively')
+    parser.add_argument('--trace', metavar='FILE', type=str, default=None,
+                        help='Write a timeline of all stages and Hugin processes to FILE, '
+                             'in Chrome trace-event format')
+    parser.add_argument('--snapshot', metavar='FILE', type=str, default=None,
+                        help='Also save the project as snapshot, which Project.load() '
+                             'reads back in milliseconds')
+    parser.add_argument('--ingest-workers', metavar='N', type=int, default=None,
+                        help='Number of threads reading photo metadata')
 
     args = parser.parse_args()
     basedir = os.path.dirname(args.filename)
     if args.debug:
         quickypano.hugin.set_debugging(True)
+    quickypano.hugin.set_use_pto_var(args.pto_var)
+    if args.trace:
+        quickypano.trace.start()
 
     start_time = time.time()
 
@@ -76,8 +153,10 @@ def main():
         photo_glob_uc = os.path.normpath(os.path.join(basedir, 'jpeg/*.JPG'))
         photo_fnames = glob.glob(photo_glob_lc) + glob.glob(photo_glob_uc)
 
+    metadata_cache = quickypano.exif.MetadataCache.for_directory(basedir)
     project = quickypano.project.Project()
-    project.load_photos(photo_fnames)
+    project.load_photos(photo_fnames, max_workers=args.ingest_workers, cache=metadata_cache)
+    metadata_cache.save()
     project.hugin_filename = args.filename
 
     # Detect HDR stack size.
@@ -102,31 +181,141 @@ def main():
 
     project.move_anchor(args.hdr_offset)
     project.set_variables()
+    project.canvas_scale = args.canvas_scale
+    project.max_canvas_width = args.max_canvas_width or None
+    print('Output canvas is %ix%i pixels' % project.canvas_size)
 
     project_lock = threading.RLock()
 
+    if args.no_cp_cache:
+        cp_cache = None
+    else:
+        cp_cache = quickypano.cache.DirectoryCache(args.cp_cache, args.cp_cache_size)
+
+    if args.no_keypoints:
+        keypath = None
+    else:
+        keypath = os.path.join(basedir, 'keypoints')
+
     # Find control points
-    def find_control_points(idx_0, idx_1):
-        if idx_0 > idx_1:
-            idx_0, idx_1 = idx_1, idx_0
+    def cp_cache_key(idx_0, idx_1, cpfind_args):
+        return quickypano.cache.make_key(
+            'cpfind',
+            metadata_cache.digest(project.photos[idx_0].filename),
+            metadata_cache.digest(project.photos[idx_1].filename),
+            quickypano.hugin.cpfind_version(),
+            cpfind_args,
+            args.proxy_scale,
+        )
+
+    def add_control_points(idx_0, idx_1, cpoint_lines):
+        """Adds control points, given as the part of 'c' lines after n and N."""
+
+        with project_lock:
+            project.control_points.extend('c n%i N%i %s' % (idx_0, idx_1, cpoint_line)
+                                          for cpoint_line in cpoint_lines)
+
+    def add_cached_control_points(idx_0, idx_1, cpfind_args) -> bool:
+        """Adds control points from the cache, returns False on a cache miss."""
+
+        if cp_cache is None:
+            return False
+
+        cached = cp_cache.get(cp_cache_key(idx_0, idx_1, cpfind_args))
+        if cached is None:
+            return False
+
+        log.info('Using cached control points for images %i -- %i', idx_0, idx_1)
+        add_control_points(idx_0, idx_1, cached.decode('utf-8').splitlines())
+        return True
+
+    def cache_control_points(idx_0, idx_1, cpfind_args, cpoint_lines):
+        if cp_cache is None:
+            return
+        data = '\n'.join(cpoint_lines).encode('utf-8')
+        cp_cache.put(cp_cache_key(idx_0, idx_1, cpfind_args), data)
+
+    proxy_fnames = {}  # image index -> proxy filename
+
+    def make_proxy_images(indices):
+        if args.proxy_scale == 1:
+            return
+
+        fnames = quickypano.proxies.make_proxies(
+            [project.photos[idx].filename for idx in indices],
+            os.path.join(basedir, 'proxies'), args.proxy_scale, max_workers=args.jobs)
+        proxy_fnames.update(zip(indices, fnames))
 
+    keypoint_fnames = {}  # image index -> uniquely named link for the keypoint stage
+
+    def cp_filename(idx):
+        """Returns the filename of the image cpfind looks at."""
+        if idx in keypoint_fnames:
+            return keypoint_fnames[idx]
+        return proxy_fnames.get(idx, project.photos[idx].filename)
+
+    def cp_slice(indices):
+        """Returns a slice of the project for cpfind, on proxy images if enabled."""
+
+        clone = project.get_slice(indices)
+        for idx, photo in zip(indices, clone.photos):
+            photo.filename = cp_filename(idx)
+        if args.proxy_scale == 1:
+            return clone
+
+        for photo in clone.photos:
+            params = photo.parameters
+            params['w'], params['h'] = quickypano.proxies.proxy_size(
+                params['w'], params['h'], args.proxy_scale)
+        return clone
+
+    def to_full_resolution(idx_0, idx_1, coords):
+        """Scales the x, y, X and Y tokens of a 'c' line from proxy to full-size pixels."""
+
+        if args.proxy_scale == 1:
+            return coords
+
+        factors = []
+        for idx in (idx_0, idx_1):
+            params = project.photos[idx].parameters
+            proxy_w, proxy_h = quickypano.proxies.proxy_size(
+                params['w'], params['h'], args.proxy_scale)
+            factors += [params['w'] / proxy_w, params['h'] / proxy_h]
+
+        return ['%s%.4f' % (token[0], float(token[1:]) * factor)
+                for token, factor in zip(coords, factors)]
+
+    def temp_pto_names():
         pid = os.getpid()
         rdm = random.randint(0, 2 ** 20)
 
-        log.info('Finding control points for images %i -- %i', idx_0, idx_1)
+        return (os.path.join(basedir, 'cpfind_in-%i-%i.pto' % (pid, rdm)),
+                os.path.join(basedir, 'cpfind_out-%i-%i.pto' % (pid, rdm)))
 
-        cpfind_inname = os.path.join(basedir, 'cpfind_in-%i-%i.pto' % (pid, rdm))
-        cpfind_outname = os.path.join(basedir, 'cpfind_out-%i-%i.pto' % (pid, rdm))
+    def remove_files(*filenames):
+        for fname in filenames:
+            try:
+                os.unlink(fname)
+            except FileNotFoundError:
+                pass
 
-        clone = project.get_slice([idx_0, idx_1])
+    def prepare_pair(idx_0, idx_1):
+        """Writes the two-image project for cpfind, returns the (input, output) filenames."""
+
+        cpfind_inname, cpfind_outname = temp_pto_names()
+
+        clone = cp_slice([idx_0, idx_1])
         clone.hugin_filename = cpfind_inname
         clone.anchor_exposure = 0
         # clone.set_variables()
         clone.create_hugin_project()
 
-        quickypano.hugin.cpfind(clone.hugin_filename, cpfind_outname)
+        return cpfind_inname, cpfind_outname
+
+    def merge_pair(idx_0, idx_1, cpfind_outname):
+        """Merges found control points with our project definition."""
 
-        # Merge found control points with our project definition
+        cpoint_lines = []
         with open(cpfind_outname, 'r', encoding='utf-8') as infile:
             # Load control points
             for line in infile:
@@ -134,90 +323,388 @@ def main():
                     continue
 
                 cpoint_info = line.split()
-                cpoint_line = ' '.join(cpoint_info[3:])
-                with project_lock:
-                    project.control_points.append('c n%i N%i %s' % (idx_0, idx_1, cpoint_line))
+                coords = to_full_resolution(idx_0, idx_1, cpoint_info[3:7])
+                cpoint_lines.append(' '.join(coords + cpoint_info[7:]))
 
-        os.unlink(cpfind_inname)
-        os.unlink(cpfind_outname)
+        add_control_points(idx_0, idx_1, cpoint_lines)
+        cache_control_points(idx_0, idx_1, [], cpoint_lines)
 
-    def task_done(future):
-        exception = future.exception()
-        if exception is None:
-            return
+    def find_control_points(idx_0, idx_1):
+        if idx_0 > idx_1:
+            idx_0, idx_1 = idx_1, idx_0
+
+        log.info('Finding control points for images %i -- %i', idx_0, idx_1)
 
+        with quickypano.trace.span('find_control_points', 'cpfind', images=[idx_0, idx_1]):
+            cpfind_inname, cpfind_outname = prepare_pair(idx_0, idx_1)
+            try:
+                quickypano.hugin.cpfind(cpfind_inname, cpfind_outname,
+                                        threads=args.threads_per_job, keypath=keypath)
+                merge_pair(idx_0, idx_1, cpfind_outname)
+            finally:
+                remove_files(cpfind_inname, cpfind_outname)
+
+    def log_task_error(exception):
         import traceback
 
         lines = traceback.format_exception_only(type(exception), exception)
         log.error('Exception trying to find control points:\n%s', '\n'.join(lines))
 
+    def task_done(future):
+        exception = future.exception()
+        if exception is not None:
+            log_task_error(exception)
+
+    def cpfind_memory(indices):
+        pixels = sum(project.photos[idx].parameters['w'] * project.photos[idx].parameters['h']
+                     for idx in indices)
+        return CPFIND_BASE_MEMORY + CPFIND_BYTES_PER_PIXEL * pixels
+
+    def cpfind_jobs(budget):
+        if args.debug:
+            return 1
+        return args.jobs or max(1, budget.cores // args.threads_per_job)
+
+    def make_executor():
+        if args.debug:
+            return DummyExecutor()
+
+        budget = quickypano.scheduler.ResourceBudget(cores=args.cores, memory=args.max_mem)
+        jobs = cpfind_jobs(budget)
+        log.info('Running up to %i cpfind processes of %i threads on %i cores',
+                 jobs, args.threads_per_job, budget.cores)
+        return quickypano.scheduler.BudgetExecutor(jobs, budget)
+
+    def prefetch_digests(indices):
+        """Computes the content digests of the images in parallel."""
+
+        fnames = [project.photos[idx].filename for idx in indices]
+        with concurrent.futures.ThreadPoolExecutor(args.ingest_workers) as executor:
+            list(executor.map(metadata_cache.digest, fnames))
+
+    def make_keypoint_links(indices):
+        """Links the images cpfind looks at under a name with their content digest.
+
+        cpfind names keyfiles after the image basename, so images with the
+        same basename in different directories would share a keyfile.
+        """
+
+        link_dir = os.path.join(keypath, 'images')
+        os.makedirs(link_dir, exist_ok=True)
+        for idx in indices:
+            if idx in keypoint_fnames:
+                continue
+            target = os.path.abspath(proxy_fnames.get(idx, project.photos[idx].filename))
+            stem, ext = os.path.splitext(os.path.basename(target))
+            digest = metadata_cache.digest(project.photos[idx].filename)
+            link = os.path.join(link_dir, '%s-%s%s' % (stem, digest[:12], ext))
+            if not os.path.exists(link):
+                try:
+                    os.symlink(target, link)
+                except OSError:
+                    # No symlinks on this platform or file system.
+                    shutil.copyfile(target, link)
+            keypoint_fnames[idx] = link
+
+    def extract_keypoints(pairs, naive_extractions: int=None):
+        """Extracts the keypoints of every image once, before matching the pairs.
+
+        Keyfiles that are newer than their image are reused.
+
+        :param naive_extractions: number of keypoint extractions cpfind would
+            do without this stage, or None if that is not known.
+        """
+
+        if keypath is None:
+            return
+
+        indices = sorted({idx for pair in pairs for idx in pair})
+        make_keypoint_links(indices)
+        todo = []
+        for idx in indices:
+            fname = cp_filename(idx)
+            keyfile = quickypano.hugin.keyfile_name(keypath, fname)
+            try:
+                up_to_date = os.path.getmtime(keyfile) >= os.path.getmtime(fname)
+            except FileNotFoundError:
+                up_to_date = False
+            if not up_to_date:
+                todo.append(idx)
+
+        def extract(idx):
+            log.info('Extracting keypoints of image %i', idx)
+            cpfind_inname, _ = temp_pto_names()
+
+            with quickypano.trace.span('extract keypoints', 'cpfind', image=idx):
+                clone = cp_slice([idx])
+                clone.hugin_filename = cpfind_inname
+                clone.create_hugin_project()
+
+                quickypano.hugin.cpfind_keypoints(cpfind_inname, keypath,
+                                                  threads=args.threads_per_job)
+                os.unlink(cpfind_inname)
+
+        with make_executor() as executor:
+            for idx in todo:
+                future = executor.submit(extract, idx,
+                                         cores=args.threads_per_job,
+                                         memory=cpfind_memory((idx,)))
+                future.add_done_callback(task_done)
+
+        if naive_extractions is None:
+            log.info('Extracted keypoints of %i of %i images', len(todo), len(indices))
+        else:
+            log.info('Extracted keypoints of %i images; avoided %i of %i keypoint extractions',
+                     len(todo), naive_extractions - len(todo), naive_extractions)
+
     def submit_task(executor, idx0, idx1):
-        future = executor.submit(find_control_points, idx0, idx1)
+        future = executor.submit(find_control_points, idx0, idx1,
+                                 cores=args.threads_per_job,
+                                 memory=cpfind_memory((idx0, idx1)))
         future.add_done_callback(task_done)
 
-    def find_cpoints_for_ring(ring_size, ring_offset, executor):
-        ring_offset *= project.stack_size
+    async def find_control_points_async(pairs):
+        """Runs cpfind for every pair from one event loop, without a thread per task.
+
+        Writing the pair's project, which may run pto_var, and merging the
+        found control points block, so they run on the loop's default executor.
+        """
+
+        loop = asyncio.get_running_loop()
+        budget = quickypano.scheduler.AsyncResourceBudget(cores=args.cores,
+                                                            memory=args.max_mem)
+        limit = asyncio.Semaphore(cpfind_jobs(budget))
+        log.info('Running up to %i cpfind processes of %i threads on %i cores from an '
+                 'event loop', cpfind_jobs(budget), args.threads_per_job, budget.cores)
+
+        # Concurrent coroutines need their own trace tracks; reuse them between tasks.
+        free_tracks = []
+
+        async def find(idx_0, idx_1):
+            async with budget.reserve_async(args.threads_per_job,
+                                            cpfind_memory((idx_0, idx_1))):
+                log.info('Finding control points for images %i -- %i', idx_0, idx_1)
+
+                if free_tracks:
+                    track = free_tracks.pop()
+                else:
+                    track = quickypano.trace.new_track('cpfind task')
+                try:
+                    with quickypano.trace.span('find_control_points', 'cpfind', tid=track,
+                                               images=[idx_0, idx_1]):
+                        cpfind_inname, cpfind_outname = await loop.run_in_executor(
+                            None, prepare_pair, idx_0, idx_1)
+                        try:
+                            await quickypano.hugin_async.cpfind(
+                                cpfind_inname, cpfind_outname, threads=args.threads_per_job,
+                                keypath=keypath, timeout=args.cp_timeout, limit=limit)
+                            await loop.run_in_executor(
+                                None, merge_pair, idx_0, idx_1, cpfind_outname)
+                        finally:
+                            remove_files(cpfind_inname, cpfind_outname)
+                finally:
+                    free_tracks.append(track)
+
+        results = await asyncio.gather(*(find(idx_0, idx_1) for idx_0, idx_1 in pairs),
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, asyncio.TimeoutError):
+                log.error('Timeout trying to find control points after %.0f seconds',
+                          args.cp_timeout)
+            elif isinstance(result, BaseException):
+                log_task_error(result)
+
+    def control_point_pairs():
+        """Returns the (low index, high index) pairs of images to match."""
+
+        return quickypano.geometry.overlapping_pairs(project, args.min_overlap)
+
+    def find_control_points_per_pair(pairs):
+        """Runs cpfind once for every pair, on a two-image project."""
+
+        pairs = [pair for pair in pairs if not add_cached_control_points(*pair, [])]
+        extract_keypoints(pairs, 2 * len(pairs))
+
+        if args.use_async:
+            asyncio.run(find_control_points_async(pairs))
+            return
 
-        for stack_idx in range(ring_size):
-            next_stack_idx = (stack_idx + 1) % ring_size
-            idx = project.stack_size * stack_idx
-            next_idx = project.stack_size * next_stack_idx
+        with make_executor() as executor:
+            for idx0, idx1 in pairs:
+                log.debug('Calling find_control_points(%i, %i)', idx0, idx1)
+                submit_task(executor, idx0, idx1)
 
-            log.debug('Calling find_control_points(%i, %i)', idx + ring_offset,
-                      next_idx + ring_offset)
-            submit_task(executor, idx + ring_offset, next_idx + ring_offset)
+    def find_control_points_single(pairs):
+        """Runs cpfind once on all images involved, then keeps only the given pairs.
 
-    def connect_rings(name1, name2, executor):
-        """Determine suitable divisor for inter-ring connections."""
+        cpfind has no option to match an explicit list of pairs, so it is run
+        with --prealigned to only match images that overlap according to
+        their initial yaw/pitch/roll, and the other pairs are dropped.
+        """
 
-        sett = project.settings
+        cpfind_args = ['--prealigned']
+        pairs = [pair for pair in pairs if not add_cached_control_points(*pair, cpfind_args)]
+        if not pairs:
+            return
 
-        row_size1 = sett.row(name1)
-        row_size2 = sett.row(name2)
-        if row_size1 == row_size2:
-            # All the same size, divide into quarters
-            gcd = 4
-        else:
-            gcd = math.gcd(row_size1, row_size2)
+        indices = sorted({idx for pair in pairs for idx in pair})
+        extract_keypoints(pairs)
+
+        found = {pair: [] for pair in pairs}
+        log.info('Finding control points for %i pairs of %i images in one cpfind run',
+                 len(pairs), len(indices))
+
+        cpfind_inname, cpfind_outname = temp_pto_names()
 
-        log.debug('using gcd: %r', gcd)
-        step1 = row_size1 // gcd
-        step2 = row_size2 // gcd
+        clone = cp_slice(indices)
+        clone.hugin_filename = cpfind_inname
+        clone.create_hugin_project()
+
+        quickypano.hugin.cpfind(clone.hugin_filename, cpfind_outname, extra_args=cpfind_args,
+                                keypath=keypath)
+
+        dropped = 0
+        with open(cpfind_outname, 'r', encoding='utf-8') as infile:
+            for line in infile:
+                if not line.startswith('c '):
+                    continue
+
+                cpoint_info = line.split()
+                idx_0 = indices[int(cpoint_info[1][1:])]
+                idx_1 = indices[int(cpoint_info[2][1:])]
+                coords = cpoint_info[3:7]
+                if idx_0 > idx_1:
+                    # Swap images, so x/y and X/Y swap too.
+                    idx_0, idx_1 = idx_1, idx_0
+                    coords = [coords[0][0] + coords[2][1:], coords[1][0] + coords[3][1:],
+                              coords[2][0] + coords[0][1:], coords[3][0] + coords[1][1:]]
+
+                if (idx_0, idx_1) not in found:
+                    dropped += 1
+                    continue
 
-        start_idx1 = sett.start_offset(name1)
-        start_idx2 = sett.start_offset(name2)
-        ssize = project.stack_size
+                coords = to_full_resolution(idx_0, idx_1, coords)
+                found[idx_0, idx_1].append(' '.join(coords + cpoint_info[7:]))
 
-        for stepidx in range(gcd):
-            idx1 = ssize * (start_idx1 + stepidx * step1)
-            idx2 = ssize * (start_idx2 + stepidx * step2)
+        for (idx_0, idx_1), cpoint_lines in found.items():
+            add_control_points(idx_0, idx_1, cpoint_lines)
+            # With --prealigned cpfind skips pairs that don't overlap according to
+            # their initial yaw/pitch/roll, so no control points can mean "not tried".
+            # Those must be tried again once the geometry or settings change.
+            if cpoint_lines:
+                cache_control_points(idx_0, idx_1, cpfind_args, cpoint_lines)
 
-            log.debug('Connecting rings step %i, connecting %i - %i', stepidx,  idx1, idx2)
-            submit_task(executor, idx1, idx2)
+        log.debug('Dropped %i control points of unwanted pairs', dropped)
+        os.unlink(cpfind_inname)
+        os.unlink(cpfind_outname)
 
-    def find_all_control_points():
-        # Create control points for each ring
-        # TODO: use order from settings
+    def reuse_control_points(pairs):
+        """Takes control points from the existing PTO for images that didn't change.
+
+        Images are matched by path, so the indices are remapped correctly when
+        move_anchor() or a different stack size reordered the photos. Old pairs
+        that are not among the pairs are dropped, so the result is the same as
+        that of a fresh run, also when --min-overlap changed. An image
+        is unchanged when its content digest matches the one written in the PTO.
+        When there is no digest (Hugin saved the file itself) the image is
+        considered unchanged if it is older than the PTO.
+
+        :returns: (reused 'c' lines, pairs that still need cpfind)
+        """
+
+        if not os.path.exists(project.hugin_filename):
+            log.info('%s does not exist yet, finding all control points',
+                     project.hugin_filename)
+            return [], pairs
+
+        old_pto = quickypano.huginpto.HuginPto(project.hugin_filename)
+        old_digests = quickypano.hugin.read_image_digests(project.hugin_filename)
+        pto_mtime = os.path.getmtime(project.hugin_filename)
+        new_indices = {os.path.normcase(os.path.abspath(photo.filename)): idx
+                       for idx, photo in enumerate(project.photos)}
+
+        # Map old image index to new image index, for unchanged images only.
+        # Only stack anchors are matched, so only those are of interest.
+        old_to_new = {}
+        for old_idx, (fname, old_digest) in enumerate(zip(old_pto.get_input_files(),
+                                                           old_digests)):
+            new_idx = new_indices.get(os.path.normcase(os.path.abspath(fname)))
+            if new_idx is None or new_idx % project.stack_size:
+                continue
+            if old_digest is None:
+                unchanged = os.path.getmtime(fname) <= pto_mtime
+            else:
+                unchanged = old_digest == metadata_cache.digest(fname)
+            if unchanged:
+                old_to_new[old_idx] = new_idx
+
+        wanted = set(pairs)
+        reused_lines = []
+        reused_pairs = set()
+        old_cpoints = old_pto.parsed['c']
+        for old_idx_0, old_idx_1 in old_pto.control_points.pairs():
+            if old_idx_0 not in old_to_new or old_idx_1 not in old_to_new:
+                continue
+            idx_0, idx_1 = old_to_new[old_idx_0], old_to_new[old_idx_1]
+            swap = idx_0 > idx_1
+            if swap:
+                idx_0, idx_1 = idx_1, idx_0
+            if (idx_0, idx_1) not in wanted:
+                continue
+            reused_pairs.add((idx_0, idx_1))
+
+            for row in old_pto.control_points.pair_rows(old_idx_0, old_idx_1):
+                cpoint = old_cpoints[row]
+                if swap:
+                    coords = (cpoint['X'], cpoint['Y'], cpoint['x'], cpoint['y'])
+                else:
+                    coords = (cpoint['x'], cpoint['y'], cpoint['X'], cpoint['Y'])
+                reused_lines.append('c n%i N%i x%s y%s X%s Y%s t%s' % (
+                    (idx_0, idx_1) + coords + (cpoint.get('t', '0'),)))
+
+        remaining = [pair for pair in pairs if pair not in reused_pairs]
+        log.info('Reusing %i control points of %i unchanged anchor images; '
+                 '%i of %i pairs left to do',
+                 len(reused_lines), len(old_to_new), len(remaining), len(pairs))
+        return reused_lines, remaining
+
+    def find_all_control_points(pairs):
         project.control_points.clear()
 
         quickypano.lowpriority()
 
-        if args.debug:
-            exec_class = DummyExecutor
+        with quickypano.trace.span('image digests'):
+            prefetch_digests(sorted({idx for pair in pairs for idx in pair}))
+        if args.incremental:
+            with quickypano.trace.span('reuse control points'):
+                reused_lines, pairs = reuse_control_points(pairs)
         else:
-            exec_class = concurrent.futures.ThreadPoolExecutor
-
-        with exec_class(os.cpu_count()) as executor:
-            sett = project.settings
-            find_cpoints_for_ring(sett.ROW_MIDDLE, sett.start_offset('MIDDLE'), executor)
-            find_cpoints_for_ring(sett.ROW_DOWN, sett.start_offset('DOWN'), executor)
-            find_cpoints_for_ring(sett.ROW_UP, sett.start_offset('UP'), executor)
+            reused_lines = []
+        with quickypano.trace.span('proxy images'):
+            make_proxy_images(sorted({idx for pair in pairs for idx in pair}))
 
-            # Connect rings
-            connect_rings('MIDDLE', 'DOWN', executor)
-            connect_rings('MIDDLE', 'UP', executor)
-
-            # TODO: zenith & nadir shots
+        if args.cp_strategy == 'compare':
+            strategies = ['single', 'pairs']
+        else:
+            strategies = [args.cp_strategy]
+
+        timings = {}
+        for strategy in strategies:
+            project.control_points[:] = reused_lines
+            cp_start_time = time.time()
+            with quickypano.trace.span('control points (%s)' % strategy, pairs=len(pairs)):
+                if strategy == 'single':
+                    find_control_points_single(pairs)
+                else:
+                    find_control_points_per_pair(pairs)
+            timings[strategy] = time.time() - cp_start_time
+
+            log.info('Control point strategy %r: %i control points in %.1f seconds',
+                     strategy, len(project.control_points), timings[strategy])
+
+        if len(timings) > 1:
+            log.info('Single cpfind run took %.1f%% of the per-pair time',
+                     100 * timings['single'] / max(timings['pairs'], 1e-6))
 
         sys.stderr.flush()
         sys.stdout.flush()
@@ -226,7 +713,19 @@ def main():
         log.info('Found a total of %i control points', len(project.control_points))
 
     if not args.no_cp:
-        find_all_control_points()
+        pairs = control_point_pairs()
+        find_all_control_points(pairs)
+
+        # Record the digests of the matched images, for --incremental.
+        for idx in {idx for pair in pairs for idx in pair}:
+            photo = project.photos[idx]
+            photo.digest = metadata_cache.digest(photo.filename)
+        metadata_cache.save()
+
+    if args.snapshot:
+        with quickypano.trace.span('save snapshot'):
+            project.save(args.snapshot)
+        log.info('Saved project snapshot %s', args.snapshot)
 
     # Create Hugin project file
     project.create_hugin_project()
@@ -234,6 +733,9 @@ def main():
     end_time = time.time()
     log.info('Total running time: %.1f seconds', end_time - start_time)
 
+    if args.trace:
+        quickypano.trace.save(args.trace)
+
     if hasattr(os, 'startfile'):
         os.startfile(project.hugin_filename)
 
@@ -2,10 +2,16 @@
 
 import argparse
 import glob
+import logging
 import time
 import os.path
 
+import quickypano.cache
 import quickypano.hugin
+import quickypano.render
+import quickypano.scheduler
+import quickypano.tiff
+import quickypano.trace
 
 
 def main():
@@ -13,6 +19,10 @@ def main():
 
     start_time = time.time()
 
+    logging.basicConfig(level=logging.INFO)
+    log = logging.getLogger('quickypano')
+    log.setLevel(logging.INFO)
+
     parser = argparse.ArgumentParser(description='Renders a panorama using "make".')
     parser.add_argument('--hugin', metavar='HUGIN_DIR', type=str, help="Hugin's directory",
                         default=r'c:\Program Files*\Hugin')
@@ -21,8 +31,45 @@ def main():
     parser.add_argument('-f', '--filename', metavar='PTO', type=str,
                         nargs='?',
                         help='The PTO filename. Optional if there is only one PTO file.')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=None,
+                        help='Number of make jobs; chosen from the number of cores, '
+                             'the available memory and the panorama size by default')
+    parser.add_argument('--nona-threads', metavar='N', type=int, default=None,
+                        help='Number of threads per nona process; by default the cores '
+                             'are divided over the make jobs')
+    parser.add_argument('--cores', metavar='N', type=int, default=None,
+                        help='Number of cores to use; defaults to all cores')
+    parser.add_argument('--max-mem', metavar='SIZE', type=quickypano.scheduler.parse_size,
+                        default=None,
+                        help='Memory budget, like "16G"; defaults to the available memory')
+    parser.add_argument('--native', action='store_true', default=False,
+                        help='Run the makefile with the built-in executor instead of make; '
+                             'EXTRA_ARGS are then targets and NAME=value variables')
+    parser.add_argument('--retries', metavar='N', type=int, default=0,
+                        help='Number of times a failed task is retried, with --native')
+    parser.add_argument('--tile-size', metavar='PIXELS', type=int, default=None,
+                        help='Render in tiles of at most this many pixels square, in parallel '
+                             'with the built-in executor, and assemble them afterwards into '
+                             'an uncompressed TIFF; bounds the memory use of huge panoramas')
+    parser.add_argument('--tile-margin', metavar='PIXELS', type=int,
+                        default=quickypano.render.TILE_MARGIN,
+                        help='Extra pixels rendered around each tile for the seams '
+                             '(default: %(default)s)')
+    parser.add_argument('--render-cache', metavar='DIR', type=str,
+                        default=quickypano.cache.default_cache_dir('render'),
+                        help='Directory for caching rendered panoramas (default: %(default)s)')
+    parser.add_argument('--render-cache-size', metavar='SIZE',
+                        type=quickypano.scheduler.parse_size, default='8G',
+                        help='Maximum size of the render cache (default: %(default)s)')
+    parser.add_argument('--no-render-cache', action='store_true', default=False,
+                        help="Don't use the render cache")
+    parser.add_argument('--trace', metavar='FILE', type=str, default=None,
+                        help='Write a timeline of the Hugin processes to FILE, '
+                             'in Chrome trace-event format')
     parser.add_argument('extra_args', type=str, help='Extra Make arguments', nargs='*')
     args = parser.parse_args()
+    if args.trace:
+        quickypano.trace.start()
 
     quickypano.hugin.find_hugin(args.hugin)
 
@@ -39,8 +86,53 @@ def main():
 
     print('Processing %s' % pto)
     quickypano.lowpriority()
-    quickypano.hugin.make(pto, on_gpu=args.gpu, make_args=args.extra_args)
 
+    def render_tiled():
+        budget = quickypano.scheduler.ResourceBudget(
+            cores=args.cores, memory=args.max_mem or quickypano.scheduler.available_memory())
+        with quickypano.trace.span('tiled make', pto=pto, tile_size=args.tile_size):
+            try:
+                return [quickypano.render.render_tiled(pto, budget, tile_size=args.tile_size,
+                                                       margin=args.tile_margin, on_gpu=args.gpu,
+                                                       nona_threads=args.nona_threads,
+                                                       retries=args.retries)]
+            except (RuntimeError, quickypano.tiff.TiffError) as ex:
+                raise SystemExit(str(ex))
+
+    def render_make():
+        plan = quickypano.render.plan_make(pto, cores=args.cores, memory=args.max_mem,
+                                           on_gpu=args.gpu, jobs=args.jobs,
+                                           nona_threads=args.nona_threads)
+        for reason in plan.reasons:
+            log.info('Make plan: %s', reason)
+        log.info('Running make with %i jobs and %i nona threads', plan.jobs, plan.nona_threads)
+
+        with quickypano.trace.span('make', pto=pto, jobs=plan.jobs,
+                                   nona_threads=plan.nona_threads):
+            if args.native:
+                goals = [arg for arg in args.extra_args if '=' not in arg]
+                variables = dict(arg.split('=', 1) for arg in args.extra_args if '=' in arg)
+                quickypano.hugin.make_native(pto, goals, on_gpu=args.gpu, jobs=plan.jobs,
+                                             nona_threads=plan.nona_threads,
+                                             retries=args.retries, variables=variables)
+            else:
+                quickypano.hugin.make(pto, on_gpu=args.gpu, make_args=args.extra_args,
+                                      jobs=plan.jobs, nona_threads=plan.nona_threads)
+        return quickypano.render.render_outputs(quickypano.hugin.makefile_name(pto))
+
+    # Extra arguments can select other targets, so their output isn't cached.
+    render_cache = None
+    if not args.no_render_cache and not args.extra_args:
+        render_cache = quickypano.render.RenderCache(args.render_cache, args.render_cache_size)
+
+    renderer = quickypano.render.make_renderer(args.gpu, args.tile_size, args.tile_margin)
+    quickypano.render.cached_render(pto, render_cache,
+                                    render_tiled if args.tile_size else render_make, renderer)
+
+    finish(start_time, args.trace)
+
+
+def finish(start_time, trace_filename):
     end_time = time.time()
 
     print(50 * '-')
@@ -48,6 +140,9 @@ def main():
     str_duration = time.strftime('%H:%M:%S', time.gmtime(duration))
     print('Done! Duration: %s' % str_duration)
 
+    if trace_filename:
+        quickypano.trace.save(trace_filename)
+
 
 if __name__ == '__main__':
     main()
@@ -10,7 +10,7 @@ import subprocess
 
 import exifread
 
-from quickypano import huginpto
+from quickypano import exif, huginpto
 
 SourceImage = collections.namedtuple(
     'SourceImage',
@@ -50,31 +50,33 @@ def parse_cli() -> (Path, [Path], int):
 
 
 def parse_pto(pto_fname: Path) -> [SourceImage]:
-    pto = huginpto.HuginPto(str(pto_fname))
+    # Parse only the first HDR stack, without tokenising the rest of the file.
+    stack = []
+    with huginpto.HuginPto(str(pto_fname), lazy=True) as pto:
+        for idx in range(pto.count('i')):
+            img = pto.get_image(idx)
+            if stack and not img['y'].startswith('='):
+                # This is the start of the next stack; we're done.
+                break
+            stack.append(img)
+
+    # Get the EXIF of the source images, preferably from the cache.
+    cache = exif.MetadataCache.for_directory(str(pto_fname.parent))
+    fnames = [Path(img['n'].strip('"')) for img in stack]
+    metadata = cache.read_all(str(fname) for fname in fnames)
+    cache.save()
 
-    # Parse only the first HDR stack.
     source_images = []
-    for img in pto.parsed['i']:
-        if source_images and not img['y'].startswith('='):
-            # This is the start of the next stack; we're done.
-            break
-
-        fname = Path(img['n'].strip('"'))
-
-        # Parse EXIF of source image
-        with fname.open('rb') as infile:
-            exif = exifread.process_file(infile, details=False)
-        # pprint(sorted(exif.keys()))
-
+    for img, fname, meta in zip(stack, fnames, metadata):
         simg = SourceImage(
             ev=img['Eev'],
             fname=fname,
-            sspeed=exif['EXIF ShutterSpeedValue'].values[0],
-            exposure=exif['EXIF ExposureTime'].values[0],
-            aperture=exif['EXIF ApertureValue'].values[0],
-            fnumber=exif['EXIF FNumber'].values[0],
-            iso=exif['EXIF ISOSpeedRatings'].values[0],
-            exposure_bias=exif['EXIF ExposureBiasValue'].values[0],
+            sspeed=exifread.utils.Ratio(*meta.shutter_speed),
+            exposure=exifread.utils.Ratio(*meta.exposure_time),
+            aperture=exifread.utils.Ratio(*meta.aperture),
+            fnumber=exifread.utils.Ratio(*meta.fnumber),
+            iso=meta.iso,
+            exposure_bias=exifread.utils.Ratio(*meta.exposure_bias),
         )
         source_images.append(simg)
 
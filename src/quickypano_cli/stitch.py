@@ -2,15 +2,29 @@
 
 import glob
 import argparse
+import logging
 import time
+import quickypano.cache
 import quickypano.hugin
+import quickypano.render
+import quickypano.scheduler
 
 
 def main():
     """Stitches a single project."""
 
+    logging.basicConfig(level=logging.INFO)
+
     parser = argparse.ArgumentParser(description='Stitches a single Hugin project.')
     parser.add_argument('--hugin', metavar='HUGIN_DIR', type=str, help="Hugin's directory", nargs='?')
+    parser.add_argument('--render-cache', metavar='DIR', type=str,
+                        default=quickypano.cache.default_cache_dir('render'),
+                        help='Directory for caching rendered panoramas (default: %(default)s)')
+    parser.add_argument('--render-cache-size', metavar='SIZE',
+                        type=quickypano.scheduler.parse_size, default='8G',
+                        help='Maximum size of the render cache (default: %(default)s)')
+    parser.add_argument('--no-render-cache', action='store_true', default=False,
+                        help="Don't use the render cache")
     parser.add_argument('filename', metavar='FILENAME', type=str, help='the PTO filename', nargs='?')
 
     args = parser.parse_args()
@@ -25,7 +39,15 @@ def main():
 
         args.filename = ptos[0]
 
-    quickypano.hugin.stitch_project(args.filename)
+    def stitch():
+        quickypano.hugin.stitch_project(args.filename)
+        return quickypano.render.project_outputs(args.filename)
+
+    render_cache = None
+    if not args.no_render_cache:
+        render_cache = quickypano.render.RenderCache(args.render_cache, args.render_cache_size)
+    quickypano.render.cached_render(args.filename, render_cache, stitch,
+                                    quickypano.render.STITCH_RENDERER)
 
     end_time = time.time()
 
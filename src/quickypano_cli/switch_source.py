@@ -16,6 +16,30 @@ FTYPES = {
     'JPEG': {'path': 'jpeg', 'extension': 'jpg'},
 }
 
+fname_re = re.compile(r'n"\w+[/\\](\w+)\.\w+"')
+
+
+def switch_sources(infile, outfile, filetype: str) -> int:
+    """Copies a PTO file, pointing its image lines to the given file type.
+
+    :returns: the number of changed image lines.
+    """
+
+    ftype = FTYPES[filetype]
+    target = r'n"%s/\1.%s"' % (ftype['path'], ftype['extension'])
+
+    changes = 0
+    for line in infile:
+        if line.startswith('i '):
+            new_line = fname_re.sub(target, line)
+            if new_line != line:
+                changes += 1
+                line = new_line
+
+        outfile.write(line)
+
+    return changes
+
 
 def main():
     """Switches source images between JPEG and TIFF."""
@@ -41,26 +65,14 @@ def main():
         args.filename = ptos[0]
 
     print('Switching %s to %s' % (args.filename, args.filetype))
-    fname_re = re.compile(r'n"\w+[/\\](\w+)\.\w+"')
-    ftype = FTYPES[args.filetype]
-    target = r'n"%s/\1.%s"' % (ftype['path'], ftype['extension'])
 
     basename = os.path.dirname(args.filename)
     outname = os.path.join(basename, 'switch_source-%i.pto' % os.getpid())
     print('Writing to %s for now.' % outname)
-    print('Target: %s' % target)
 
-    changes = 0
     with open(args.filename, 'r', encoding='utf-8') as infile, \
             open(outname, 'w', encoding='utf-8') as outfile:
-        for line in infile:
-            if line.startswith('i '):
-                new_line = fname_re.sub(target, line)
-                if new_line != line:
-                    changes += 1
-                    line = new_line
-
-            outfile.write(line)
+        changes = switch_sources(infile, outfile, args.filetype)
 
     if not changes:
         print('No changes made to file.')
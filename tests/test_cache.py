@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from quickypano import cache
+
+
+class DirectoryCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.root = tmpdir.name
+        self.cache = cache.DirectoryCache(self.root, 300)
+
+    def put(self, key, mtime):
+        self.cache.put(key, key.encode() * 100)
+        os.utime(self.cache._path(key), (mtime, mtime))
+
+    def reopen(self):
+        """Opens the cache again, so it reads the mtimes set by put()."""
+        self.cache = cache.DirectoryCache(self.root, 300)
+
+    def test_get_put(self):
+        key = cache.make_key('pair', 1, 2)
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, b'control points')
+        self.assertEqual(self.cache.get(key), b'control points')
+
+    def test_evicts_least_recently_used(self):
+        self.put('a', 1000)
+        self.put('b', 2000)
+        self.put('c', 3000)
+        self.reopen()
+        self.cache.get('a')  # now the most recently used
+        self.cache.put('d', b'd' * 100)
+
+        self.assertIsNone(self.cache.get('b'))
+        for key in 'acd':
+            self.assertEqual(self.cache.get(key), key.encode() * 100)
+
+    def test_replaced_entry(self):
+        self.put('a', 1000)
+        self.put('b', 2000)
+        self.put('a', 3000)
+        self.reopen()
+        self.cache.put('c', b'c' * 100)
+        self.assertEqual([self.cache.get(key) is not None for key in 'abc'], [True, True, True])
+
+    def test_entry_larger_than_cache(self):
+        self.put('a', 1000)
+        self.cache.put('big', b'x' * 1000)
+        self.assertIsNone(self.cache.get('big'))
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_walks_once(self):
+        with mock.patch('os.walk', wraps=os.walk) as walk:
+            for idx in range(20):
+                self.cache.put('%02i' % idx, b'x' * 100)
+        self.assertEqual(walk.call_count, 1)
+        self.assertEqual(sum(self.cache.get('%02i' % idx) is not None for idx in range(20)), 3)
+
+    def test_removed_entry(self):
+        self.cache.put('a', b'a' * 200)
+        self.cache.remove('a')
+        self.cache.put('b', b'b' * 200)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), b'b' * 200)
@@ -0,0 +1,183 @@
+import io
+import os.path
+import struct
+import tempfile
+import unittest
+
+from quickypano import exif
+
+# TIFF field type -> struct format of its values; rationals are pairs of LONGs.
+_FORMATS = {3: 'H', 4: 'L', 5: 'L'}
+
+
+def _ifd(entries, offset: int, endian: str) -> bytes:
+    """Returns the IFD at the offset, followed by the values that don't fit in it.
+
+    :param entries: [(tag, field type, values)]
+    """
+
+    extra_start = offset + 2 + 12 * len(entries) + 4
+    table = struct.pack(endian + 'H', len(entries))
+    extra = b''
+    for tag, ftype, values in sorted(entries):
+        count = len(values) // 2 if ftype == 5 else len(values)
+        value = struct.pack('%s%i%s' % (endian, len(values), _FORMATS[ftype]), *values)
+        if len(value) <= 4:
+            value = value.ljust(4, b'\0')
+        else:
+            extra += value
+            value = struct.pack(endian + 'L', extra_start + len(extra) - len(value))
+        table += struct.pack(endian + 'HHL', tag, ftype, count) + value
+    return table + b'\0\0\0\0' + extra
+
+
+def tiff_data(entries, exif_entries=(), endian='<') -> bytes:
+    """Returns a TIFF header with the entries in IFD0, and an Exif IFD if given."""
+
+    header = (b'II' if endian == '<' else b'MM') + struct.pack(endian + 'HL', 42, 8)
+    if not exif_entries:
+        return header + _ifd(entries, 8, endian)
+
+    entries = list(entries) + [(exif.TAG_EXIF_IFD, 4, [0])]
+    exif_offset = 8 + len(_ifd(entries, 8, endian))
+    entries[-1] = (exif.TAG_EXIF_IFD, 4, [exif_offset])
+    return header + _ifd(entries, 8, endian) + _ifd(exif_entries, exif_offset, endian)
+
+
+EXIF_ENTRIES = [
+    (exif.TAG_EXPOSURE_TIME, 5, [1, 100]),
+    (exif.TAG_FNUMBER, 5, [28, 10]),
+    (exif.TAG_ISO, 3, [200]),
+]
+
+
+def segment(marker: int, payload: bytes) -> bytes:
+    return struct.pack('>BBH', 0xFF, marker, len(payload) + 2) + payload
+
+
+def jpeg_data(exif_payload: bytes=None, width=640, height=480) -> bytes:
+    data = b'\xff\xd8' + segment(0xE0, b'JFIF\0\x01\x01\0\0\x01\0\x01\0\0')
+    if exif_payload is not None:
+        data += segment(0xE1, b'Exif\0\0' + exif_payload)
+    data += segment(0xC0, struct.pack('>BHHB', 8, height, width, 1) + b'\x01\x11\x00')
+    # Start of scan and entropy-coded data, which must not be needed.
+    return data + segment(0xDA, b'\x01\x01\x00\x00\x3f\x00') + b'\x12\x34' * 16 + b'\xff\xd9'
+
+
+class ReadJpegTest(unittest.TestCase):
+    def test_exif_and_size(self):
+        # The size comes from the Start Of Frame, not from the EXIF tags.
+        data = jpeg_data(tiff_data([(exif.TAG_IMAGE_WIDTH, 3, [9999])], EXIF_ENTRIES))
+        tags, size = exif._read_jpeg(io.BytesIO(data[2:]))
+
+        self.assertEqual(size, (640, 480))
+        self.assertEqual(tags[exif.TAG_FNUMBER], (28, 10))
+        self.assertEqual(tags[exif.TAG_EXPOSURE_TIME], (1, 100))
+        self.assertEqual(tags[exif.TAG_ISO], 200)
+
+    def test_stops_at_start_of_frame(self):
+        data = jpeg_data(tiff_data([], EXIF_ENTRIES))
+        infile = io.BytesIO(data[2:])
+        exif._read_jpeg(infile)
+        self.assertLess(infile.tell(), data.index(b'\xff\xda'))
+
+    def test_without_exif(self):
+        tags, size = exif._read_jpeg(io.BytesIO(jpeg_data()[2:]))
+        self.assertEqual((tags, size), ({}, (640, 480)))
+
+    def test_no_start_of_frame(self):
+        data = b'\xff\xd8' + segment(0xE0, b'JFIF\0') + b'\xff\xd9'
+        with self.assertRaises(ValueError):
+            exif._read_jpeg(io.BytesIO(data[2:]))
+
+    def test_read_metadata(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'photo.jpg')
+            with open(filename, 'wb') as outfile:
+                outfile.write(jpeg_data(tiff_data([], EXIF_ENTRIES), 3456, 5184))
+            metadata = exif.read_metadata(filename)
+
+        self.assertEqual((metadata.width, metadata.height), (3456, 5184))
+        self.assertEqual(metadata.iso, 200)
+        self.assertIsNone(metadata.aperture)
+        self.assertAlmostEqual(metadata.exposure_value, 9.6147098, places=6)
+
+
+class TiffReaderTest(unittest.TestCase):
+    def test_read_ifd(self):
+        for endian in '<>':
+            data = tiff_data([(exif.TAG_IMAGE_WIDTH, 3, [3456]),
+                              (exif.TAG_IMAGE_LENGTH, 4, [5184]),
+                              (0x010f, 3, [1])], endian=endian)
+            reader = exif._TiffReader(io.BytesIO(data))
+            tags = reader.read_ifd(reader.first_ifd, {exif.TAG_IMAGE_WIDTH,
+                                                      exif.TAG_IMAGE_LENGTH})
+            self.assertEqual(tags, {exif.TAG_IMAGE_WIDTH: 3456, exif.TAG_IMAGE_LENGTH: 5184})
+
+    def test_rational_out_of_line(self):
+        data = tiff_data([(exif.TAG_FNUMBER, 5, [56, 10])])
+        reader = exif._TiffReader(io.BytesIO(data))
+        self.assertEqual(reader.read_ifd(reader.first_ifd, {exif.TAG_FNUMBER}),
+                         {exif.TAG_FNUMBER: (56, 10)})
+
+    def test_base_offset(self):
+        data = b'Exif\0\0' + tiff_data([], EXIF_ENTRIES)
+        tags = exif._TiffReader(io.BytesIO(data), 6).read_tags()
+        self.assertEqual(tags[exif.TAG_ISO], 200)
+        self.assertNotIn(exif.TAG_EXIF_IFD, tags)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            exif._TiffReader(io.BytesIO(b'XX*\0\x08\0\0\0'))
+
+    def test_multiple_values(self):
+        # Three SHORTs don't fit in the entry; two do. Only the first is returned of both.
+        data = tiff_data([(exif.TAG_ISO, 3, [100, 200, 400]), (exif.TAG_IMAGE_WIDTH, 3, [64, 32])])
+        reader = exif._TiffReader(io.BytesIO(data))
+        self.assertEqual(reader.read_ifd(reader.first_ifd, {exif.TAG_ISO, exif.TAG_IMAGE_WIDTH}),
+                         {exif.TAG_ISO: 100, exif.TAG_IMAGE_WIDTH: 64})
+
+
+class MetadataCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.dirname = tmpdir.name
+        self.filename = os.path.join(self.dirname, 'photo.jpg')
+        with open(self.filename, 'wb') as outfile:
+            outfile.write(jpeg_data(tiff_data([], EXIF_ENTRIES)))
+
+        self.cache = exif.MetadataCache.for_directory(self.dirname)
+        self.metadata = exif.read_metadata(self.filename)
+        self.cache.put(self.filename, self.metadata)
+
+    def test_hit(self):
+        self.assertEqual(self.cache.get(self.filename), self.metadata)
+
+    def test_saved(self):
+        self.cache.save()
+        cache = exif.MetadataCache.for_directory(self.dirname)
+        self.assertEqual(cache.get(self.filename), self.metadata)
+
+    def test_stale_mtime(self):
+        stat = os.stat(self.filename)
+        os.utime(self.filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(self.cache.get(self.filename))
+
+    def test_stale_size(self):
+        stat = os.stat(self.filename)
+        with open(self.filename, 'ab') as outfile:
+            outfile.write(b'\0')
+        os.utime(self.filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertIsNone(self.cache.get(self.filename))
+
+    def test_other_version_ignored(self):
+        self.cache.save()
+        with open(self.cache.filename, 'r+', encoding='utf-8') as cachefile:
+            data = cachefile.read().replace('"VERSION": %i' % exif.MetadataCache.VERSION,
+                                            '"VERSION": 0')
+            cachefile.seek(0)
+            cachefile.truncate()
+            cachefile.write(data)
+        cache = exif.MetadataCache.for_directory(self.dirname)
+        self.assertIsNone(cache.get(self.filename))
@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+from quickypano import exif, geometry, project, settings
+
+METADATA = exif.ImageMetadata(width=3456, height=5184, fnumber=(8, 1), exposure_time=(1, 100),
+                              shutter_speed=None, aperture=None, iso=100, exposure_bias=None)
+
+
+def make_project(stack_size=1) -> project.Project:
+    """Returns a project with the LX100 layout: rows of 12, 8 and 8, zenith and nadir."""
+
+    proj = project.Project()
+    proj.settings = settings.SybrenLX100()
+    proj.stack_size = stack_size
+    proj.photos = [project.Image('IMG_%i.jpg' % idx, METADATA) for idx in range(30 * stack_size)]
+    proj.set_variables()
+    return proj
+
+
+class OverlappingPairsTest(unittest.TestCase):
+    def test_middle_row(self):
+        pairs = geometry.overlapping_pairs(make_project(), 0.25)
+        for idx in range(12):
+            self.assertIn(tuple(sorted((idx, (idx + 1) % 12))), pairs)
+        self.assertNotIn((0, 2), pairs)
+        self.assertNotIn((0, 6), pairs)
+
+    def test_zenith_and_nadir(self):
+        pairs = geometry.overlapping_pairs(make_project(), 0.25)
+        zenith = {low for low, high in pairs if high == 28}
+        nadir = {low for low, high in pairs if high == 29}
+
+        self.assertTrue(zenith and zenith <= set(range(12, 20)))
+        self.assertTrue(nadir and nadir <= set(range(20, 28)))
+        self.assertNotIn((28, 29), pairs)
+
+    def test_stack_anchors_only(self):
+        pairs = geometry.overlapping_pairs(make_project(stack_size=3), 0.25)
+        ldr_pairs = geometry.overlapping_pairs(make_project(), 0.25)
+        self.assertEqual(pairs, [(3 * low, 3 * high) for low, high in ldr_pairs])
+
+    def test_min_overlap(self):
+        proj = make_project()
+        self.assertEqual(geometry.overlapping_pairs(proj, 1.01), [])
+        self.assertLess(len(geometry.overlapping_pairs(proj, 0.5)),
+                        len(geometry.overlapping_pairs(proj, 0.25)))
+
+
+class OverlapMatrixTest(unittest.TestCase):
+    def test_symmetric(self):
+        yaw, pitch, roll = [0, 30, 180, 0], [0, 10, 0, 90], [0, 0, 0, 45]
+        overlap = geometry.overlap_matrix(yaw, pitch, roll, [90] * 4, [60] * 4)
+
+        np.testing.assert_allclose(overlap, overlap.T)
+        np.testing.assert_allclose(np.diag(overlap), 1)
+        self.assertEqual(overlap[0, 2], 0)  # back to back
+        self.assertGreater(overlap[0, 1], 0.5)
@@ -0,0 +1,75 @@
+import io
+import os.path
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from quickypano import exif, hugin, project, settings
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+METADATA = exif.ImageMetadata(width=3456, height=5184, fnumber=(8, 1), exposure_time=(1, 100),
+                              shutter_speed=None, aperture=None, iso=100, exposure_bias=None)
+
+
+class TwoStacks(settings.AbstractSettings):
+    ROW_MIDDLE = 2
+    ORDER = ['MIDDLE']
+
+
+def optimizer_section(pto_text: str) -> [str]:
+    """Returns the lines of the optimizer variables section, up to the first blank line."""
+
+    lines = pto_text.splitlines()
+    start = lines.index('# specify variables that should be optimized')
+    end = lines.index('', start)
+    return lines[start:end]
+
+
+class OptimizerLinesTest(unittest.TestCase):
+    def setUp(self):
+        # Two stacks of two photos: 'v' links to the first photo, and the
+        # position of the second photo of a stack to its anchor.
+        self.project = project.Project()
+        self.project.settings = TwoStacks()
+        self.project.stack_size = 2
+        self.project.photos = [project.Image('IMG_%i.jpg' % idx, METADATA) for idx in range(4)]
+        self.project.set_variables()
+
+    def write(self, **kwargs) -> str:
+        outfile = io.StringIO()
+        hugin.write(outfile, self.project, **kwargs)
+        return outfile.getvalue()
+
+    def test_matches_pto_var(self):
+        """Compares with what pto_var --opt y,p,r,v,Eev writes for this project.
+
+        test_real_pto_var() runs pto_var itself, where Hugin is installed.
+        """
+
+        with open(os.path.join(DATA_DIR, 'pto_var_opt.txt'), 'r', encoding='utf-8') as infile:
+            expected = infile.read().splitlines()
+        self.assertEqual(optimizer_section(self.write()), expected)
+
+    def test_links_and_order(self):
+        self.assertEqual(hugin.optimizer_lines(self.project, ('y', 'Eev', 'v')),
+                         ['v Eev0', 'v v0', 'v y0', 'v Eev1', 'v Eev2', 'v y2', 'v Eev3'])
+
+    def test_no_variables(self):
+        self.assertEqual(optimizer_section(self.write(optimize_vars=())),
+                         ['# specify variables that should be optimized', 'v'])
+
+    @unittest.skipUnless(shutil.which('pto_var'), 'Hugin is not installed')
+    def test_real_pto_var(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infname = os.path.join(tmpdir, 'in.pto')
+            outfname = os.path.join(tmpdir, 'out.pto')
+            with open(infname, 'w', encoding='utf-8') as outfile:
+                outfile.write(self.write(optimize_vars=()))
+            subprocess.check_call([shutil.which('pto_var'), infname, '-o', outfname,
+                                   '--opt', ','.join(hugin.OPTIMIZE_VARS)],
+                                  stdout=subprocess.DEVNULL)
+            with open(outfname, 'r', encoding='utf-8') as infile:
+                recorded = optimizer_section(infile.read())
+        self.assertEqual(optimizer_section(self.write()), recorded)
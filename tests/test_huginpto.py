@@ -0,0 +1,135 @@
+import os.path
+import tempfile
+import unittest
+
+import numpy as np
+
+from quickypano import huginpto
+
+PTO = '''# hugin project file
+p f2 w3000 h1500 v360 n"TIFF_m c:LZW"
+m i0
+i w1000 h800 f0 v90 r0 p0 y0 n"a.jpg"
+i w1000 h800 f0 v=0 r0 p0 y120 n"b.jpg"
+i w1000 h800 f0 v=0 r0 p0 y240 n"c.jpg"
+
+# control points
+c n0 N1 x10 y20 X30 Y40 t0
+c n1 N2 x1.5 y2.5 X3.5 Y4.5 t0
+c n0 N1 x11 y21 X31 Y41 t1
+c n2 N0 x5 y6 X7 Y8 t0
+'''
+
+
+class HuginPtoTestCase(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.filename = os.path.join(tmpdir.name, 'project.pto')
+        with open(self.filename, 'w', encoding='utf-8') as outfile:
+            outfile.write(PTO)
+
+
+class ControlPointsTest(HuginPtoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pto = huginpto.HuginPto(self.filename)
+
+    def test_columns(self):
+        cp = self.pto.control_points
+        self.assertEqual(len(cp), 4)
+        self.assertEqual(cp.n.tolist(), [0, 1, 0, 2])
+        self.assertEqual(cp.N.dtype, np.int32)
+        self.assertEqual(cp.x.tolist(), [10.0, 1.5, 11.0, 5.0])
+        self.assertEqual(cp.t.tolist(), [0, 0, 1, 0])
+
+    def test_missing_fields(self):
+        cp = huginpto.ControlPoints.from_parsed([{'n': '0', 'N': '1', 'x': '1', 'y': '2'}])
+        self.assertEqual(cp.t.tolist(), [0])
+        self.assertTrue(np.isnan(cp.X[0]))
+
+    def test_correspondences(self):
+        self.assertEqual(self.pto.get_correspondences(0, 1),
+                         ([[10.0, 20.0], [11.0, 21.0]], [[30.0, 40.0], [31.0, 41.0]]))
+        self.assertEqual(self.pto.get_correspondences(1, 0), ([], []))
+
+    def test_correspondences_ndarray(self):
+        corr1, corr2 = self.pto.get_correspondences_ndarray(0, 1)
+        np.testing.assert_array_equal(corr1, [[10, 11], [20, 21]])
+        np.testing.assert_array_equal(corr2, [[30, 31], [40, 41]])
+
+        # A pair without points has shape (0,), as np.array([]).T used to give.
+        corr1, corr2 = self.pto.get_correspondences_ndarray(0, 2)
+        self.assertEqual((corr1.shape, corr2.shape), ((0,), (0,)))
+
+    def test_available_pairs(self):
+        self.assertEqual(self.pto.get_available_correspondence_pairs(),
+                         [[0, 1], [1, 2], [2, 0]])
+
+    def test_input_files(self):
+        self.assertEqual(self.pto.get_input_files(), ['a.jpg', 'b.jpg', 'c.jpg'])
+
+    def test_pair_index(self):
+        cp = self.pto.control_points
+        self.assertEqual(cp.pairs(), [(0, 1), (1, 2), (2, 0)])
+        self.assertEqual(cp.pair_rows(0, 1).tolist(), [0, 2])
+        self.assertEqual(cp.pair_rows(1, 0).tolist(), [])
+
+    def test_extend_updates_index(self):
+        cp = self.pto.control_points
+        cp.pair_index  # build the index before extending
+        cp.extend(n=[1, 0], N=[0, 1], x=[1, 2], y=[3, 4], X=[5, 6], Y=[7, 8])
+
+        self.assertEqual(cp.pairs(), [(0, 1), (1, 2), (2, 0), (1, 0)])
+        self.assertEqual(cp.pair_rows(0, 1).tolist(), [0, 2, 5])
+        self.assertEqual(cp.pair_rows(1, 0).tolist(), [4])
+        self.assertEqual(cp.t.tolist(), [0, 0, 1, 0, 0, 0])
+
+    def test_add_control_point(self):
+        self.pto.add_control_point(2, 1, 1, 2, 3, 4)
+        self.assertEqual(self.pto.parsed['c'][-1]['n'], '2')
+        self.assertEqual(self.pto.get_correspondences(2, 1), ([[1.0, 2.0]], [[3.0, 4.0]]))
+        self.assertEqual(self.pto.get_available_correspondence_pairs()[-1], [2, 1])
+
+
+class LazyHuginPtoTest(HuginPtoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pto = huginpto.HuginPto(self.filename, lazy=True)
+        self.addCleanup(self.pto.close)
+
+    def test_count_without_parsing(self):
+        self.assertEqual(self.pto.count('i'), 3)
+        self.assertEqual(self.pto.count('c'), 4)
+        self.assertFalse(self.pto.parsed.is_parsed('i'))
+        self.assertFalse(self.pto.parsed.is_parsed('c'))
+
+    def test_get_image(self):
+        self.assertEqual(self.pto.get_image(2)['y'], '240')
+        self.assertFalse(self.pto.parsed.is_parsed('i'))
+
+    def test_same_as_eager(self):
+        eager = huginpto.HuginPto(self.filename)
+        for c in eager.commands:
+            self.assertEqual(self.pto.parsed[c], eager.parsed[c])
+        self.assertEqual(self.pto.get_input_files(), eager.get_input_files())
+        self.assertEqual(self.pto.get_correspondences(0, 1), eager.get_correspondences(0, 1))
+        self.assertEqual(self.pto.count('c'), 4)
+
+    def test_mapping(self):
+        self.assertEqual(len(self.pto.parsed.get('c')), 4)
+        self.assertTrue(self.pto.parsed.is_parsed('c'))
+        self.assertIsNone(self.pto.parsed.get('x'))
+        self.assertIn('i', self.pto.parsed)
+        self.assertFalse(self.pto.parsed.is_parsed('i'))
+
+        eager = huginpto.HuginPto(self.filename)
+        self.assertEqual(dict(self.pto.parsed.items()), eager.parsed)
+        self.assertEqual(self.pto.parsed, eager.parsed)
+
+    def test_empty_file(self):
+        with open(self.filename, 'w'):
+            pass
+        with huginpto.HuginPto(self.filename, lazy=True) as pto:
+            self.assertEqual(pto.count('i'), 0)
+            self.assertEqual(pto.parsed['c'], [])
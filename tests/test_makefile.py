@@ -0,0 +1,107 @@
+import threading
+import time
+import unittest
+
+from quickypano import makefile
+
+MAKEFILE = r'''# makefile for panorama stitching
+NONA=nona
+PREFIX=pano
+LAYERS=$(PREFIX)0000.tif $(PREFIX)0001.tif
+TARGETS=$(PREFIX).tif
+
+.PHONY : all clean
+
+all : $(TARGETS)
+
+clean :
+	rm -f $(LAYERS)
+
+$(PREFIX)0000.tif : a.jpg ; $(NONA) -i 0 -o $@ out.pto
+$(PREFIX)0001.tif : b.jpg
+	$(NONA) -i 1 -o $@ out.pto
+
+$(PREFIX).tif : $(LAYERS)
+	enblend -o $@ -- $^
+'''
+
+
+class MakefileParseTest(unittest.TestCase):
+    def setUp(self):
+        self.makefile = makefile.Makefile()
+        self.makefile.parse_lines(MAKEFILE.splitlines())
+
+    def test_rules(self):
+        self.assertEqual(self.makefile.default_goal, 'all')
+        self.assertEqual(self.makefile.phony, {'all', 'clean'})
+        self.assertEqual(list(self.makefile.rules),
+                         ['all', 'clean', 'pano0000.tif', 'pano0001.tif', 'pano.tif'])
+        self.assertEqual(self.makefile.rules['pano.tif'].prerequisites,
+                         ['pano0000.tif', 'pano0001.tif'])
+        self.assertEqual(self.makefile.rules['all'].prerequisites, ['pano.tif'])
+
+    def test_inline_recipe(self):
+        self.assertEqual(self.makefile.rules['pano0000.tif'].recipe,
+                         ['$(NONA) -i 0 -o $@ out.pto'])
+        self.assertEqual(self.makefile.rules['pano0001.tif'].recipe,
+                         ['$(NONA) -i 1 -o $@ out.pto'])
+
+    def test_variables(self):
+        self.assertEqual(self.makefile.expand('$(NONA) -z LZW'), 'nona -z LZW')
+
+    def test_overrides(self):
+        overridden = makefile.Makefile({'NONA': 'nona -t 4'})
+        overridden.parse_lines(MAKEFILE.splitlines())
+        self.assertEqual(overridden.expand('$(NONA)'), 'nona -t 4')
+
+    def test_conditionals(self):
+        parsed = makefile.Makefile()
+        parsed.parse_lines(['LAYERS=', 'TARGETS=a.tif', 'ifeq ($(words $(LAYERS)),0)',
+                            'TARGETS=', 'endif', 'all : $(TARGETS)'])
+        self.assertEqual(parsed.rules['all'].prerequisites, [])
+
+    def test_unbalanced_conditional(self):
+        with self.assertRaises(makefile.MakefileError):
+            makefile.Makefile().parse_lines(['ifdef NONA', 'A=1'])
+
+    def test_escaped_spaces(self):
+        parsed = makefile.Makefile()
+        parsed.parse_lines([r'PREFIX=my\ pano', r'all : $(PREFIX).tif',
+                            r'$(PREFIX).tif : $(PREFIX)0000.tif a\ b.tif c.tif',
+                            '\tenblend -o $@ -- $^'])
+        self.assertEqual(list(parsed.rules), ['all', 'my pano.tif'])
+        self.assertEqual(parsed.rules['all'].prerequisites, ['my pano.tif'])
+        self.assertEqual(parsed.rules['my pano.tif'].prerequisites,
+                         ['my pano0000.tif', 'a b.tif', 'c.tif'])
+
+
+class RunPlansTest(unittest.TestCase):
+    def executor(self, jobs):
+        parsed = makefile.Makefile()
+        parsed.parse_lines(['.PHONY : all', 'all : t0 t1 t2 t3'] +
+                           ['t%i : ; true' % idx for idx in range(4)])
+        executor = makefile.MakeExecutor(parsed, jobs)
+        executor.running = executor.most_running = 0
+        lock = threading.Lock()
+
+        def run_task(target, commands):
+            with lock:
+                executor.running += 1
+                executor.most_running = max(executor.most_running, executor.running)
+            time.sleep(0.05)
+            with lock:
+                executor.running -= 1
+            return 0.05
+
+        executor._run_task = run_task
+        return executor
+
+    def test_jobs_per_makefile(self):
+        executors = [self.executor(1), self.executor(2)]
+        all_results = makefile.run_plans([executor.prepare() for executor in executors], 4)
+
+        for results in all_results:
+            self.assertEqual(sorted(result.target for result in results),
+                             ['all', 't0', 't1', 't2', 't3'])
+            self.assertTrue(all(result.status == 'ok' for result in results))
+        self.assertEqual([executor.most_running for executor in executors], [1, 2])
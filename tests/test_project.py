@@ -0,0 +1,45 @@
+import unittest
+
+from quickypano import project
+
+
+class ParameterTableResolvedTest(unittest.TestCase):
+    def setUp(self):
+        self.table = project.ParameterTable.defaults(4)
+        self.table.set(0, 'v', 90.0)
+        self.table.set(0, 'w', 1000)
+
+    def test_chained_links(self):
+        self.table.set(1, 'v', '=0')
+        self.table.set(2, 'v', '=1')
+        self.table.set(3, 'w', '=2')
+
+        resolved = self.table.resolved()
+        self.assertEqual([row['v'] for row in resolved.dicts()],
+                         [90.0, 90.0, 90.0, project.DEFAULT_PARAMS['v']])
+        self.assertEqual(resolved.get(3, 'w'), 3456)
+        self.assertTrue((resolved.array['link'] == -1).all())
+        # The table itself keeps its links.
+        self.assertEqual(self.table.get(2, 'v'), '=1')
+
+    def test_is_int_follows_link(self):
+        self.table.set(2, 'w', '=0')
+        self.assertEqual(self.table.resolved().get(2, 'w'), 1000)
+        self.assertIsInstance(self.table.resolved().get(2, 'w'), int)
+
+    def test_rows(self):
+        self.table.set(3, 'v', '=0')
+        resolved = self.table.resolved([3, 1])
+        self.assertEqual(len(resolved), 2)
+        self.assertEqual(resolved.get(0, 'v'), 90.0)
+
+    def test_circular_links(self):
+        self.table.set(1, 'v', '=2')
+        self.table.set(2, 'v', '=1')
+        with self.assertRaises(ValueError):
+            self.table.resolved()
+
+    def test_self_link(self):
+        self.table.set(3, 'y', '=3')
+        with self.assertRaises(ValueError):
+            self.table.resolved()
@@ -0,0 +1,174 @@
+import os.path
+import tempfile
+import unittest
+
+from quickypano import exif, render
+
+PTO = '''# hugin project file
+p f2 w3000 h1500 v360 E0 R0 n"TIFF_m c:LZW"
+m i0
+i w1000 h800 f0 v90 Ra0 Eev12 r0 p0 y0 n"a.jpg"
+#-hugin  cropFactor=1
+i w1000 h800 f0 v=0 Ra0 Eev12 r0 p0 y120 n"b.jpg"
+v y1 p1
+c n0 N1 x10 y20 X30 Y40 t0
+#hugin_outputLDRBlended true
+#hugin_outputImageType tif
+'''
+
+
+class PlanTilesTest(unittest.TestCase):
+    def test_single_tile(self):
+        tiles = render.plan_tiles((0, 100, 0, 50), 4096, 10)
+        self.assertEqual(tiles, [render.Tile(0, 0, (0, 100, 0, 50), (0, 100, 0, 50))])
+
+    def test_exact_multiple(self):
+        tiles = render.plan_tiles((0, 200, 0, 100), 100, 10)
+        self.assertEqual([tile.inner for tile in tiles], [(0, 100, 0, 100), (100, 200, 0, 100)])
+        self.assertEqual([tile.crop for tile in tiles], [(0, 110, 0, 100), (90, 200, 0, 100)])
+
+    def test_partial_last_tile(self):
+        tiles = render.plan_tiles((0, 250, 0, 120), 100, 10)
+        self.assertEqual([(tile.row, tile.column) for tile in tiles],
+                         [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2)])
+        self.assertEqual(tiles[-1].inner, (200, 250, 100, 120))
+        self.assertEqual(tiles[-1].crop, (190, 250, 90, 120))
+
+    def test_offset_region(self):
+        tiles = render.plan_tiles((50, 250, 30, 80), 100, 500)
+        # The margin is clipped to the region, not to the canvas.
+        self.assertEqual([tile.crop for tile in tiles], [(50, 250, 30, 80)] * 2)
+        self.assertEqual([tile.inner for tile in tiles], [(50, 150, 30, 80), (150, 250, 30, 80)])
+
+    def test_inner_regions_cover_region(self):
+        region = (7, 1000, 3, 517)
+        tiles = render.plan_tiles(region, 128, 16)
+        area = sum((right - left) * (bottom - top) for left, right, top, bottom
+                   in (tile.inner for tile in tiles))
+        self.assertEqual(area, (1000 - 7) * (517 - 3))
+
+    def test_empty_region(self):
+        self.assertEqual(render.plan_tiles((0, 0, 0, 0), 100, 10), [])
+
+
+class RenderKeyTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.dirname = tmpdir.name
+        for name in ('a.jpg', 'b.jpg'):
+            with open(os.path.join(self.dirname, name), 'wb') as outfile:
+                outfile.write(name.encode())
+        self.digests = exif.MetadataCache.for_directory(self.dirname)
+
+    def key(self, pto_text, renderer=render.STITCH_RENDERER):
+        pto_filename = os.path.join(self.dirname, 'out.pto')
+        with open(pto_filename, 'w', encoding='utf-8') as outfile:
+            outfile.write(pto_text)
+        return render.render_key(pto_filename, renderer, self.digests)
+
+    def test_comments_do_not_matter(self):
+        changed = PTO.replace('# hugin project file', '# hugin project file, edited') \
+            .replace('v y1 p1', 'v y1') \
+            .replace('c n0 N1 x10 y20 X30 Y40 t0', '') \
+            .replace('#hugin_outputImageType tif', '#hugin_optimizerMasterSwitch 1\n'
+                                                   '#hugin_outputImageType tif')
+        self.assertEqual(self.key(PTO), self.key(changed))
+
+    def test_number_formatting_does_not_matter(self):
+        changed = PTO.replace('v90 ', 'v90.000 ').replace('y120 ', 'y1.2e2 ') \
+            .replace('w3000 h1500', 'h1500   w3000')
+        self.assertEqual(self.key(PTO), self.key(changed))
+
+    def test_parameters_matter(self):
+        self.assertNotEqual(self.key(PTO), self.key(PTO.replace('y120 ', 'y121 ')))
+        self.assertNotEqual(self.key(PTO), self.key(PTO.replace('#hugin_outputImageType tif',
+                                                                '#hugin_outputImageType jpg')))
+
+    def test_image_contents_matter(self):
+        key = self.key(PTO)
+        with open(os.path.join(self.dirname, 'b.jpg'), 'ab') as outfile:
+            outfile.write(b'changed')
+        self.assertNotEqual(key, self.key(PTO))
+
+    def test_renderer_matters(self):
+        keys = {self.key(PTO, render.STITCH_RENDERER),
+                self.key(PTO, render.make_renderer()),
+                self.key(PTO, render.make_renderer(tile_size=4096))}
+        self.assertEqual(len(keys), 3)
+
+
+class ProjectOutputsTest(unittest.TestCase):
+    def test_outputs(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pto_filename = os.path.join(tmpdir, 'out.pto')
+            with open(pto_filename, 'w', encoding='utf-8') as outfile:
+                outfile.write(PTO.replace('LDRBlended true', 'LDRBlended true\n'
+                                          '#hugin_outputLDRExposureBlended true\n'
+                                          '#hugin_outputHDRBlended true\n'
+                                          '#hugin_outputImageTypeHDR exr'))
+            for name in ('out.tif', 'out_hdr.exr', 'out0000.tif'):
+                open(os.path.join(tmpdir, name), 'wb').close()
+
+            # The exposure blended output was not rendered.
+            self.assertEqual(render.project_outputs(pto_filename),
+                             [os.path.join(tmpdir, name) for name in ('out.tif', 'out_hdr.exr')])
+
+
+class RenderCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.dirname = tmpdir.name
+        self.pto_filename = os.path.join(self.dirname, 'out.pto')
+        self.outputs = []
+        for name, size in (('out.tif', 1000), ('out_fused.tif', 500)):
+            output = os.path.join(self.dirname, name)
+            with open(output, 'wb') as outfile:
+                outfile.write(b'x' * size)
+            self.outputs.append(output)
+
+    def restore_elsewhere(self, render_cache, key):
+        other = os.path.join(self.dirname, 'other.pto')
+        return render_cache.restore(other, key)
+
+    def test_store_restore(self):
+        render_cache = render.RenderCache(os.path.join(self.dirname, 'cache'), 2000)
+        render_cache.store(self.pto_filename, 'key', self.outputs)
+
+        outputs = self.restore_elsewhere(render_cache, 'key')
+        self.assertEqual([os.path.basename(output) for output in outputs],
+                         ['other.tif', 'other_fused.tif'])
+        with open(outputs[1], 'rb') as infile:
+            self.assertEqual(infile.read(), b'x' * 500)
+
+    def test_too_large(self):
+        render_cache = render.RenderCache(os.path.join(self.dirname, 'cache'), 1200)
+        render_cache.store(self.pto_filename, 'key', self.outputs)
+        self.assertIsNone(self.restore_elsewhere(render_cache, 'key'))
+        self.assertIsNone(render_cache.cache.get('key'))
+
+    def test_partly_evicted(self):
+        render_cache = render.RenderCache(os.path.join(self.dirname, 'cache'), 2000)
+        render_cache.store(self.pto_filename, 'key', self.outputs)
+        render_cache.cache.remove(render.cache.make_key('key', '_fused.tif'))
+
+        self.assertIsNone(self.restore_elsewhere(render_cache, 'key'))
+        self.assertIsNone(render_cache.cache.get('key'))
+
+    def test_no_outputs(self):
+        render_cache = render.RenderCache(os.path.join(self.dirname, 'cache'), 2000)
+        render_cache.store(self.pto_filename, 'key', [])
+        self.assertIsNone(render_cache.cache.get('key'))
+
+        # An empty manifest from an older version is a miss, too.
+        render_cache.cache.put('key', b'[]')
+        self.assertIsNone(self.restore_elsewhere(render_cache, 'key'))
+        self.assertIsNone(render_cache.cache.get('key'))
+
+    def test_missing_output(self):
+        render_cache = render.RenderCache(os.path.join(self.dirname, 'cache'), 2000)
+        os.unlink(self.outputs[1])
+        render_cache.store(self.pto_filename, 'key', self.outputs)
+        self.assertIsNone(render_cache.cache.get('key'))
+        self.assertIsNone(self.restore_elsewhere(render_cache, 'key'))
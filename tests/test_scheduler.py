@@ -0,0 +1,79 @@
+import threading
+import time
+import unittest
+
+from quickypano import scheduler
+
+
+class ResourceBudgetTest(unittest.TestCase):
+    def acquire_in_thread(self, budget, cores, memory=0) -> threading.Event:
+        acquired = threading.Event()
+
+        def acquire():
+            budget.acquire(cores, memory)
+            acquired.set()
+
+        thread = threading.Thread(target=acquire, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        return acquired
+
+    def test_blocks_until_cores_are_released(self):
+        budget = scheduler.ResourceBudget(cores=4)
+        budget.acquire(3)
+        acquired = self.acquire_in_thread(budget, 2)
+        self.assertFalse(acquired.wait(0.1))
+
+        budget.release(3)
+        self.assertTrue(acquired.wait(5))
+        self.assertEqual(budget.cores_used, 2)
+
+    def test_blocks_until_memory_is_released(self):
+        budget = scheduler.ResourceBudget(cores=8, memory=1000)
+        budget.acquire(1, 600)
+        acquired = self.acquire_in_thread(budget, 1, 600)
+        self.assertFalse(acquired.wait(0.1))
+
+        budget.release(1, 600)
+        self.assertTrue(acquired.wait(5))
+        self.assertEqual((budget.cores_used, budget.memory_used), (1, 600))
+
+    def test_unlimited_memory(self):
+        budget = scheduler.ResourceBudget(cores=2)
+        budget.acquire(1, 2 ** 40)
+        budget.acquire(1, 2 ** 40)
+        self.assertEqual(budget.memory_used, 2 ** 41)
+
+    def test_oversized_task_runs_alone(self):
+        budget = scheduler.ResourceBudget(cores=2, memory=100)
+        with budget.reserve(8, 1000):
+            self.assertEqual(budget.cores_used, 8)
+            acquired = self.acquire_in_thread(budget, 1)
+            self.assertFalse(acquired.wait(0.1))
+        self.assertTrue(acquired.wait(5))
+
+
+class BudgetExecutorTest(unittest.TestCase):
+    def test_stays_within_budget(self):
+        budget = scheduler.ResourceBudget(cores=4)
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def task(cores):
+            with lock:
+                running.append(cores)
+                peak.append(sum(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(cores)
+            return cores
+
+        with scheduler.BudgetExecutor(8, budget) as executor:
+            futures = [executor.submit(task, cores, cores=cores)
+                       for cores in [2, 3, 1, 2, 4, 1] * 2]
+            results = [future.result() for future in futures]
+
+        self.assertEqual(results, [2, 3, 1, 2, 4, 1] * 2)
+        self.assertLessEqual(max(peak), 4)
+        self.assertEqual(budget.cores_used, 0)
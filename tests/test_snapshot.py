@@ -0,0 +1,72 @@
+import json
+import os.path
+import tempfile
+import unittest
+
+from quickypano import exif, project, snapshot
+
+METADATA = exif.ImageMetadata(width=3456, height=5184, fnumber=(8, 1), exposure_time=(1, 100),
+                              shutter_speed=None, aperture=None, iso=100, exposure_bias=None)
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.filename = os.path.join(tmpdir.name, 'project.qpsnap')
+
+        self.project = project.Project()
+        self.project.filename = 'out.pto'
+        self.project.stack_size = 3
+        self.project.photos = [project.Image('jpeg/IMG_%i.jpg' % idx, METADATA)
+                               for idx in range(3)]
+        for idx, photo in enumerate(self.project.photos):
+            photo.digest = 'digest%i' % idx
+        self.project.photos[1].parameters['y'] = 120.5
+        self.project.photos[2].parameters['v'] = '=0'
+        self.project.control_points = ['c n0 N1 x1.5 y2 X3.25 Y4 t0',
+                                       'c n1 N2 x10 y20 X30 Y40 t1']
+
+    def test_round_trip(self):
+        self.project.save(self.filename)
+        loaded = project.Project.load(self.filename)
+
+        self.assertEqual(loaded.filename, 'out.pto')
+        self.assertEqual(loaded.stack_size, 3)
+        self.assertEqual([photo.filename for photo in loaded.photos],
+                         [photo.filename for photo in self.project.photos])
+        self.assertEqual([photo.digest for photo in loaded.photos],
+                         ['digest0', 'digest1', 'digest2'])
+        self.assertEqual([dict(photo.parameters) for photo in loaded.photos],
+                         [dict(photo.parameters) for photo in self.project.photos])
+        self.assertEqual(loaded.photos[2].parameters['v'], '=0')
+        self.assertIsInstance(loaded.photos[0].parameters['w'], int)
+        self.assertEqual(list(loaded.control_points),
+                         ['c n0 N1 x1.5 y2.0 X3.25 Y4.0 t0',
+                          'c n1 N2 x10.0 y20.0 X30.0 Y40.0 t1'])
+
+    def test_no_control_points(self):
+        self.project.control_points = []
+        self.project.save(self.filename)
+        self.assertEqual(list(project.Project.load(self.filename).control_points), [])
+
+    def test_version_check(self):
+        self.project.save(self.filename)
+        with open(self.filename, 'r+b') as snapfile:
+            snapfile.seek(len(snapshot.MAGIC))
+            header_len, = snapshot._header_len.unpack(snapfile.read(snapshot._header_len.size))
+            header = snapfile.read(header_len)
+            old = json.dumps({'version': snapshot.VERSION}, sort_keys=True)[1:-1].encode()
+            new = json.dumps({'version': snapshot.VERSION + 1}, sort_keys=True)[1:-1].encode()
+            self.assertIn(old, header)
+            snapfile.seek(-header_len, os.SEEK_CUR)
+            snapfile.write(header.replace(old, new))
+
+        with self.assertRaisesRegex(ValueError, 'version'):
+            snapshot.load(self.filename)
+
+    def test_not_a_snapshot(self):
+        with open(self.filename, 'w') as outfile:
+            outfile.write('p w100 h50\n')
+        with self.assertRaises(ValueError):
+            snapshot.load(self.filename)
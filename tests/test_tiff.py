@@ -0,0 +1,74 @@
+import os.path
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+from quickypano import tiff
+
+RGB = 2
+
+
+class TiffRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.filename = os.path.join(tmpdir.name, 'image.tif')
+
+    def write(self, pixels, extra_samples=(), rows_per_write=7):
+        height, width, samples = pixels.shape
+        with tiff.TiffWriter(self.filename, width, height, pixels.dtype, samples, RGB,
+                             extra_samples) as writer:
+            for top in range(0, height, rows_per_write):
+                writer.write_rows(pixels[top:top + rows_per_write])
+
+    def assert_round_trip(self, pixels, extra_samples=()):
+        self.write(pixels, extra_samples)
+        with tiff.TiffReader(self.filename) as reader:
+            self.assertEqual((reader.width, reader.height, reader.samples),
+                             (pixels.shape[1], pixels.shape[0], pixels.shape[2]))
+            self.assertEqual(reader.dtype, pixels.dtype)
+            self.assertEqual(reader.photometric, RGB)
+            self.assertEqual(tuple(reader.extra_samples), tuple(extra_samples))
+            np.testing.assert_array_equal(reader.read_rows(0, reader.height, 0, reader.width),
+                                          pixels)
+            np.testing.assert_array_equal(reader.read_rows(5, 40, 3, 11), pixels[5:40, 3:11])
+
+    def test_uint8(self):
+        pixels = np.random.default_rng(1).integers(0, 256, (45, 13, 3), dtype=np.uint8)
+        self.assert_round_trip(pixels)
+
+        with Image.open(self.filename) as image:
+            np.testing.assert_array_equal(np.asarray(image), pixels)
+
+    def test_uint16_with_alpha(self):
+        pixels = np.random.default_rng(2).integers(0, 65536, (45, 13, 4), dtype=np.uint16)
+        self.assert_round_trip(pixels, extra_samples=(2,))
+
+    def test_float32(self):
+        pixels = np.random.default_rng(3).random((45, 13, 3), dtype=np.float32) * 1e4
+        self.assert_round_trip(pixels)
+
+    def test_bigtiff(self):
+        pixels = np.random.default_rng(4).integers(0, 256, (45, 13, 3), dtype=np.uint8)
+        with mock.patch.object(tiff, '_CLASSIC_MAX_SIZE', 100):
+            self.assert_round_trip(pixels)
+
+        with open(self.filename, 'rb') as infile:
+            self.assertEqual(infile.read(4), b'II+\0')
+        with Image.open(self.filename) as image:
+            np.testing.assert_array_equal(np.asarray(image), pixels)
+
+    def test_incomplete(self):
+        pixels = np.zeros((10, 4, 3), dtype=np.uint8)
+        writer = tiff.TiffWriter(self.filename, 4, 20, np.uint8, 3, RGB)
+        writer.write_rows(pixels)
+        with self.assertRaises(tiff.TiffError):
+            writer.close()
+
+    def test_compressed(self):
+        Image.new('RGB', (8, 8)).save(self.filename, compression='tiff_lzw')
+        with self.assertRaisesRegex(tiff.TiffError, 'compressed'):
+            tiff.TiffReader(self.filename)
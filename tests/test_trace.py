@@ -0,0 +1,58 @@
+import json
+import os.path
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from quickypano import trace
+
+
+class CheckCallTest(unittest.TestCase):
+    def setUp(self):
+        trace.start()
+        self.addCleanup(setattr, trace, '_tracer', None)
+
+    def subprocess_events(self) -> [dict]:
+        return [event for event in trace.tracer().events if event.get('cat') == 'subprocess']
+
+    def test_records_child(self):
+        with trace.span('stage'):
+            self.assertEqual(trace.check_call([sys.executable, '-c', 'pass']), 0)
+
+        event, = self.subprocess_events()
+        self.assertEqual(event['ph'], 'X')
+        self.assertEqual(event['args']['returncode'], 0)
+        self.assertIn(sys.executable, event['args']['cmdline'])
+        self.assertGreater(event['args']['pid'], 0)
+
+        stage, = [event for event in trace.tracer().events if event.get('name') == 'stage']
+        # Nested in the stage, on the same track.
+        self.assertEqual(event['tid'], stage['tid'])
+        self.assertGreaterEqual(event['ts'], stage['ts'])
+        self.assertLessEqual(event['ts'] + event['dur'], stage['ts'] + stage['dur'])
+
+    def test_failure(self):
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            trace.check_call([sys.executable, '-c', 'raise SystemExit(3)'])
+        self.assertEqual(context.exception.returncode, 3)
+        self.assertEqual(self.subprocess_events()[0]['args']['returncode'], 3)
+
+    def test_save(self):
+        trace.check_call([sys.executable, '-c', 'pass'])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'trace.json')
+            trace.save(filename)
+            with open(filename, 'r', encoding='utf-8') as infile:
+                data = json.load(infile)
+        self.assertEqual(len([event for event in data['traceEvents']
+                              if event.get('cat') == 'subprocess']), 1)
+
+
+class DisabledTest(unittest.TestCase):
+    def test_no_events(self):
+        self.assertFalse(trace.enabled())
+        with trace.span('stage'):
+            self.assertEqual(trace.check_call([sys.executable, '-c', 'pass']), 0)
+        with self.assertRaises(subprocess.CalledProcessError):
+            trace.check_call([sys.executable, '-c', 'raise SystemExit(1)'])